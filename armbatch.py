@@ -0,0 +1,351 @@
+'''
+armbatch runs many programs through armsim at once, for example all of
+the submissions for an assignment. Each program is run in a fresh
+Machine by one of a pool of worker processes. The workers are started
+once and reused for every job, so the cost of starting python and
+importing armsim is only paid once per worker.
+
+A job is a program plus the text that its stdin should read from (the
+fixture). When a worker gets several jobs for the same program in a
+row (e.g. one program with many fixtures), it only parses the program
+once and restores the machine to its initial state for the other jobs.
+For each job a result is produced with the final value of x0,
+everything the program wrote to stdout, the number of instructions
+executed, any violated rules and the wall time (and, if asked for, an
+estimate of the cycles it would take on a Raspberry Pi 4). A program 
+that raises an error only fails its own job. A program that runs for
+longer than the timeout (or executes more instructions or prints more
+bytes than allowed) is stopped by armsim, which keeps what it printed
+until then. If that doesn't work or a worker dies, the worker is 
+killed and replaced, and the rest of the batch carries on.
+
+Usage:
+    python armbatch.py submissions/ [-i fixture.txt] [-r rules.json] [-j 4] [-t 10] [-m 1000000] [-b 65536] [-e] [-c cache/] [-o results.jsonl]
+    python armbatch.py manifest.jsonl ...
+
+Results are written as one json object per line. See
+documentation/armbatch_guide.md for the details
+'''
+import armsim
+import argparse
+import base64
+import io
+import json
+import multiprocessing
+import multiprocessing.connection
+import os
+import sys
+import time
+
+#Machine settings that can be given in a rules file or a manifest entry
+#forbidden_instructions and recursive_labels are given as lists
+rule_settings = ('forbidden_instructions','forbid_recursion','require_recursion',
+                 'forbid_loops','check_dead_code','recursive_labels')
+
+#the value of each rule setting in a new Machine, used for the settings
+#that a job doesn't give when a machine is reused
+default_rules = {setting:getattr(armsim.Machine(),setting) for setting in rule_settings}
+
+#seconds a worker is given on top of the timeout to stop the program
+#itself before it is killed
+KILL_GRACE = 1.0
+
+'''
+Returns output (bytes) as a string that can be written to json and the
+name of its encoding: the text itself ('utf-8') if the bytes are valid
+utf-8, or their base64 ('base64') if they aren't
+'''
+def encode_output(output:bytes)->tuple:
+    try:
+        return output.decode('utf-8'),'utf-8'
+    except UnicodeDecodeError:
+        return base64.b64encode(output).decode('ascii'),'base64'
+
+'''
+Returns the bytes a program wrote to stdout, from its result (the
+inverse of encode_output())
+'''
+def output_bytes(result:dict)->bytes:
+    if(result.get('stdout_encoding') == 'base64'):
+        return base64.b64decode(result['stdout'])
+    return result['stdout'].encode('utf-8')
+
+'''
+Runs a single job in the current process and returns its result. The
+program reads the job's fixture (see armsim.InputSource). Its output 
+is kept in a BytesIO (see armsim.OutputSink), limited to the job's 
+max_output bytes if it is given, and returned as text if it is valid
+utf-8, or else encoded as base64 so that no bytes are lost (see
+encode_output()). sys.stdin and sys.stdout are not used.
+Errors raised by check_static_rules() and by the recursion checks at
+the end of run() are rule violations, any other error is reported as an
+error of the program. The job's max_steps and time_limit are passed
+on to run(). If the job has a cache directory, the parsed program is
+kept there (see armsim.Machine.parse_cached()). If the job's cycles is
+true, the cycles the program takes are estimated (see Timing Model in
+armsim.py).
+
+The job is run in machine, or in a new Machine if none is given. If
+machine already holds the job's program, it is run again from its
+initial state (see armsim.Machine.restore()) instead of being parsed
+'''
+def run_job(job:dict,machine:armsim.Machine=None)->dict:
+    if(machine is None):
+        machine = armsim.Machine()
+    result = {'id':job['id'], 'program':job['program'], 'status':'ok', 'x0':None,
+              'stdout':'', 'stdout_encoding':'utf-8', 'steps':0, 'cycles':None, 'violations':[], 'error':None, 'time':0.0}
+    machine.timing = armsim.TimingModel() if job.get('cycles') else None
+    machine.stdin = armsim.InputSource(job.get('stdin') or '')
+    output = io.BytesIO()
+    machine.stdout = armsim.OutputSink(output,job.get('max_output'))
+    start = time.perf_counter()
+    try:
+        if(machine.initial_state is None):
+            with open(job['program'],'r') as f:
+                if(job.get('cache')):
+                    machine.parse_cached(f.readlines(),job['cache'])
+                else:
+                    machine.parse(f)
+        else:
+            machine.restore()
+        for setting in rule_settings:
+            value = job.get(setting,default_rules[setting])
+            if(setting in ('forbidden_instructions','recursive_labels')):
+                value = set(value)
+            setattr(machine,setting,value)
+        try:
+            machine.check_static_rules()
+        except (ValueError,AssertionError) as e:
+            result['status'] = 'violation'
+            result['violations'].append(str(e))
+        if(result['status'] == 'ok'):
+            machine.run(job.get('max_steps'),job.get('time_limit'))
+    except armsim.LimitExceeded as e:
+        result['status'] = {'time':'timeout','steps':'step_limit','output':'output_limit'}[e.reason]
+        result['error'] = str(e)
+    except ValueError as e:
+        #the recursion checks run after the program has finished
+        if(machine.asm and machine.pc >= len(machine.asm)):
+            result['status'] = 'violation'
+            result['violations'].append(str(e))
+        else:
+            result['status'] = 'error'
+            result['error'] = "{}: {}".format(type(e).__name__,e)
+    except Exception as e:
+        result['status'] = 'error'
+        result['error'] = "{}: {}".format(type(e).__name__,e)
+    finally:
+        result['time'] = time.perf_counter() - start
+        machine.stdout.flush()
+        result['stdout'],result['stdout_encoding'] = encode_output(output.getvalue())
+    result['x0'] = machine.reg['x0']
+    result['steps'] = machine.steps
+    if(machine.timing):result['cycles'] = machine.timing.cycles
+    return result
+
+'''
+The loop run by each worker process. Jobs are received through conn
+and their results are sent back, until None is received. The machine
+of the last job is kept, and reused if the next job is for the same 
+program and the file hasn't changed since it was parsed
+'''
+def worker(conn):
+    key = None
+    while(True):
+        job = conn.recv()
+        if(job is None):break
+        try:
+            program = (job['program'],os.stat(job['program']).st_mtime_ns)
+        except OSError:
+            program = None
+        if(program is None or program != key):
+            machine = armsim.Machine()
+        result = run_job(job,machine)
+        key = program
+        #a program that didn't parse is parsed again in a new machine
+        if(machine.initial_state is None):
+            key = None
+        conn.send(result)
+    conn.close()
+
+'''
+A worker process together with the end of the pipe used to talk to it
+and the job it is currently running (None when it is idle)
+'''
+class Worker:
+    def __init__(self):
+        self.conn, child = multiprocessing.Pipe()
+        self.process = multiprocessing.Process(target=worker,args=(child,),daemon=True)
+        self.process.start()
+        #the parent doesn't use the child's end of the pipe
+        child.close()
+        self.job = None
+        self.started = 0.0
+        self.deadline = 0.0
+
+    def submit(self,job:dict,timeout:float):
+        self.job = job
+        self.started = time.perf_counter()
+        #the program should stop itself at its time_limit
+        self.deadline = self.started + (job['time_limit'] or timeout) + KILL_GRACE
+        self.conn.send(job)
+
+    def stop(self):
+        try:
+            self.conn.send(None)
+        except (BrokenPipeError,OSError):
+            pass
+        self.process.join(1)
+        if(self.process.is_alive()):self.process.kill()
+        self.conn.close()
+
+    def kill(self):
+        self.process.kill()
+        self.process.join()
+        self.conn.close()
+
+'''
+Result for a job whose worker had to be killed or died while running it.
+Nothing is known about the state of the program in this case
+'''
+def failed_result(job:dict,status:str,error:str,elapsed:float)->dict:
+    return {'id':job['id'], 'program':job['program'], 'status':status, 'x0':None,
+            'stdout':'', 'stdout_encoding':'utf-8', 'steps':None, 'cycles':None, 'violations':[], 'error':error, 'time':elapsed}
+
+'''
+Runs every job in jobs using a pool of worker processes and yields
+the results in the order the jobs finish. workers defaults to the
+number of cpus. A job that runs for longer than timeout seconds is
+stopped and gets the status 'timeout'. Normally armsim stops the
+program itself, but if the worker doesn't answer KILL_GRACE seconds
+later it is killed. If a worker dies the status is 'crash'. Killed
+workers are replaced by a new one. max_steps is the instruction 
+budget and max_output the number of bytes that can be printed by 
+every job that doesn't set its own. If cycles is True, the cycles are
+estimated for every job that doesn't say otherwise
+'''
+def grade(jobs:list, workers:int=None, timeout:float=10.0, max_steps:int=None, max_output:int=None, cycles:bool=False):
+    jobs = [dict({'time_limit':timeout,'max_steps':max_steps,'max_output':max_output,'cycles':cycles},**job) for job in jobs]
+    pending = list(reversed(jobs))
+    count = min(workers or os.cpu_count() or 1, len(jobs))
+    pool = [Worker() for i in range(count)]
+    try:
+        while(pending or any(w.job for w in pool)):
+            for w in pool:
+                if(w.job is None and pending):
+                    w.submit(pending.pop(),timeout)
+            busy = [w for w in pool if w.job]
+            now = time.perf_counter()
+            wait = max(0,min(w.deadline for w in busy) - now)
+            ready = multiprocessing.connection.wait([w.conn for w in busy],wait)
+            now = time.perf_counter()
+            for i,w in enumerate(pool):
+                if(w.job is None):continue
+                elapsed = now - w.started
+                if(w.conn in ready):
+                    try:
+                        result = w.conn.recv()
+                    except (EOFError,OSError):
+                        #the pipe is closed when the worker dies
+                        w.kill()
+                        result = failed_result(w.job,'crash',
+                            "worker exited with code {}".format(w.process.exitcode),elapsed)
+                        pool[i] = Worker()
+                    w.job = None
+                    yield result
+                elif(now >= w.deadline):
+                    result = failed_result(w.job,'timeout',
+                        "worker killed after {:.1f} seconds".format(elapsed),elapsed)
+                    w.kill()
+                    pool[i] = Worker()
+                    yield result
+    finally:
+        for w in pool:
+            if(w.job is None):
+                w.stop()
+            else:
+                w.kill()
+
+'''
+Reads the text of a fixture file. Returns None for no fixture
+'''
+def read_fixture(path:str):
+    if(path is None):return None
+    with open(path,'r') as f:
+        return f.read()
+
+'''
+Builds the list of jobs for a directory or a manifest file.
+
+For a directory, there is one job for every .s file in it. If there is
+a file with the same name ending in .in next to the program, it is
+used as the program's stdin, otherwise the stdin argument is used.
+
+A manifest has one json object per line with the path of the "program"
+and optionally the path of its "stdin" fixture, an "id" and any of the
+rule_settings. Paths are relative to the manifest. A program can be
+listed several times with different fixtures.
+
+rules is a dict of rule_settings that is applied to every job (entries
+in the manifest take precedence)
+'''
+def load_jobs(path:str, stdin:str=None, rules:dict=None)->list:
+    rules = rules or {}
+    jobs = []
+    if(os.path.isdir(path)):
+        for name in sorted(os.listdir(path)):
+            if(not name.endswith('.s')):continue
+            program = os.path.join(path,name)
+            fixture = program[:-2] + '.in'
+            if(not os.path.exists(fixture)):fixture = stdin
+            job = dict(rules)
+            job.update({'id':name, 'program':program, 'stdin':read_fixture(fixture)})
+            jobs.append(job)
+        return jobs
+    base = os.path.dirname(path)
+    with open(path,'r') as f:
+        for number,line in enumerate(f):
+            if(not line.strip()):continue
+            entry = json.loads(line)
+            if('program' not in entry):
+                raise ValueError("manifest line {} has no program".format(number+1))
+            job = dict(rules)
+            job.update(entry)
+            job['program'] = os.path.join(base,entry['program'])
+            fixture = os.path.join(base,entry['stdin']) if entry.get('stdin') else stdin
+            job['stdin'] = read_fixture(fixture)
+            if('id' not in entry):
+                job['id'] = entry['program'] + (' < ' + entry['stdin'] if entry.get('stdin') else '')
+            jobs.append(job)
+    return jobs
+
+def main():
+    parser = argparse.ArgumentParser(description='Run many programs with armsim in parallel')
+    parser.add_argument('path', help='directory of .s files or a manifest (one json object per line)')
+    parser.add_argument('-i','--stdin', help='fixture used as stdin for programs without their own')
+    parser.add_argument('-r','--rules', help='json file with the rules applied to every program')
+    parser.add_argument('-j','--jobs', type=int, default=None, help='number of worker processes (default: number of cpus)')
+    parser.add_argument('-t','--timeout', type=float, default=10.0, help='seconds a program may run for (default: 10)')
+    parser.add_argument('-m','--max-steps', type=int, default=None, help='number of instructions a program may execute (default: no limit)')
+    parser.add_argument('-b','--max-output', type=int, default=None, help='number of bytes a program may print (default: no limit)')
+    parser.add_argument('-e','--cycles', action='store_true', help='estimate the cycles each program takes on a Raspberry Pi 4 (slower)')
+    parser.add_argument('-c','--cache', help='directory to keep parsed programs in, to speed up running them again')
+    parser.add_argument('-o','--output', help='file to write the results to (default: stdout)')
+    args = parser.parse_args()
+    rules = None
+    if(args.rules):
+        with open(args.rules,'r') as f:
+            rules = json.load(f)
+    jobs = load_jobs(args.path,args.stdin,rules)
+    if(args.cache):
+        for job in jobs:job['cache'] = args.cache
+    out = open(args.output,'w') if args.output else sys.stdout
+    try:
+        for result in grade(jobs,args.jobs,args.timeout,args.max_steps,args.max_output,args.cycles):
+            out.write(json.dumps(result) + '\n')
+            out.flush()
+    finally:
+        if(out is not sys.stdout):out.close()
+
+if __name__ == "__main__":
+    main()
@@ -15,7 +15,7 @@ command, here is a more detailed description of their semantics:
 p:
     The program code is scanned and the used registers are extracted
     Each register in this list is printed on a single line with its value
-    followed by another line with the Z and N flags
+    followed by another line with the N, Z, C and V flags
 heap:
     Prints out all elements of the heap contained from the beginning of the heap
     to the program break (set with the brk system call). Info stored outside
@@ -32,7 +32,7 @@ d  <vars>:
     =     : integer value of variable
 n:
     Executes the line displayed above the prompt, increments the program
-    counter, resets xzr to zero, and prints monitored registers, if any
+    counter and prints monitored registers, if any
 mr <regs>:
     This command is to be followed by a list of registers to be monitored.
     Monitored registers are printed out after executing a line or reaching
@@ -107,14 +107,15 @@ def print_regs(reg_list):
         
 def main():
     with open(sys.argv[1],'r') as f:
-        armsim.parse(f.readlines())
+        armsim.parse(f)
+    #also indexes labels and decodes the program (see armsim.load())
     armsim.check_static_rules()
     
     #Aliases for armsim fields (reduce using armsim. everywhere)
     reg = armsim.reg
     asm = armsim.asm
     mem = armsim.mem
-    lab = armsim.label_regex
+    label_index = armsim.label_index
     rg = armsim.register_regex
     var = armsim.var_regex
     cmd = ''
@@ -128,13 +129,13 @@ def main():
     #than having a random order
     used_regs.sort()
     
-    labels = [l for l in asm if(re.match('{}:'.format(lab),l))]
+    labels = list(label_index.keys())
     armsim.label_hit_counts = dict(zip(labels, [0]*len(labels)))
     
     line = asm[armsim.pc]
     #print first line
     #if a label in encountered, inc armsim.pc and skip
-    if(re.match(lab+':',line)):
+    if(line in label_index):
         print("<label {}>".format(line));armsim.pc+=1
         armsim.label_hit_counts[line] += 1
     else:
@@ -143,7 +144,7 @@ def main():
     while(True):
         if(armsim.pc >= len(asm)): print('reached end of program. exiting...');break  
         #if a label in encountered, inc armsim.pc and skip
-        if(re.match(lab+':',line)):
+        if(line in label_index):
             armsim.pc+=1;line = asm[armsim.pc];continue 
         cmd = input('(armdb) ').lower().strip()
         if(not cmd and prevcmd):
@@ -152,7 +153,7 @@ def main():
         #command switch statement
         if(cmd == 'p'):
             print_regs(used_regs)    
-            print("Z: {} N: {}".format(armsim.z_flag,armsim.n_flag))
+            print("N: {} Z: {} C: {} V: {}".format(armsim.n_flag,armsim.z_flag,armsim.c_flag,armsim.v_flag))
         elif(cmd.startswith('stk')):
             numList = re.findall('[0-9]+',cmd)
             print("SP: {}".format(hex((reg['sp']))))
@@ -160,23 +161,22 @@ def main():
             if(numList):
                 #should only be 1 element in numList
                 num = int(numList[0])
-                #stack elements are stored as a list of bytes
                 for i in range(0, num*8,8):
                     #remember stack goes down, so move up
                     addr = reg['sp']+i
-                    #convert list of 8 bytes to value
-                    value = int.from_bytes(bytes(mem[addr:addr+8]),'little')
+                    #read the 8 bytes at addr as a value
+                    value = mem.load_quad(addr)
                     print("<sp+{}>  {}".format(i,hex(value)))
             #print top 10
             else:
                 for i in range(0,80,8):
                     addr = reg['sp']+i
-                    value = int.from_bytes(bytes(mem[addr:addr+8]),'little')
+                    value = mem.load_quad(addr)
                     print("<sp+{}>  {}".format(i,hex(value)))
         elif(cmd == 'heap'):
             offset = armsim.brk
-            for addr in range(armsim.data_pointer,armsim.brk,8):
-                value = int.from_bytes(bytes(mem[addr:addr+8]),'little')
+            for addr in range(armsim.original_break,armsim.brk,8):
+                value = mem.load_quad(addr)
                 print("<brk-{}>  {}".format(offset,hex(value)))
                 offset -= 8
         elif(cmd.startswith('d ')):
@@ -187,9 +187,9 @@ def main():
             else:
                 print("no labels specified")
         elif(cmd == 'n'):
-            armsim.execute(line)
-            armsim.pc+=1
-            reg['xzr'] = 0
+            #executes the line and increments the pc (xzr stays zero, since
+            #writes to it go to a register that is never read)
+            armsim.step()
             #if program has ended we can print monitors and msg
             if(armsim.pc >= len(asm)):
                 print_regs(monitors)
@@ -213,7 +213,7 @@ def main():
             for bp in bps: 
                 if(int(bp) not in range(0,len(asm))):
                     print("breakpoint {} out of range".format(bp))
-                elif(re.match(lab+':',asm[int(bp)])):
+                elif(asm[int(bp)] in label_index):
                         print("cannot use label as breakpoint")    
                 else:
                     breakpoints.add(int(bp))
@@ -233,7 +233,7 @@ def main():
                 while(armsim.pc < len(asm)):
                     #if a label in encountered, inc armsim.pc and skip
                     line = asm[armsim.pc]
-                    if(re.match(lab+':',line)):
+                    if(line in label_index):
                         armsim.label_hit_counts[line] += 1
                         armsim.pc+=1;continue
                     #without the came_from_bp flag, the c command will
@@ -243,10 +243,8 @@ def main():
                         print_regs(monitors)
                         came_from_bp = True
                         break
-                    armsim.execute(line)
-                    armsim.pc+=1
+                    armsim.step()
                     came_from_bp = False
-                    reg['xzr'] = 0
                 #if program has ended we can print monitors and msg
                 if(armsim.pc >= len(asm)):
                     print_regs(monitors) 
@@ -0,0 +1,617 @@
+'''
+armlanes runs one program on many inputs at once, for example to check
+a submission for collatz.s against thousands of different numbers.
+Instead of running a Machine once per input, every register is a numpy
+array with one element (a lane) per input, and memory is a 2-D array
+with one row of bytes per lane. Each decoded instruction is executed
+for all of the lanes that are at it with a handful of numpy operations,
+so the cost of interpreting an instruction is paid once for the whole
+group of lanes instead of once per input.
+
+Lanes can take different branches. Every lane has its own pc, and on
+each step the instruction that the most lanes are waiting at is run for
+exactly those lanes (the active lanes). The other lanes wait until the
+group catches up to them, or until they are the biggest group
+themselves. A lane drops out when it exits, when it raises an error
+(which only fails that lane) or when it runs out of its instruction
+budget. System calls are done one lane at a time, since every lane has
+its own stdin and stdout.
+
+Every lane has its own copy of memory, except for the part of the
+stack that is more than stack_size bytes below its top. Since armsim's
+stack is megabytes big but programs only use a little of it, lanes
+only keep the top of it, and going further down fails the lane. The
+same goes for the heap: memory is one array, so when one lane moves its
+break up (brk) every lane's row is widened to match. To keep this from
+taking HEAP_SIZE bytes per lane, a lane can only grow its heap to 
+heap_size bytes, and a lane that asks for more stops with the status
+'memory_limit'.
+
+numpy is only needed for armlanes, armsim itself does not use it.
+
+Usage:
+    machine = armsim.Machine()
+    with open('collatz.s','r') as f:
+        machine.parse(f)
+    lanes = Lanes(machine,['{}\\n'.format(n) for n in range(1,1001)])
+    lanes.run(max_steps=100000)
+    for result in lanes.results():
+        print(result['x0'])
+
+    python armlanes.py collatz.s -i numbers.txt [-m 100000] [-o results.jsonl]
+'''
+import armsim
+from armsim import SP, LR, XZR, REGISTER_COUNT, STACK_SIZE, HEAP_SIZE
+import argparse
+import json
+import os
+import sys
+import numpy as np
+
+#conditions in terms of arrays of flags, like armsim.condition_flags
+lane_conditions = {
+    'eq':lambda n,z,c,v: z,          'ne':lambda n,z,c,v: ~z,
+    'hs':lambda n,z,c,v: c,          'lo':lambda n,z,c,v: ~c,
+    'mi':lambda n,z,c,v: n,          'pl':lambda n,z,c,v: ~n,
+    'vs':lambda n,z,c,v: v,          'vc':lambda n,z,c,v: ~v,
+    'hi':lambda n,z,c,v: c & ~z,     'ls':lambda n,z,c,v: ~c | z,
+    'ge':lambda n,z,c,v: n == v,     'lt':lambda n,z,c,v: n != v,
+    'gt':lambda n,z,c,v: ~z & (n == v),
+    'le':lambda n,z,c,v: z | (n != v),
+}
+lane_conditions['cs'] = lane_conditions['hs']
+lane_conditions['cc'] = lane_conditions['lo']
+
+#bytes at the top of the stack that each lane has its own copy of
+LANE_STACK_SIZE = 0x10000
+#bytes of heap (see brk) that each lane can allocate
+LANE_HEAP_SIZE = 0x100000
+
+#offsets of the bytes of a quad and a pair from their address
+quad_bytes = np.arange(8)
+pair_bytes = np.arange(16)
+
+'''
+Returns the unsigned view of an array of registers
+'''
+def unsigned(values):
+    return values.view(np.uint64)
+
+'''
+The state of a program running on many inputs. machine must have been
+given the program with parse(). Its registers, flags and memory are
+the starting point of every lane, and its rule settings are checked
+like run() does. stdins has the input of each lane (a str, bytes or
+anything else armsim.InputSource takes), one lane is created per 
+entry. stack_size is how much of the top of the stack the lanes can
+use and heap_size how much heap each lane can allocate with brk
+'''
+class Lanes:
+    def __init__(self, machine:armsim.Machine, stdins:list, stack_size:int=LANE_STACK_SIZE, heap_size:int=LANE_HEAP_SIZE):
+        machine.check_static_rules()
+        self.machine = machine
+        self.program = machine.program
+        count = len(stdins)
+        self.count = count
+        #registers[n] holds register n of every lane (see the Register
+        #File in armsim). Writes to xzr go to a row that is never read
+        self.registers = np.tile(np.array(machine.registers,dtype=np.int64)[:,None],(1,count))
+        #flags as one array per flag. Unlike armsim they are worked out
+        #eagerly, since different lanes may have different kinds
+        n,z,c,v = armsim.nzcv(machine.flags)
+        self.n = np.full(count,n);self.z = np.full(count,z)
+        self.c = np.full(count,c);self.v = np.full(count,v)
+        #mem[i] is the memory of lane i from address base onwards. end[i]
+        #is the end of the memory of lane i, which can be before the end 
+        #of mem after brk
+        self.base = max(0,STACK_SIZE - stack_size)
+        memory = machine.mem.read(self.base,len(machine.mem) - self.base)
+        self.mem = np.tile(np.frombuffer(memory,dtype=np.uint8),(count,1))
+        self.end = np.full(count,len(machine.mem),dtype=np.int64)
+        self.original_break = machine.original_break
+        self.heap_size = heap_size
+        self.brk = np.full(count,machine.brk,dtype=np.int64)
+        self.pc = np.full(count,machine.pc,dtype=np.int64)
+        self.steps = np.zeros(count,dtype=np.int64)
+        #lanes that haven't exited, failed or run out of steps
+        self.running = np.ones(count,dtype=bool)
+        self.status = ['ok']*count
+        self.errors = [None]*count
+        self.stdin = [armsim.InputSource(text or '') for text in stdins]
+        self.output = [[] for i in range(count)]
+        labels = list(machine.label_index.keys())
+        self.label_hit_counts = {label:np.zeros(count,dtype=np.int64) for label in labels}
+        #label (without colon) to the lanes where it was called recursively
+        self.recursed_labels = {}
+        self.handlers = {
+            'ldp':self.op_ldp, 'ldp_pre':self.op_ldp_pre, 'ldp_post':self.op_ldp_post,
+            'stp':self.op_stp, 'stp_pre':self.op_stp_pre, 'stp_post':self.op_stp_post,
+            'ldr_sym':self.op_mov_imm, 'ldr':self.op_ldr, 'ldr_reg':self.op_ldr_reg, 'ldr_pre':self.op_ldr_pre, 'ldr_post':self.op_ldr_post,
+            'str':self.op_str, 'str_reg':self.op_str_reg, 'str_pre':self.op_str_pre, 'str_post':self.op_str_post,
+            'mov_imm':self.op_mov_imm, 'mov_reg':self.op_mov_reg,
+            'asr':self.op_asr, 'lsl':self.op_lsl, 'lsr':self.op_lsr,
+            'add_imm':self.op_add_imm, 'add_reg':self.op_add_reg, 'sub_imm':self.op_sub_imm, 'sub_reg':self.op_sub_reg,
+            'mul':self.op_mul, 'udiv':self.op_udiv, 'sdiv':self.op_sdiv, 'msub':self.op_msub, 'madd':self.op_madd,
+            'cmp_reg':self.op_cmp_reg, 'cmp_imm':self.op_cmp_imm,
+            'and_imm':self.op_and_imm, 'and_reg':self.op_and_reg, 'orr_imm':self.op_orr_imm, 'orr_reg':self.op_orr_reg, 'eor_imm':self.op_eor_imm,
+            'cbnz':self.op_cbnz, 'cbz':self.op_cbz, 'b':self.op_b,
+            'csel':self.op_csel, 'csinc':self.op_csinc, 'cset':self.op_cset,
+            'bl':self.op_bl, 'ret':self.op_ret, 'svc':self.op_svc,
+            'label':self.op_label, 'invalid':self.op_invalid
+        }
+        for cond in armsim.branch_conditions:
+            self.handlers['b.'+cond] = self.op_b_cond(cond)
+        #(handler, operands) for every instruction, like Machine.code
+        self.code = []
+        for instr in self.program:
+            handler = self.handlers[instr[0]]
+            if(instr[0] not in armsim.block_exits and instr[0] not in armsim.block_branches):
+                if(SP in armsim.block_writes(instr)):
+                    handler = self.checked(handler)
+            self.code.append((handler,instr[1:]))
+
+    '''
+    Returns the values of a register (by name) in every lane. The array
+    is a view, so writing to it sets the register, for example to give
+    every lane a different argument before run()
+    '''
+    def register(self,name:str):
+        return self.registers[armsim.register_number[name]]
+
+    '''
+    Stops the given lanes because of an error. Like in armsim, the pc
+    stays at the instruction that failed and it isn't counted as a step.
+    status is 'error', or the limit the lanes ran into (the error is 
+    then only its message)
+    '''
+    def fail(self,lanes,error:Exception,status:str='error'):
+        for lane in lanes:
+            self.status[lane] = status
+            self.errors[lane] = "{}: {}".format(type(error).__name__,error) if status == 'error' else str(error)
+        self.running[lanes] = False
+        self.pc[lanes] = self.group_pc
+        self.steps[lanes] -= 1
+
+    '''
+    Runs the active lanes until every lane has stopped. max_steps is the
+    instruction budget of each lane, a lane that uses it up stops with
+    the status 'step_limit'
+    '''
+    def run(self, max_steps:int=None):
+        end = len(self.program)
+        self.running &= self.pc < end
+        with np.errstate(all='ignore'):
+            while(True):
+                pcs = self.pc[self.running]
+                if(not len(pcs)):break
+                #run the instruction that the most lanes are waiting at
+                self.group_pc = int(np.bincount(pcs).argmax())
+                active = np.flatnonzero(self.running & (self.pc == self.group_pc))
+                self.pc[active] += 1
+                self.steps[active] += 1
+                handler, operands = self.code[self.group_pc]
+                handler(active,*operands)
+                self.running[active] &= self.pc[active] < end
+                if(max_steps is not None):
+                    spent = active[self.running[active] & (self.steps[active] >= max_steps)]
+                    for lane in spent:
+                        self.status[lane] = 'step_limit'
+                        self.errors[lane] = "instruction limit of {} reached".format(max_steps)
+                    self.running[spent] = False
+
+    '''
+    Returns a list with a result for every lane, with the same fields as
+    the results of armbatch: the status ('ok', 'violation', 'error',
+    'step_limit' or 'memory_limit'), x0, stdout, steps, violations and error. The
+    recursion rules of the machine are checked for each lane that
+    finished, like at the end of run()
+    '''
+    def results(self)->list:
+        machine = self.machine
+        results = []
+        for lane in range(0,self.count):
+            result = {'lane':lane, 'status':self.status[lane], 'x0':int(self.registers[0,lane]),
+                      'stdout':b''.join(self.output[lane]).decode('utf-8','replace'), 'steps':int(self.steps[lane]),
+                      'violations':[], 'error':self.errors[lane]}
+            if(result['status'] == 'ok'):
+                recursed = {label for label,lanes in self.recursed_labels.items() if lanes[lane]}
+                violation = None
+                if(recursed and machine.forbid_recursion):
+                    violation = "recursion occurred in program but it should not have"
+                elif(not recursed and machine.require_recursion):
+                    violation = "recursion did not occur in program but it should have"
+                elif(recursed and machine.recursive_labels - recursed):
+                    violation = "recursive calls do not include required call to {}".format(machine.recursive_labels)
+                if(violation):
+                    result['status'] = 'violation'
+                    result['violations'].append(violation)
+            results.append(result)
+        return results
+
+    '''
+    Memory access. Lanes whose address is out of bounds fail, the others
+    are returned with their addresses
+    '''
+    def check_access(self,lanes,addr,size:int,line:str):
+        bad = (addr < self.registers[SP,lanes]) | (addr > self.end[lanes] - size) | (addr < self.base)
+        if(bad.any()):
+            self.fail(lanes[bad],ValueError("out of bounds memory access: {}".format(line)))
+            return lanes[~bad],addr[~bad]
+        return lanes,addr
+    #the quads stored at addr in each lane, as a (lanes, count) array
+    def load(self,lanes,addr,offsets):
+        data = self.mem[lanes[:,None],addr[:,None] - self.base + offsets]
+        return data.view('<i8')
+    def store(self,lanes,addr,offsets,*values):
+        data = np.stack(values,axis=1).astype('<i8').view(np.uint8)
+        self.mem[lanes[:,None],addr[:,None] - self.base + offsets] = data
+    #post index writeback can't leave a pointer outside of memory
+    def check_pointer(self,lanes,rn):
+        value = self.registers[rn,lanes]
+        bad = (value > self.end[lanes]) & (value < self.registers[SP,lanes])
+        for lane in lanes[bad]:
+            self.fail([lane],ValueError("register {} points to out of bounds memory".format(self.registers[rn,lane])))
+    #like Machine.checked(), for instructions that write sp
+    def checked(self,handler):
+        def run(lanes,*operands):
+            handler(lanes,*operands)
+            lanes = lanes[self.running[lanes]]
+            sp = self.registers[SP,lanes]
+            for bad,message in ((sp < self.base,"stack overflow"),
+                                (sp > STACK_SIZE,"stack underflow (make sure to allocate space)"),
+                                ((sp + 1) % 16 != 0,"Alignment error: sp must be a multiple of 16")):
+                if(bad.any()):
+                    self.fail(lanes[bad],ValueError(message))
+                    lanes = lanes[self.running[lanes]]
+                    sp = self.registers[SP,lanes]
+        return run
+
+    '''
+    Sets the flags of the given lanes after adding or subtracting a and
+    b (see armsim.nzcv())
+    '''
+    def set_flags(self,lanes,a,b,result,kind:str):
+        self.n[lanes] = result < 0
+        self.z[lanes] = result == 0
+        if(kind == 'add'):
+            self.c[lanes] = unsigned(result) < unsigned(a)
+            self.v[lanes] = ((a ^ result) & (b ^ result)) < 0
+        else:
+            self.c[lanes] = unsigned(a) >= unsigned(b)
+            self.v[lanes] = ((a ^ b) & (a ^ result)) < 0
+    #flags of a logical instruction
+    def set_logic_flags(self,lanes,result):
+        self.n[lanes] = result < 0
+        self.z[lanes] = result == 0
+        self.c[lanes] = False
+        self.v[lanes] = False
+    #the lanes where a condition holds
+    def condition(self,lanes,cond:str):
+        return lane_conditions[cond](self.n[lanes],self.z[lanes],self.c[lanes],self.v[lanes])
+
+    '''
+    Instruction handlers. Each one takes the active lanes (an array of
+    lane numbers) followed by the same operands as the handler in
+    armsim, and updates those lanes. The pc of the active lanes has
+    already been moved on to the next instruction
+    '''
+    #ldp rt, rt2, [rn, imm]
+    def op_ldp(self,lanes,rt,rt2,rn,imm,line):
+        lanes,addr = self.check_access(lanes,self.registers[rn,lanes] + imm,16,line)
+        data = self.load(lanes,addr,pair_bytes)
+        self.registers[rt,lanes] = data[:,0]
+        self.registers[rt2,lanes] = data[:,1]
+    #ldp rt, rt2, [rn, imm]! //pre index
+    def op_ldp_pre(self,lanes,rt,rt2,rn,imm,line):
+        self.registers[rn,lanes] += imm
+        self.op_ldp(lanes,rt,rt2,rn,0,line)
+    #ldp rt, rt2, [rn], imm //post index
+    def op_ldp_post(self,lanes,rt,rt2,rn,imm,line):
+        self.op_ldp(lanes,rt,rt2,rn,0,line)
+        lanes = lanes[self.running[lanes]]
+        self.registers[rn,lanes] += imm
+        self.check_pointer(lanes,rn)
+    #stp rt, rt2, [rn, imm]
+    def op_stp(self,lanes,rt,rt2,rn,imm,line):
+        lanes,addr = self.check_access(lanes,self.registers[rn,lanes] + imm,16,line)
+        self.store(lanes,addr,pair_bytes,self.registers[rt,lanes],self.registers[rt2,lanes])
+    #stp rt, rt2, [rn, imm]! //pre index
+    def op_stp_pre(self,lanes,rt,rt2,rn,imm,line):
+        self.registers[rn,lanes] += imm
+        self.op_stp(lanes,rt,rt2,rn,0,line)
+    #stp rt, rt2, [rn], imm //post index
+    def op_stp_post(self,lanes,rt,rt2,rn,imm,line):
+        self.op_stp(lanes,rt,rt2,rn,0,line)
+        lanes = lanes[self.running[lanes]]
+        self.registers[rn,lanes] += imm
+        self.check_pointer(lanes,rn)
+    #ldr rt, [rn, imm]
+    def op_ldr(self,lanes,rt,rn,imm,line):
+        lanes,addr = self.check_access(lanes,self.registers[rn,lanes] + imm,8,line)
+        self.registers[rt,lanes] = self.load(lanes,addr,quad_bytes)[:,0]
+    #ldr rt, [rn, rm]
+    def op_ldr_reg(self,lanes,rt,rn,rm,line):
+        lanes,addr = self.check_access(lanes,self.registers[rn,lanes] + self.registers[rm,lanes],8,line)
+        self.registers[rt,lanes] = self.load(lanes,addr,quad_bytes)[:,0]
+    #ldr rt, [rn, imm]! //pre index
+    def op_ldr_pre(self,lanes,rt,rn,imm,line):
+        self.registers[rn,lanes] += imm
+        self.op_ldr(lanes,rt,rn,0,line)
+    #ldr rt, [rn], imm //post index
+    def op_ldr_post(self,lanes,rt,rn,imm,line):
+        self.op_ldr(lanes,rt,rn,0,line)
+        lanes = lanes[self.running[lanes]]
+        self.registers[rn,lanes] += imm
+        self.check_pointer(lanes,rn)
+    #str rt, [rn, imm]
+    def op_str(self,lanes,rt,rn,imm,line):
+        lanes,addr = self.check_access(lanes,self.registers[rn,lanes] + imm,8,line)
+        self.store(lanes,addr,quad_bytes,self.registers[rt,lanes])
+    #str rt, [rn, rm]
+    def op_str_reg(self,lanes,rt,rn,rm,line):
+        lanes,addr = self.check_access(lanes,self.registers[rn,lanes] + self.registers[rm,lanes],8,line)
+        self.store(lanes,addr,quad_bytes,self.registers[rt,lanes])
+    #str rt, [rn, imm]! //pre index
+    def op_str_pre(self,lanes,rt,rn,imm,line):
+        self.registers[rn,lanes] += imm
+        self.op_str(lanes,rt,rn,0,line)
+    #str rt, [rn], imm //post index
+    def op_str_post(self,lanes,rt,rn,imm,line):
+        self.op_str(lanes,rt,rn,0,line)
+        lanes = lanes[self.running[lanes]]
+        self.registers[rn,lanes] += imm
+        self.check_pointer(lanes,rn)
+    #mov rd, imm (and ldr rt, =<var>)
+    def op_mov_imm(self,lanes,rd,imm):
+        self.registers[rd,lanes] = imm
+    #mov rd, rn
+    def op_mov_reg(self,lanes,rd,rn):
+        self.registers[rd,lanes] = self.registers[rn,lanes]
+    #asr rd, rn, imm
+    def op_asr(self,lanes,rd,rn,imm):
+        self.registers[rd,lanes] = self.registers[rn,lanes] >> imm
+    #lsl rd, rn, imm
+    def op_lsl(self,lanes,rd,rn,imm):
+        self.registers[rd,lanes] = self.registers[rn,lanes] << imm
+    #lsr rd, rn, imm
+    def op_lsr(self,lanes,rd,rn,imm):
+        self.registers[rd,lanes] = (unsigned(self.registers[rn,lanes]) >> np.uint64(imm)).view(np.int64)
+    #add{s} rd, rn, imm
+    def op_add_imm(self,lanes,rd,rn,imm,s):
+        a = self.registers[rn,lanes]
+        result = a + imm
+        if(s):self.set_flags(lanes,a,np.int64(imm),result,'add')
+        self.registers[rd,lanes] = result
+    #add{s} rd, rn, rm
+    def op_add_reg(self,lanes,rd,rn,rm,s):
+        a = self.registers[rn,lanes]
+        b = self.registers[rm,lanes]
+        result = a + b
+        if(s):self.set_flags(lanes,a,b,result,'add')
+        self.registers[rd,lanes] = result
+    #sub{s} rd, rn, imm
+    def op_sub_imm(self,lanes,rd,rn,imm,s):
+        a = self.registers[rn,lanes]
+        result = a - imm
+        if(s):self.set_flags(lanes,a,np.int64(imm),result,'sub')
+        self.registers[rd,lanes] = result
+    #sub{s} rd, rn, rm
+    def op_sub_reg(self,lanes,rd,rn,rm,s):
+        a = self.registers[rn,lanes]
+        b = self.registers[rm,lanes]
+        result = a - b
+        if(s):self.set_flags(lanes,a,b,result,'sub')
+        self.registers[rd,lanes] = result
+    #mul rd, rn, rm
+    def op_mul(self,lanes,rd,rn,rm):
+        self.registers[rd,lanes] = self.registers[rn,lanes] * self.registers[rm,lanes]
+    #lanes that divide by zero fail like they do in armsim
+    def divisors(self,lanes,rn,rm):
+        b = self.registers[rm,lanes]
+        zero = b == 0
+        if(zero.any()):
+            self.fail(lanes[zero],ZeroDivisionError("integer division or modulo by zero"))
+            lanes = lanes[~zero]
+            b = b[~zero]
+        return lanes,self.registers[rn,lanes],b
+    #udiv rd, rn, rm
+    def op_udiv(self,lanes,rd,rn,rm):
+        lanes,a,b = self.divisors(lanes,rn,rm)
+        self.registers[rd,lanes] = (unsigned(a) // unsigned(b)).view(np.int64)
+    #sdiv rd, rn, rm (rounds towards zero)
+    def op_sdiv(self,lanes,rd,rn,rm):
+        lanes,a,b = self.divisors(lanes,rn,rm)
+        quotient = a // b
+        quotient += (quotient * b != a) & ((a < 0) != (b < 0))
+        self.registers[rd,lanes] = quotient
+    #msub rd, rn, rm, ra
+    def op_msub(self,lanes,rd,rn,rm,ra):
+        self.registers[rd,lanes] = self.registers[ra,lanes] - self.registers[rn,lanes] * self.registers[rm,lanes]
+    #madd rd, rn, rm, ra
+    def op_madd(self,lanes,rd,rn,rm,ra):
+        self.registers[rd,lanes] = self.registers[ra,lanes] + self.registers[rn,lanes] * self.registers[rm,lanes]
+    #cmp rn, rm
+    def op_cmp_reg(self,lanes,rn,rm):
+        a = self.registers[rn,lanes]
+        b = self.registers[rm,lanes]
+        self.set_flags(lanes,a,b,a - b,'sub')
+    #cmp rn, imm
+    def op_cmp_imm(self,lanes,rn,imm):
+        a = self.registers[rn,lanes]
+        self.set_flags(lanes,a,np.int64(imm),a - imm,'sub')
+    #csel rd, rn, rm, <cond>
+    def op_csel(self,lanes,rd,rn,rm,cond):
+        self.registers[rd,lanes] = np.where(self.condition(lanes,cond),self.registers[rn,lanes],self.registers[rm,lanes])
+    #csinc rd, rn, rm, <cond>
+    def op_csinc(self,lanes,rd,rn,rm,cond):
+        self.registers[rd,lanes] = np.where(self.condition(lanes,cond),self.registers[rn,lanes],self.registers[rm,lanes] + 1)
+    #cset rd, <cond>
+    def op_cset(self,lanes,rd,cond):
+        self.registers[rd,lanes] = self.condition(lanes,cond)
+    #and{s} rd, rn, imm
+    def op_and_imm(self,lanes,rd,rn,imm,s):
+        result = self.registers[rn,lanes] & imm
+        if(s):self.set_logic_flags(lanes,result)
+        self.registers[rd,lanes] = result
+    #and{s} rd, rn, rm
+    def op_and_reg(self,lanes,rd,rn,rm,s):
+        result = self.registers[rn,lanes] & self.registers[rm,lanes]
+        if(s):self.set_logic_flags(lanes,result)
+        self.registers[rd,lanes] = result
+    #orr{s} rd, rn, imm
+    def op_orr_imm(self,lanes,rd,rn,imm,s):
+        result = self.registers[rn,lanes] | imm
+        if(s):self.set_logic_flags(lanes,result)
+        self.registers[rd,lanes] = result
+    #orr{s} rd, rn, rm
+    def op_orr_reg(self,lanes,rd,rn,rm,s):
+        result = self.registers[rn,lanes] | self.registers[rm,lanes]
+        if(s):self.set_logic_flags(lanes,result)
+        self.registers[rd,lanes] = result
+    #eor{s} rd, rn, imm
+    def op_eor_imm(self,lanes,rd,rn,imm,s):
+        result = self.registers[rn,lanes] ^ imm
+        if(s):self.set_logic_flags(lanes,result)
+        self.registers[rd,lanes] = result
+    #branches go to the instruction after the label, like in armsim
+    def branch(self,lanes,taken,target:int):
+        self.pc[lanes[taken]] = target + 1
+    #cbnz rn,<label>
+    def op_cbnz(self,lanes,rn,target):
+        self.branch(lanes,self.registers[rn,lanes] != 0,target)
+    #cbz rn, <label>
+    def op_cbz(self,lanes,rn,target):
+        self.branch(lanes,self.registers[rn,lanes] == 0,target)
+    #b <label>
+    def op_b(self,lanes,target):
+        self.pc[lanes] = target + 1
+    #b.<cond> <label>
+    def op_b_cond(self,cond):
+        def branch(lanes,target):
+            self.branch(lanes,self.condition(lanes,cond),target)
+        return branch
+    #bl <label>
+    def op_bl(self,lanes,label,target):
+        if(label in self.machine.linked_labels):
+            self.fail(lanes,ValueError("{} is a linked label, which can't be called by armlanes".format(label[:-1])))
+            return
+        if(target is None):
+            self.fail(lanes,ValueError("{} is not a label in the program".format(label[:-1])))
+            return
+        #recursion is detected the same way as in armsim
+        recursed = self.registers[LR,lanes] == self.group_pc
+        if(recursed.any()):
+            if(label[:-1] not in self.recursed_labels):
+                self.recursed_labels[label[:-1]] = np.zeros(self.count,dtype=bool)
+            self.recursed_labels[label[:-1]][lanes[recursed]] = True
+        self.registers[LR,lanes] = self.group_pc
+        if(label in self.label_hit_counts):
+            self.label_hit_counts[label][lanes] += 1
+        self.pc[lanes] = target + 1
+    #ret
+    def op_ret(self,lanes):
+        addr = self.registers[LR,lanes]
+        bad = (addr < 0) | (addr >= len(self.program))
+        for lane in lanes[bad]:
+            self.fail([lane],ValueError("ret: address in LR ({}) out of range".format(self.registers[LR,lane])))
+        self.pc[lanes[~bad]] = addr[~bad] + 1
+    #svc 0, one lane at a time
+    def op_svc(self,lanes):
+        for lane in lanes:
+            try:
+                self.syscall(lane)
+            except Exception as e:
+                self.fail([lane],e)
+    #labels aren't counted as steps
+    def op_label(self,lanes,line):
+        self.label_hit_counts[line][lanes] += 1
+        self.steps[lanes] -= 1
+    #a line that failed to decode
+    def op_invalid(self,lanes,error):
+        self.fail(lanes,error)
+
+    #the column of mem that holds an address
+    def column(self,addr:int)->int:
+        if(addr < self.base):
+            raise ValueError("out of bounds memory access: {} is below the stack of the lane".format(addr))
+        return addr - self.base
+
+    '''
+    System calls for a single lane, the same ones as armsim supports
+    '''
+    def syscall(self,lane):
+        reg = self.registers[:,lane]
+        syscall = int(reg[8])
+        #exit
+        if(syscall==93):
+            self.pc[lane] = len(self.program)
+        #write
+        elif(syscall==64):
+            assert reg[0] == 1, "Can only write to stdout! (x0 must contain #1)"
+            start = self.column(int(reg[1]))
+            end = min(start + int(reg[2]),self.end[lane] - self.base)
+            self.output[lane].append(self.mem[lane,start:end].tobytes())
+        #read
+        elif(syscall==63):
+            start = self.column(int(reg[1]))
+            #same as armsim
+            data = self.stdin[lane].read(int(reg[2]))
+            self.mem[lane,start:start+len(data)] = np.frombuffer(data,dtype=np.uint8)
+            reg[0] = len(data)
+        #brk
+        elif(syscall==214):
+            new_brk = int(reg[0])
+            if(new_brk < self.original_break):
+                reg[0] = self.brk[lane]
+            elif(new_brk == self.original_break):
+                self.brk[lane] = new_brk
+                self.mem[lane,self.column(new_brk):] = 0
+                self.end[lane] = new_brk
+            else:
+                break_size = new_brk - self.original_break
+                page = (break_size + 0x1000) - break_size % 0x1000
+                if(page > HEAP_SIZE): raise ValueError("break size of {} too large".format(break_size))
+                if(page > self.heap_size):
+                    self.fail([lane],ValueError("heap limit of {} bytes reached".format(self.heap_size)),'memory_limit')
+                    return
+                end = self.original_break + page
+                #memory is only ever widened, for all lanes at once, so 
+                #heap_size limits it
+                if(self.column(end) > self.mem.shape[1]):
+                    self.mem = np.pad(self.mem,((0,0),(0,self.column(end) - self.mem.shape[1])))
+                #shrinking the heap throws away what was in it
+                self.mem[lane,self.column(end):] = 0
+                self.end[lane] = end
+                self.brk[lane] = new_brk
+        #getrandom
+        elif(syscall==278):
+            start = self.column(int(reg[0]))
+            quantity = int(reg[1])
+            self.mem[lane,start:start+quantity] = np.frombuffer(os.urandom(quantity),dtype=np.uint8)
+            reg[0] = quantity
+        else:
+            raise ValueError("Unsupported system call: {} ".format(syscall))
+
+def main():
+    parser = argparse.ArgumentParser(description='Run a program with armsim on many inputs at once')
+    parser.add_argument('program', help='the .s file to run')
+    parser.add_argument('-i','--inputs', required=True, help='file with the stdin of one run on each line')
+    parser.add_argument('-m','--max-steps', type=int, default=None, help='number of instructions each run may execute (default: no limit)')
+    parser.add_argument('-o','--output', help='file to write the results to (default: stdout)')
+    args = parser.parse_args()
+    machine = armsim.Machine()
+    with open(args.program,'r') as f:
+        machine.parse(f)
+    with open(args.inputs,'r') as f:
+        stdins = [line if line.endswith('\n') else line + '\n' for line in f]
+    lanes = Lanes(machine,stdins)
+    lanes.run(args.max_steps)
+    out = open(args.output,'w') if args.output else sys.stdout
+    try:
+        for result in lanes.results():
+            out.write(json.dumps(result) + '\n')
+    finally:
+        if(out is not sys.stdout):out.close()
+
+if __name__ == "__main__":
+    main()
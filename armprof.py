@@ -0,0 +1,128 @@
+'''
+armprof runs a program with armsim and reports where it spent its time,
+for example to find out why a submission is slow. Every instruction is
+counted while the program runs (see Profiling in armsim.py), and the
+instructions that ran the most are listed with their share of all
+instructions executed and the line of the .s file they are on:
+
+    1,234 instructions executed
+         count   share  line  instruction
+           400   32.4%    41  udiv x2, x0, x10
+           ...
+
+With -g, the procedures (labels called with bl) are listed too, with
+the instructions executed in each one and everything it calls 
+(inclusive), in the procedure itself (exclusive) and the most calls
+of it that were on the stack at once (depth). Code that isn't in a
+procedure is counted under _start. With -f, the stacks of procedures
+are written to a file in the folded format that flamegraph tools 
+(flamegraph.pl, speedscope, ...) read, e.g.
+    python armprof.py collatz.s -i input.txt -f collatz.folded
+    flamegraph.pl collatz.folded > collatz.svg
+Stacks deeper than --stack-depth procedures are cut off there.
+
+With -c, the cycles the program would take on the Cortex-A72 of a 
+Raspberry Pi 4 are estimated as well (see Timing Model in armsim.py).
+
+The program reads its input from the file given with -i (or from
+stdin) and its output goes to stderr, so that it doesn't get mixed up
+with the report. If the program fails or runs out of instructions the
+report is still written, covering everything it did until then, and
+the exit code is 1.
+
+Usage:
+    python armprof.py program.s [-i input.txt] [-n 20] [-m 1000000] [-g] [-f stacks.folded] [-c] [-j] [-o report.txt]
+'''
+import armsim
+import argparse
+import json
+import sys
+
+'''
+Returns the report of machine's last profiled run as text. Only the
+top instructions are listed if top is given
+'''
+def format_report(machine:armsim.Machine,top:int=None)->str:
+    lines = ["{:,} instructions executed".format(machine.steps),
+             "{:>10}{:>8}{:>6}  {}".format('count','share','line','instruction')]
+    for entry in machine.profile_report(top):
+        line = '' if entry['line'] is None else entry['line']
+        lines.append("{:>10}{:>8.1%}{:>6}  {}".format(entry['count'],entry['share'],line,entry['text']))
+    return '\n'.join(lines) + '\n'
+
+'''
+Returns the procedures of machine's last profiled run as text, the
+most inclusive instructions first
+'''
+def format_procedures(machine:armsim.Machine)->str:
+    procedures = machine.call_profile.procedures()
+    total = max(machine.steps,1)
+    lines = ["{:<24}{:>8}{:>12}{:>8}{:>12}{:>8}{:>7}".format(
+        'procedure','calls','inclusive','share','exclusive','share','depth')]
+    for label,entry in sorted(procedures.items(),key=lambda item:-item[1]['inclusive']):
+        lines.append("{:<24}{:>8}{:>12}{:>8.1%}{:>12}{:>8.1%}{:>7}".format(label,entry['calls'],
+            entry['inclusive'],entry['inclusive']/total,entry['exclusive'],entry['exclusive']/total,entry['max_depth']))
+    return '\n'.join(lines) + '\n'
+
+'''
+Returns the estimate of a TimingModel as text
+'''
+def format_timing(timing:armsim.TimingModel)->str:
+    report = timing.report()
+    lines = ["{:,} cycles estimated ({:,} of them stalls)".format(report['cycles'],report['stalls'])]
+    if(report['cpi'] is not None):lines.append("{:.2f} cycles per instruction".format(report['cpi']))
+    for kind,count in sorted(report['classes'].items(),key=lambda item:-item[1]):
+        lines.append("{:<20}{:>12}".format(kind,count))
+    return '\n'.join(lines) + '\n'
+
+def main():
+    parser = argparse.ArgumentParser(description='Run a program with armsim and report which instructions it spends its time on')
+    parser.add_argument('program', help='the .s file to run')
+    parser.add_argument('-i','--stdin', help='file the program reads its input from (default: stdin)')
+    parser.add_argument('-n','--top', type=int, default=20, help='number of instructions to list (default: 20, 0 for all)')
+    parser.add_argument('-m','--max-steps', type=int, default=None, help='number of instructions the program may execute (default: no limit)')
+    parser.add_argument('-g','--calls', action='store_true', help='also list the procedures and the instructions executed in them')
+    parser.add_argument('-f','--folded', help='file to write the call stacks to, in the folded format of flamegraph tools')
+    parser.add_argument('-d','--stack-depth', type=int, default=500, help='deepest stack written with -f (default: 500)')
+    parser.add_argument('-c','--cycles', action='store_true', help='also estimate the cycles the program takes on a Raspberry Pi 4')
+    parser.add_argument('-j','--json', action='store_true', help='write the report as json')
+    parser.add_argument('-o','--output', help='file to write the report to (default: stdout)')
+    args = parser.parse_args()
+    machine = armsim.Machine()
+    with open(args.program,'r') as f:
+        machine.parse(f)
+    machine.profile = True
+    if(args.cycles):machine.timing = armsim.TimingModel()
+    machine.stdout = armsim.OutputSink(sys.stderr)
+    stdin = open(args.stdin,'rb') if args.stdin else None
+    if(stdin):machine.stdin = armsim.InputSource(stdin)
+    error = None
+    try:
+        machine.run(args.max_steps)
+    except Exception as e:
+        error = "{}: {}".format(type(e).__name__,e)
+        print(error,file=sys.stderr)
+    finally:
+        if(stdin):stdin.close()
+    top = args.top or None
+    if(args.json):
+        report = json.dumps({'program':args.program, 'steps':machine.steps, 'error':error,
+                             'instructions':machine.profile_report(top),
+                             'procedures':machine.call_profile.procedures(),
+                             'timing':machine.timing.report() if machine.timing else None},indent=1) + '\n'
+    else:
+        report = format_report(machine,top)
+        if(args.calls):report += '\n' + format_procedures(machine)
+        if(machine.timing):report += '\n' + format_timing(machine.timing)
+    if(args.folded):
+        with open(args.folded,'w') as f:
+            f.write(machine.call_profile.folded(args.stack_depth))
+    if(args.output):
+        with open(args.output,'w') as f:
+            f.write(report)
+    else:
+        sys.stdout.write(report)
+    if(error):sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,15 @@
 import re
 import sys
 import os
+import struct
+import array
+import time
+import types
+import hashlib
+import pickle
+import io
+import math
+from collections.abc import MutableMapping
 
 '''
 *******************
@@ -12,11 +21,11 @@ with the format of gnu assembler files and supports a subset
 of the instructions and directives. The basic operation of
 the simulator is that it first reads in a .s file line by 
 line and separates the input into code and symbol declarations. 
-The data in static memory is simulated with a python list, where
-each element represents one byte as an int. It attempts to execute 
-each line of code by matching against regular expressions that encode 
-the instruction format, and updating global variables appropriately 
-based on that execution. All text is converted to lower case, 
+Memory is simulated with pages of bytes that are allocated when
+they are first written (see Memory). Each line of code is
+decoded once by matching against regular expressions that encode 
+the instruction format, then the decoded instructions are executed
+by updating the state of a Machine appropriately. All text is converted to lower case, 
 meaning that identifiers are not case sensitive 
 (so variable = VARIABLE).
 Currently supported:
@@ -75,6 +84,7 @@ Currently supported:
     add{s}  rd, rn, rm
     asr     rd, rn, imm
     lsl     rd, rn, imm
+    lsr     rd, rn, imm
     udiv    rd, rn, rm
     sdiv    rd, rn, rm
     mul     rd, rn, rm
@@ -97,11 +107,26 @@ Currently supported:
     b.ne    <label>
     b.mi    <label>
     b.pl    <label>
+    b.hi    <label>
+    b.hs    <label> (also b.cs)
+    b.lo    <label> (also b.cc)
+    b.ls    <label>
+    b.vs    <label>
+    b.vc    <label>
+    csel    rd, rn, rm, <cond>
+    csinc   rd, rn, rm, <cond>
+    cset    rd, <cond>
     bl      <label>
     ret
     svc 0   
 
     
+  Registers:
+    Registers are 64 bits wide and hold signed values, so results wrap
+    around like on hardware (e.g. adding 1 to 0x7fffffffffffffff gives
+    the smallest negative number). udiv, lsr and the unsigned conditions
+    (hi, hs, lo, ls) treat the registers as unsigned.
+
 Comments (Must NOT be on same line as stuff you want read into the program):
   //text
   /*text*/
@@ -111,53 +136,43 @@ Comments (Must NOT be on same line as stuff you want read into the program):
 '''
 
 '''
-Global state variables
+Global constants
 '''
-#list to hold the instructions
-asm = []
-STACK_SIZE = 4096
-#heap will be 4 pages
-HEAP_SIZE  =  0x4000
-#points to the original break, which comes after the static data
-original_break = 0
-#points to current break
-brk = 0
-#dict of register names to values. Will always be numeric values       
-reg = {'x0':0,'x1':0,'x2':0,'x3':0,'x4':0,'x5':0,'x6':0,'x7':0,'x8':0,'x9':0,'x10':0,
-'x11':0,'x12':0,'x13':0,'x14':0,'x15':0,'x16':0,'x17':0,'x18':0,'x19':0,'x20':0,
-'x21':0,'x22':0,'x23':0,'x24':0,'x25':0,'x26':0,'x27':0,'x28':0,'fp':0,'lr':0,'sp':0,'xzr':0}
-#program counter
-pc = 0
-#Note: Python doesn't really have overflow and it would
-#be a pain to simulate, so the v (signed overflow) flag
-#is implicitly zero
-#negative flag
-n_flag = False 
-#zero flag
-z_flag = False 
-
+#memory is only allocated when it is written (see Memory), so these
+#can be as big as on a real system without slowing anything down
+STACK_SIZE = 0x800000
+HEAP_SIZE  = 0x4000000
+#when run() is given a time limit, the clock is read every
+#LIMIT_CHECK_STEPS instructions instead of on every step
+LIMIT_CHECK_STEPS = 4096
+#bytes written by a program that are kept before they are passed on to
+#the output (see OutputSink)
+OUTPUT_BUFFER_SIZE = 0x10000
+#the most bytes that are taken from the input source at once (see
+#InputSource)
+INPUT_CHUNK_SIZE = 0x10000
+#start of every cached program file (see parse_cached()). The number is
+#changed whenever the layout of the file changes
+CACHE_MAGIC = b'ARMSIM-CACHE'
+CACHE_FORMAT = 2
 
 '''
-dict to hold how often a label has been seen. Intialized in the
-run() procedure, then updated in the main loop every time a label is
-hit. Since the BL instruction does not cause the pc to actually
-land on the label, label_hit_counts must also be updated in execute()
-when a BL instruction is matched (colon must be included)
+Returns a hash of the source of this file, which changes whenever the
+simulator does. It is part of the key of cached programs
 '''
-label_hit_counts = {}
+def simulator_version()->str:
+    global source_hash
+    if(source_hash is None):
+        with open(__file__,'rb') as f:
+            source_hash = hashlib.sha256(f.read()).hexdigest()
+    return source_hash
+source_hash = None
 
 
-'''
-dict to hold "external" labels that can be targets for BL.
-The key is a label (including colon) and the value is a python
-function
-'''
-linked_labels = {}
-
 '''
 regexes for parsing instructions
 '''
-register_regex = '(?:lr|fp|sp|xzr|(?<!\w)x[1-2]\d(?!\w)|(?<!\w)x\d(?!\w))'
+register_regex = r'(?:lr|fp|sp|xzr|(?<!\w)x[1-2]\d(?!\w)|(?<!\w)x30(?!\w)|(?<!\w)x\d(?!\w))'
 num_regex = '[-]?(?:0x[0-9a-f]+|\d+)'
 var_regex = '[a-z_]+\w*'
 label_regex = '[.]*\w+'
@@ -171,7 +186,9 @@ register_regex:
         negative lookbehind is so that we don't match hex numbers like 0x40
         as registers or labels that happen to have register names
     x[1-2]\d
-        matches registers x10 - x29 (fp is used instead of x29, should fix this)
+        matches registers x10 - x29 (x29 is another name for fp)
+    x30
+        matches x30 (another name for lr)
     (?!\w)
         negative lookahead to ensure that cases like x222 aren't matched
     (?<!0)x\d(?!\w)
@@ -191,1119 +208,3055 @@ label_regex
         followed by one or more alpanumeric symbols or underscore
 '''
 
+#struct for a signed 8 byte little endian int (and a pair of them
+#for ldp/stp), the same as a register. The bound methods are used 
+#directly on pages by compiled blocks for speed
+quad = struct.Struct('<q')
+load_quad = quad.unpack_from
+store_quad = quad.pack_into
+pair = struct.Struct('<qq')
+load_pair = pair.unpack_from
+store_pair = pair.pack_into
 
 '''
-A map of string to int, where int will either be
-an index into the mem array or a size in bytes.
-Basically, vars declared with a : will be addresses and
-vars declared with = will be literals
-Additionally the directive type will be stored in the following way:
--an key in the form <var>_TYPE_ will map to
-0 -> asciz
-1 -> 8byte
-2 -> space
-NB. vars declared with = (ie length variables) are just stored in
-sym_table as numbers, so they don't have a type
-Types are stored primarily for the get_data procedure
+********************
+* Memory           *
+********************
+Memory is split into pages of PAGE_SIZE bytes, which are kept in a 
+dict by page number (address >> PAGE_BITS). A page is only allocated 
+the first time something is written to it, and pages that have never
+been written read as zero. size is the end of memory: addresses from
+0 up to size are valid. Changing size (see resize()) doesn't allocate
+or copy anything, so the stack and heap can be megabytes big and brk
+is cheap.
+
+The 8 byte accesses used by ldr/str and ldp/stp are done in place on
+the page with struct when they don't cross into the next page.
+
+snapshot() turns every page into an immutable bytes object that is
+shared by memory and the snapshot. A shared page is only copied (into
+a bytearray) the first time it is written after that, so restore()
+only has to put back the dict of pages, however big memory is
 '''
-sym_table = {}
+PAGE_BITS = 12
+PAGE_SIZE = 1 << PAGE_BITS
+PAGE_MASK = PAGE_SIZE - 1
+ZERO_PAGE = bytes(PAGE_SIZE)
+
+class Memory:
+    def __init__(self):
+        self.pages = {}
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    #returns a page to write to, allocating it (or copying it if it is
+    #shared with a snapshot) if needed
+    def page(self,number:int)->bytearray:
+        page = self.pages.get(number)
+        if(type(page) is not bytearray):
+            page = self.pages[number] = bytearray(ZERO_PAGE if page is None else page)
+        return page
+
+    #returns the current contents of memory, which can be given to 
+    #restore() to go back to them
+    def snapshot(self)->tuple:
+        self.pages = {number:bytes(page) for number,page in self.pages.items()}
+        return (self.size,dict(self.pages))
+
+    def restore(self,snapshot:tuple):
+        self.size,pages = snapshot
+        self.pages = dict(pages)
+
+    '''
+    Moves the end of memory. When memory shrinks, whatever was past the
+    new end is thrown away, so it reads as zero if memory grows again
+    '''
+    def resize(self,size:int):
+        if(size < self.size):
+            for number in [n for n in self.pages if (n + 1) << PAGE_BITS > size]:
+                if(number << PAGE_BITS >= size):
+                    del self.pages[number]
+                else:
+                    offset = size & PAGE_MASK
+                    self.page(number)[offset:] = bytes(PAGE_SIZE - offset)
+        self.size = size
+
+    '''
+    Returns length bytes starting at addr. Like slicing a bytearray, the
+    range is cut off at the end of memory
+    '''
+    def read(self,addr:int,length:int)->bytes:
+        start,stop,_ = slice(addr,addr+length).indices(self.size)
+        #most reads stay inside of one page, copy them only once
+        offset = start & PAGE_MASK
+        if(start < stop and offset + stop - start <= PAGE_SIZE):
+            page = self.pages.get(start >> PAGE_BITS,ZERO_PAGE)
+            return bytes(memoryview(page)[offset:offset + stop - start])
+        chunks = []
+        while(start < stop):
+            offset = start & PAGE_MASK
+            end = min(offset + stop - start,PAGE_SIZE)
+            chunks.append(self.pages.get(start >> PAGE_BITS,ZERO_PAGE)[offset:end])
+            start += end - offset
+        return b''.join(chunks)
+
+    '''
+    Writes data starting at addr, which must be inside of memory. Pages
+    that haven't been allocated yet are left alone when only zeros would
+    be written to them
+    '''
+    def write(self,addr:int,data:bytes):
+        if(addr < 0 or addr + len(data) > self.size):
+            raise ValueError("out of bounds memory access: {} bytes at {}".format(len(data),addr))
+        done = 0
+        while(done < len(data)):
+            offset = (addr + done) & PAGE_MASK
+            count = min(PAGE_SIZE - offset,len(data) - done)
+            chunk = data[done:done+count]
+            number = (addr + done) >> PAGE_BITS
+            if(number in self.pages or chunk.strip(b'\0')):
+                self.page(number)[offset:offset+count] = chunk
+            done += count
+
+    #appends data to the end of memory
+    def extend(self,data:bytes):
+        addr = self.size
+        self.resize(self.size + len(data))
+        self.write(addr,data)
+
+    #slicing works like it does for a bytearray, e.g. mem[addr:addr+size]
+    def __getitem__(self,key:slice)->bytes:
+        start,stop,_ = key.indices(self.size)
+        return self.read(start,max(0,stop-start))
+    def __setitem__(self,key:slice,data:bytes):
+        self.write(key.indices(self.size)[0],data)
+
+    '''
+    8 byte accesses. The address has already been checked by the caller
+    '''
+    def load_quad(self,addr:int)->int:
+        offset = addr & PAGE_MASK
+        if(offset <= PAGE_SIZE - 8):
+            page = self.pages.get(addr >> PAGE_BITS)
+            return 0 if page is None else quad.unpack_from(page,offset)[0]
+        return quad.unpack(self.read(addr,8))[0]
+    def store_quad(self,addr:int,value:int):
+        offset = addr & PAGE_MASK
+        if(offset <= PAGE_SIZE - 8):
+            page = self.pages.get(addr >> PAGE_BITS)
+            if(type(page) is not bytearray):page = self.page(addr >> PAGE_BITS)
+            quad.pack_into(page,offset,value)
+        else:
+            self.write(addr,quad.pack(value))
+    def load_pair(self,addr:int)->tuple:
+        offset = addr & PAGE_MASK
+        if(offset <= PAGE_SIZE - 16):
+            page = self.pages.get(addr >> PAGE_BITS)
+            return (0,0) if page is None else pair.unpack_from(page,offset)
+        return pair.unpack(self.read(addr,16))
+    def store_pair(self,addr:int,first:int,second:int):
+        offset = addr & PAGE_MASK
+        if(offset <= PAGE_SIZE - 16):
+            page = self.pages.get(addr >> PAGE_BITS)
+            if(type(page) is not bytearray):page = self.page(addr >> PAGE_BITS)
+            pair.pack_into(page,offset,first,second)
+        else:
+            self.write(addr,pair.pack(first,second))
 
 '''
-Data is stored as a list. Each element is an int that represents a byte. 
-String data gets "converted" by doing list(bytes(str,'ascii')) and numbers 
-get converted into a list from their byte representation using list(int.tobytes()).
-It is accessed with an index and a size using the format [addr:addr+size].
-The stack pointer also points to the end of this list and grows down.
-It's first filled with the stack, then static data, then the heap. This
-ensures that increasing the heap does not shift the stack or static data.
-The sp (stack pointer) register will point to the end of its section
-and the heap pointer will point beginning of it's section to start
-Thus, we get the following diagram
+********************
+* Output           *
+********************
+Everything a program writes with the write syscall goes to the 
+machine's OutputSink (Machine.stdout). The bytes are copied from 
+memory into a buffer, which is passed on to the target when it holds
+buffer_size bytes, when the program reads input or exits, and when 
+run() or step() returns. The target can be:
+    None            sys.stdout (looked up when the buffer is flushed, 
+                    so replacing sys.stdout still works)
+    an int          a file descriptor, e.g. 1 or a pipe
+    a binary file   anything with a write method that takes bytes, 
+                    e.g. io.BytesIO() or open(path,'wb')
+    a text file     anything based on io.TextIOBase, e.g. StringIO
+Bytes are written as they are. Text files get the bytes decoded as
+utf-8, and bytes that aren't utf-8 are kept as surrogates (the 
+'surrogateescape' error handler), so nothing is lost. If limit is 
+given, no more than limit bytes are accepted, the rest is dropped
+and write() returns the number of bytes accepted
+'''
+class OutputSink:
+    def __init__(self,target=None,limit:int=None,buffer_size:int=OUTPUT_BUFFER_SIZE):
+        self.target = target
+        self.limit = limit
+        self.buffer_size = buffer_size
+        self.buffer = bytearray()
+        #number of bytes accepted so far
+        self.written = 0
+
+    def write(self,data:bytes)->int:
+        if(self.limit is not None and self.written + len(data) > self.limit):
+            data = data[:max(0,self.limit - self.written)]
+        self.buffer += data
+        self.written += len(data)
+        if(len(self.buffer) >= self.buffer_size):self.flush()
+        return len(data)
+
+    def flush(self):
+        if(not self.buffer):return
+        data = bytes(self.buffer)
+        self.buffer.clear()
+        target = sys.stdout if self.target is None else self.target
+        if(type(target) is int):
+            view = memoryview(data)
+            while(view):
+                view = view[os.write(target,view):]
+            return
+        if(self.target is None and hasattr(target,'buffer')):
+            #a real stdout, write the bytes underneath the text layer
+            target.flush()
+            target.buffer.write(data)
+            target.buffer.flush()
+        elif(isinstance(target,io.TextIOBase)):
+            target.write(data.decode('utf-8','surrogateescape'))
+        else:
+            target.write(data)
 
-| stack | static | heap |
-        ^        ^     
-    <--sp        hp -->
 '''
-mem = []
+********************
+* Input            *
+********************
+The read syscall reads from the machine's InputSource (Machine.stdin).
+It copies bytes from the source into memory and returns the number of
+bytes in x0, which is 0 at the end of the input. By default a read 
+works like it always has: it takes one whole line of the input, adds
+a newline if the line doesn't end with one (e.g. the last line of 
+StringIO('37')) and copies up to x2 bytes of it, the rest of the line
+is thrown away. If exact is True, nothing is added or thrown away: a
+read copies up to x2 bytes, a read that asks for fewer bytes than the
+line has leaves the rest for the next read, and input that doesn't 
+end with a newline is read as it is. The source can be:
+    None            sys.stdin (looked up when it is read from, so 
+                    replacing sys.stdin still works)
+    bytes or str    the whole input (str is encoded as utf-8)
+    an int          a file descriptor, e.g. 0 or a pipe
+    a file          a binary or a text file, e.g. io.BytesIO(b'37\n'),
+                    io.StringIO('37\n') or open(path,'rb')
+    an iterable     of bytes or str chunks, e.g. a generator
+The buffer is refilled with at most INPUT_CHUNK_SIZE bytes at a time.
+For exact reads, if line_buffered is True (the default) a read stops
+after a newline, like it does when a program reads from a terminal,
+so a program that reads one answer at a time gets one line per read.
+Otherwise reads are only limited by x2 and what is in the buffer, 
+like reads from a file or a pipe, which is faster for programs that
+read a lot of data in chunks
+'''
+class InputSource:
+    def __init__(self,source=None,line_buffered:bool=True,exact:bool=False):
+        self.source = source
+        self.line_buffered = line_buffered
+        self.exact = exact
+        self.buffer = b''
+        #start of the bytes in buffer that haven't been read yet
+        self.position = 0
+        #iterator over the chunks of input that is given as bytes, str
+        #or an iterable, None for stdin, file descriptors and files
+        self.chunks = None
+        if(isinstance(source,(str,bytes,bytearray,memoryview))):
+            self.chunks = iter([source])
+        elif(source is not None and type(source) is not int and not hasattr(source,'read')):
+            self.chunks = iter(source)
+
+    #takes the next chunk from the source, b'' at the end of it
+    def next_chunk(self)->bytes:
+        source = sys.stdin if self.source is None else self.source
+        if(self.chunks is not None):
+            #an empty chunk doesn't mean the end of the input
+            chunk = next((chunk for chunk in self.chunks if chunk),b'')
+        elif(type(source) is int):
+            chunk = os.read(source,INPUT_CHUNK_SIZE)
+        elif(hasattr(source,'buffer') and hasattr(source.buffer,'read1')):
+            #a real stdin, read the bytes underneath the text layer.
+            #read1 returns what is available instead of waiting for a 
+            #whole chunk
+            chunk = source.buffer.read1(INPUT_CHUNK_SIZE)
+        elif(isinstance(source,io.TextIOBase)):
+            chunk = source.readline(INPUT_CHUNK_SIZE) if self.line_buffered else source.read(INPUT_CHUNK_SIZE)
+        elif(hasattr(source,'read1')):
+            chunk = source.read1(INPUT_CHUNK_SIZE)
+        else:
+            chunk = source.read(INPUT_CHUNK_SIZE)
+        return chunk.encode('utf-8') if isinstance(chunk,str) else bytes(chunk)
+
+    '''
+    Returns up to count bytes, b'' at the end of the input. Nothing is
+    read from the source if count is 0
+    '''
+    def read(self,count:int)->bytes:
+        if(count <= 0):return b''
+        if(not self.exact):
+            line = self.read_line()
+            if(line and not line.endswith(b'\n')):line += b'\n'
+            return line[:count]
+        if(self.position >= len(self.buffer)):
+            self.buffer = self.next_chunk()
+            self.position = 0
+        start = self.position
+        end = min(start + max(0,count),len(self.buffer))
+        if(self.line_buffered):
+            newline = self.buffer.find(b'\n',start,end)
+            if(newline >= 0):end = newline + 1
+        self.position = end
+        return self.buffer[start:end]
+
+    '''
+    Returns the next line of the input including its newline (if it has
+    one), b'' at the end of the input
+    '''
+    def read_line(self)->bytes:
+        parts = []
+        while(True):
+            if(self.position >= len(self.buffer)):
+                self.buffer = self.next_chunk()
+                self.position = 0
+                if(not self.buffer):break
+            newline = self.buffer.find(b'\n',self.position)
+            end = len(self.buffer) if newline < 0 else newline + 1
+            parts.append(self.buffer[self.position:end])
+            self.position = end
+            if(newline >= 0):break
+        return b''.join(parts)
 
 '''
-Static Rule Variables:
-Specify properties that a program must have
---disallow certain instructions
---require/forbid recursion
+********************
+* Condition Flags  *
+********************
+The NZCV flags are evaluated lazily. An instruction that sets the
+flags only records what it did in the flags tuple of the machine:
+    ('sub', a, b)      cmp and subs, the flags of a - b
+    ('add', a, b)      adds, the flags of a + b
+    ('logic', r, 0)    ands, orrs and eors, the flags of the result r
+                       (C and V are cleared)
+    ('set', bits, 0)   flags that were set directly, bits is NZCV as
+                       a 4 bit number
+The flags themselves are only worked out when a conditional branch, a
+csel style instruction or the user (n_flag, z_flag, c_flag, v_flag)
+reads them. After a cmp or subs, which is by far the most common case,
+the conditions are evaluated by comparing a and b directly (e.g. lt is
+a < b and hi is an unsigned a > b) without working out the flags at all.
+Results are 64 bits wide, so C is the unsigned carry out of bit 63 
+and V is set if the signed result doesn't fit in 64 bits
 '''
-#A set that contains the mnemonic of instructions that you don't want used 
-#for a particular run of the the program
-forbidden_instructions = set()
+WORD_MASK = (1 << 64) - 1
+SIGN_BIT = 1 << 63
 
-#recursion flags
-forbid_recursion = False
-require_recursion = False
-#loop flag
-forbid_loops = False
+#returns value as a signed 64 bit number. Every instruction that 
+#computes a value uses this to wrap around like a 64 bit register
+def signed(value:int)->int:
+    return ((value + SIGN_BIT) & WORD_MASK) - SIGN_BIT
 
-#dead code flag
-check_dead_code = False
+#sdiv rounds towards zero, while python's // rounds down
+def signed_divide(a:int,b:int)->int:
+    quotient = abs(a) // abs(b)
+    return signed(quotient if (a < 0) == (b < 0) else -quotient)
 
-#set to add labels that should be recursively called
-#(do not include colon)
-recursive_labels = set()
+#udiv divides the unsigned views of the registers
+def unsigned_divide(a:int,b:int)->int:
+    return signed((a & WORD_MASK) // (b & WORD_MASK))
 
+'''
+Returns the (n, z, c, v) flags described by a flags tuple
+'''
+def nzcv(flags:tuple)->tuple:
+    kind,a,b = flags
+    if(kind == 'sub'):
+        result = a - b
+        #no borrow
+        c = (a & WORD_MASK) >= (b & WORD_MASK)
+    elif(kind == 'add'):
+        result = a + b
+        c = (a & WORD_MASK) + (b & WORD_MASK) > WORD_MASK
+    elif(kind == 'logic'):
+        result = signed(a)
+        return (result < 0, result == 0, False, False)
+    else:
+        return (bool(a & 8), bool(a & 4), bool(a & 2), bool(a & 1))
+    wrapped = signed(result)
+    return (wrapped < 0, wrapped == 0, c, wrapped != result)
 
+#conditions in terms of the flags
+condition_flags = {
+    'eq':lambda n,z,c,v: z,          'ne':lambda n,z,c,v: not z,
+    'hs':lambda n,z,c,v: c,          'lo':lambda n,z,c,v: not c,
+    'mi':lambda n,z,c,v: n,          'pl':lambda n,z,c,v: not n,
+    'vs':lambda n,z,c,v: v,          'vc':lambda n,z,c,v: not v,
+    'hi':lambda n,z,c,v: c and not z,'ls':lambda n,z,c,v: not c or z,
+    'ge':lambda n,z,c,v: n == v,     'lt':lambda n,z,c,v: n != v,
+    'gt':lambda n,z,c,v: not z and n == v,
+    'le':lambda n,z,c,v: z or n != v,
+}
+#conditions after a cmp/subs of a and b, as source code so that they 
+#can also be used by the block compiler
+sub_condition_source = {
+    'eq':'{a} == {b}', 'ne':'{a} != {b}',
+    'hs':'({a} & WORD_MASK) >= ({b} & WORD_MASK)', 'lo':'({a} & WORD_MASK) < ({b} & WORD_MASK)',
+    'mi':'signed({a} - {b}) < 0', 'pl':'signed({a} - {b}) >= 0',
+    'vs':'signed({a} - {b}) != {a} - {b}', 'vc':'signed({a} - {b}) == {a} - {b}',
+    'hi':'({a} & WORD_MASK) > ({b} & WORD_MASK)', 'ls':'({a} & WORD_MASK) <= ({b} & WORD_MASK)',
+    'ge':'{a} >= {b}', 'lt':'{a} < {b}', 'gt':'{a} > {b}', 'le':'{a} <= {b}',
+}
+#cs and cc are other names for hs and lo
+for cond,other in (('cs','hs'),('cc','lo')):
+    condition_flags[cond] = condition_flags[other]
+    sub_condition_source[cond] = sub_condition_source[other]
+condition_sub = {cond:eval('lambda a,b: '+src.format(a='a',b='b')) for cond,src in sub_condition_source.items()}
 
 '''
-This procedure reads the lines of a program (which can be a .s file
-or just a list of assembly instructions) and populates the
-sym_table, mem, and asm data structures. It uses
-boolean flags to determine which datastructure is currently
-being populated. These flags change upon encountering specific
-keywords. Those keywords are .data or .bss for declaring constants
-and buffers and main: or _start: for code. 
+Returns True if the condition (eq, ne, lt, ...) holds for a flags tuple
 '''
-def parse(lines)->None:
-    global STACK_SIZE, HEAP_SIZE, heap_pointer,original_break,brk
-    #booleans for parsing .s file
-    comment = False
-    code = False
-    data = False
-    bss = False 
-    
-    #allocate the stack and set the stack pointer
-    mem.extend(list([0]*STACK_SIZE))
-    reg['sp'] = len(mem) - 1
+def condition_holds(cond:str,flags:tuple)->bool:
+    if(flags[0] == 'sub'):
+        return condition_sub[cond](flags[1],flags[2])
+    return condition_flags[cond](*nzcv(flags))
+
+'''
+Makes a property for one of the flags (0 to 3 for n, z, c and v) so 
+that the flags can be read and written like plain variables. Writing a
+flag works them all out and stores them as a 'set' flags tuple
+'''
+def flag_property(index:int):
+    def get(self):
+        return nzcv(self.flags)[index]
+    def set(self,value):
+        flags = list(nzcv(self.flags))
+        flags[index] = bool(value)
+        self.flags = ('set',flags[0]*8 + flags[1]*4 + flags[2]*2 + flags[3],0)
+    return property(get,set)
+
+'''
+********************
+* Register File    *
+********************
+The registers are kept in a list, registers, and decode() turns every
+register operand into its index in that list, so instructions don't
+have to look registers up by name. x0-x28 are 0-28, fp (x29) is 29, 
+lr (x30) is 30 and sp is 31. xzr is split in two: it is read from 
+register 32, which is never written, and written to register 33, 
+which is never read. This way xzr is always 0 without having to be
+reset after every instruction.
+reg is a view of registers by name (reg['x0'], reg['fp'], reg['x29']),
+which is how everything outside of the simulator uses the registers
+'''
+FP = 29
+LR = 30
+SP = 31
+XZR = 32
+DISCARD = 33
+REGISTER_COUNT = 34
+
+#dict of register name to its index in registers
+register_number = {'x{}'.format(i):i for i in range(0,31)}
+register_number.update({'fp':FP,'lr':LR,'sp':SP,'xzr':XZR})
+#the names shown by reg (x29 and x30 are only aliases)
+register_names = ['x{}'.format(i) for i in range(0,29)] + ['fp','lr','sp','xzr']
+
+#the index used when a register is read
+def read_register(name:str)->int:
+    return register_number[name]
+
+#the index used when a register is written
+def write_register(name:str)->int:
+    return DISCARD if name == 'xzr' else register_number[name]
+
+'''
+A dict like view of the registers by name. Writes are wrapped to 64
+bits and writes to xzr are ignored
+'''
+class RegisterView(MutableMapping):
+    def __init__(self,registers:list):
+        self.registers = registers
+    def __getitem__(self,name):
+        return self.registers[register_number[name]]
+    def __setitem__(self,name,value):
+        self.registers[write_register(name)] = signed(value)
+    def __delitem__(self,name):
+        raise TypeError("registers can't be deleted")
+    def __iter__(self):
+        return iter(register_names)
+    def __len__(self):
+        return len(register_names)
+    def __contains__(self,name):
+        return name in register_number
+    def __repr__(self):
+        return repr(dict(self))
+
+'''
+*******************
+* Decoder Patterns *
+*******************
+Each mnemonic has its own decoder (see Machine.decode()) which only
+tries the formats of that mnemonic. The patterns below are compiled 
+once and matched against the operands of a line, i.e. what follows
+the mnemonic after spaces around commas and octothorpes have been
+removed. Registers, immediates, variables and labels are captured in
+groups, in the order they appear
+'''
+def operand_pattern(form:str):
+    return re.compile(form.format(rg='('+register_regex+')',num='('+num_regex+')',
+                                  var='('+var_regex+')',lab='('+label_regex+')'))
+
+label_line_regex = re.compile('{}:$'.format(label_regex))
+comma_regex = re.compile('[ ]*,[ ]*')
+#ldp/stp: (pattern, opcode suffix). The offset is optional in the
+#first format, so [rn] and [rn, imm] are both matched
+pair_patterns = [
+    (operand_pattern(r'{rg},{rg},\[{rg}(?:,{num})?\]$'),''),
+    (operand_pattern(r'{rg},{rg},\[{rg},{num}\]!$'),'_pre'),
+    (operand_pattern(r'{rg},{rg},\[{rg}\],{num}$'),'_post'),
+]
+#ldr/str with an immediate offset: (pattern, opcode suffix)
+single_patterns = [
+    (operand_pattern(r'{rg},\[{rg}(?:,{num})?\]$'),''),
+    (operand_pattern(r'{rg},\[{rg},{num}\]!$'),'_pre'),
+    (operand_pattern(r'{rg},\[{rg}\],{num}$'),'_post'),
+]
+single_reg_pattern = operand_pattern(r'{rg},\[{rg},{rg}\]$')
+ldr_sym_pattern = operand_pattern(r'{rg},={var}$')
+reg_imm_pattern = operand_pattern(r'{rg},{num}$')
+reg_reg_pattern = operand_pattern(r'{rg},{rg}$')
+reg_reg_imm_pattern = operand_pattern(r'{rg},{rg},{num}$')
+reg_reg_reg_pattern = operand_pattern(r'{rg},{rg},{rg}$')
+four_reg_pattern = operand_pattern(r'{rg},{rg},{rg},{rg}$')
+reg_label_pattern = operand_pattern(r'{rg},{lab}$')
+label_pattern = operand_pattern(r'{lab}$')
+
+#conditions of b.<cond> and csel style instructions
+branch_conditions = ['lt','le','gt','ge','eq','ne','mi','pl','hi','hs','lo','ls','vs','vc','cs','cc']
+cond_regex = '(' + '|'.join(branch_conditions) + ')'
+csel_pattern = re.compile(r'({0}),({0}),({0}),{1}$'.format(register_regex,cond_regex))
+cset_pattern = re.compile(r'({0}),{1}$'.format(register_regex,cond_regex))
+
+'''
+*******************
+* Parser Patterns *
+*******************
+Used by parse() for the lines of the .data and .bss sections. Every
+line is matched against directive_regex once, which splits it into the
+name, the directive and its operands, with or without spaces around
+the colon. Lines that are not directives are constants (= and =.-),
+which are matched after the spaces around punctuation are removed
+'''
+spaces_regex = re.compile('[ \t]+')
+#a space in front of : . - = or after - =
+punctuation_regex = re.compile(' (?=[:.=-])|(?<=[-=]) ')
+directive_regex = re.compile(r'(.*?) ?: ?\.(asciz|space|8byte) (.*)')
+length_regex = re.compile('(.)+=.-(.)+')
+constant_regex = re.compile('(.)+=[a-z0-9]+')
+
+'''
+Raised by run() when a program uses up its instruction budget, time
+limit or output limit. reason is 'steps', 'time' or 'output'. The 
+exception keeps the state of the program when it was stopped: the pc,
+a copy of the registers, the number of instructions executed and 
+everything it wrote to stdout (as a string, see OutputSink)
+'''
+class LimitExceeded(Exception):
+    def __init__(self, message:str, reason:str, machine):
+        super().__init__(message)
+        self.reason = reason
+        self.pc = machine.pc
+        self.reg = dict(machine.reg)
+        self.steps = machine.steps
+        self.output = machine.output.decode('utf-8','surrogateescape')
+
+'''
+********************
+* Block Compiler   *
+********************
+Even with a decoded program, the main loop pays for a dispatch on
+every instruction. To avoid this, run() splits the program into basic
+blocks and compiles the ones that are executed often into python
+functions. A basic block starts at the beginning of the program, 
+after a label, or after any instruction that can change the pc 
+(branches, bl, ret and svc). It ends before the next label, before
+an instruction that can't be compiled (bl, ret, svc and lines that
+failed to decode), or after a b, b.<cond>, cbz or cbnz instruction.
+
+The source code of the function is generated from the decoded 
+instructions. The registers used in the block are copied into local
+variables (r0 to r31, named by register number) when the function 
+starts and written back into registers when it exits (normally or 
+with an exception), so syscalls and linked_labels calls always see 
+the up to date registers, since they are never executed inside of a
+compiled block. xzr is read as 0 and writes to it are thrown away.
+The function returns the pc of the next instruction to run. Stack
+pointer checks are done after every instruction in the block that 
+writes sp, so the same errors as in the main loop are raised. run() adds the size of the block to steps 
+before calling it. If the block raises an error, the line of the 
+generated code that raised it tells which instruction failed (the 
+function's offsets), and pc and steps are set to what the main loop
+would have had (see block_error()). This costs nothing while no error
+is raised.
+
+Example (the comments are not generated):
+    .loop:
+    udiv x2, x0, x10
+    msub x3, x10, x2, x0
+    cmp x0, 9
+    bgt .loop
+becomes
+    def block(self):
+        reg = self.registers; mem = self.mem; pages = mem.pages
+        r0 = reg[0]
+        r2 = reg[2]
+        r3 = reg[3]
+        r10 = reg[10]
+        _fk,_fa,_fb = self.flags
+        try:
+            r2 = unsigned_divide(r0,r10)
+            r3 = ((r0 - r10 * r2) + SIGN_BIT & WORD_MASK) - SIGN_BIT
+            _fk = 'sub'; _fa = r0; _fb = 9
+            #the label is at index 40 in asm
+            if(_fa > _fb): return 41
+            return 45
+        finally:
+            reg[2] = r2
+            reg[3] = r3
+            self.flags = (_fk,_fa,_fb)
+The flags are kept in the locals _fk, _fa and _fb (see Condition 
+Flags). If the kind of the last flag setting instruction is known when
+the block is compiled, conditions are compiled to direct comparisons
+'''
+
+#instructions that end a block and can be compiled
+block_branches = {'b','cbz','cbnz'} | {'b.'+cond for cond in branch_conditions}
+#instructions that end a block and can't be compiled
+block_exits = {'bl','ret','svc','invalid','label'}
+#indexes of the register operands of each instruction that can be 
+#compiled, since register numbers can't be told apart from immediates
+register_operands = {'ldr_sym':(1,),'mov_imm':(1,),'mov_reg':(1,2),
+                     'asr':(1,2),'lsl':(1,2),'lsr':(1,2),
+                     'mul':(1,2,3),'udiv':(1,2,3),'sdiv':(1,2,3),
+                     'madd':(1,2,3,4),'msub':(1,2,3,4),
+                     'cmp_reg':(1,2),'cmp_imm':(1,),
+                     'csel':(1,2,3),'csinc':(1,2,3),'cset':(1,),
+                     'cbz':(1,),'cbnz':(1,),'b':()}
+register_operands.update({'b.'+cond:() for cond in branch_conditions})
+for op in ('ldp','stp'):
+    register_operands.update({op+suffix:(1,2,3) for suffix in ('','_pre','_post')})
+for op in ('ldr','str'):
+    register_operands.update({op+suffix:(1,2) for suffix in ('','_pre','_post')})
+    register_operands[op+'_reg'] = (1,2,3)
+for op in ('add','sub','and','orr','eor'):
+    register_operands.update({op+'_imm':(1,2),op+'_reg':(1,2,3)})
+
+'''
+Returns the kind of flags tuple an instruction records ('sub', 'add' or
+'logic'), or None if it doesn't set the flags
+'''
+def flag_kind(instr:tuple):
+    op = instr[0]
+    if(op in ('cmp_reg','cmp_imm')):return 'sub'
+    if(type(instr[-1]) is bool and instr[-1]):
+        return {'add':'add','sub':'sub'}.get(op[0:3],'logic')
+    return None
+
+'''
+Returns the source code of a condition in terms of the local flags.
+kind is the kind of the last flag setting instruction if it is known
+when the block is compiled
+'''
+def block_condition(cond:str,kind:str)->str:
+    if(kind == 'sub'):
+        return sub_condition_source[cond].format(a='_fa',b='_fb')
+    return "condition_holds('{}',(_fk,_fa,_fb))".format(cond)
+
+'''
+Returns the python source code for a single decoded instruction.
+rd is used to name registers that are written and rs to name registers
+that are read, so that xzr can be handled. kind is passed on to
+block_condition()
+'''
+def block_source(instr:tuple,kind:str=None)->list:
+    op = instr[0]
+    args = instr[1:]
+    #local variable names for registers
+    rs = lambda r: '0' if r == XZR else 'r{}'.format(r)
+    rd = lambda r: '_' if r == DISCARD else 'r{}'.format(r)
+    #checks for memory accesses, same as load_mem()/store_mem()
+    def bounds(size,line):
+        return ["if(_a < r31 or _a > mem.size - {}): raise ValueError({!r})".format(
+            size,"out of bounds memory access: {}".format(line))]
+    def pointer(rn):
+        return ["if({0} > mem.size and {0} < r31): raise ValueError("\
+            "'register {{}} points to out of bounds memory'.format({0}))".format(rs(rn))]
+    #accesses that stay inside of one page go straight to the page,
+    #the others (and writes to pages that don't exist yet or are shared
+    #with a snapshot) go through mem
+    def load(targets,kind,size):
+        return ["if(_a & {} <= {}): {} = load_{}(pages.get(_a >> {},ZERO_PAGE),_a & {}){}".format(
+                    PAGE_MASK,PAGE_SIZE - size,targets,kind,PAGE_BITS,PAGE_MASK,'[0]' if kind == 'quad' else ''),
+                "else: {} = mem.load_{}(_a)".format(targets,kind)]
+    def store(values,kind,size):
+        return ["_p = pages.get(_a >> {})".format(PAGE_BITS),
+                "if(type(_p) is bytearray and _a & {} <= {}): store_{}(_p,_a & {},{})".format(
+                    PAGE_MASK,PAGE_SIZE - size,kind,PAGE_MASK,values),
+                "else: mem.store_{}(_a,{})".format(kind,values)]
+    flags = ["_fk = 'logic'; _fa = _t; _fb = 0"]
+    #wraps the source of an expression to 64 bits, like signed()
+    wrap = lambda e: "(({}) + SIGN_BIT & WORD_MASK) - SIGN_BIT".format(e)
+    if(op in ('ldp','ldp_pre','ldp_post','stp','stp_pre','stp_post')):
+        rt,rt2,rn,imm,line = args
+        src = []
+        if(op.endswith('_pre')):src.append("{} += {}".format(rd(rn),imm))
+        src.append("_a = {} + {}".format(rs(rn),0 if op.endswith('_pre') or op.endswith('_post') else imm))
+        src += bounds(16,line)
+        if(op.startswith('ldp')):
+            src += load("{},{}".format(rd(rt),rd(rt2)),'pair',16)
+        else:
+            src += store("{},{}".format(rs(rt),rs(rt2)),'pair',16)
+        if(op.endswith('_post')):
+            src.append("{} += {}".format(rd(rn),imm))
+            src += pointer(rn)
+        return src
+    if(op in ('ldr','ldr_reg','ldr_pre','ldr_post','str','str_reg','str_pre','str_post')):
+        rt,rn,offset,line = args
+        src = []
+        if(op.endswith('_pre')):src.append("{} += {}".format(rd(rn),offset))
+        if(op.endswith('_reg')):src.append("_a = {} + {}".format(rs(rn),rs(offset)))
+        elif(op.endswith('_pre') or op.endswith('_post')):src.append("_a = {}".format(rs(rn)))
+        else:src.append("_a = {} + {}".format(rs(rn),offset))
+        src += bounds(8,line)
+        if(op.startswith('ldr')):
+            src += load(rd(rt),'quad',8)
+        else:
+            src += store(rs(rt),'quad',8)
+        if(op.endswith('_post')):
+            src.append("{} += {}".format(rd(rn),offset))
+            src += pointer(rn)
+        return src
+    if(op == 'ldr_sym' or op == 'mov_imm'):
+        return ["{} = {}".format(rd(args[0]),args[1])]
+    if(op == 'mov_reg'):
+        return ["{} = {}".format(rd(args[0]),rs(args[1]))]
+    if(op == 'asr'):
+        return ["{} = {} >> {}".format(rd(args[0]),rs(args[1]),args[2])]
+    if(op == 'lsl'):
+        return ["{} = {}".format(rd(args[0]),wrap("{} << {}".format(rs(args[1]),args[2])))]
+    if(op == 'lsr'):
+        return ["{} = {}".format(rd(args[0]),wrap("({} & WORD_MASK) >> {}".format(rs(args[1]),args[2])))]
+    if(op in ('add_imm','add_reg','sub_imm','sub_reg','and_imm','and_reg','orr_imm','orr_reg','eor_imm')):
+        d,n,m,s = args
+        operator = {'add':'+','sub':'-','and':'&','orr':'|','eor':'^'}[op[0:3]]
+        m = m if op.endswith('_imm') else rs(m)
+        #the logical operations of two 64 bit values can't overflow
+        if(not s and op[0:3] in ('add','sub')):
+            return ["{} = {}".format(rd(d),wrap("{} {} {}".format(rs(n),operator,m)))]
+        if(not s):
+            return ["{} = {} {} {}".format(rd(d),rs(n),operator,m)]
+        if(op[0:3] in ('add','sub')):
+            return ["_fk = '{}'; _fa = {}; _fb = {}".format(op[0:3],rs(n),m),"{} = {}".format(rd(d),wrap("_fa {} _fb".format(operator)))]
+        return ["_t = {} {} {}".format(rs(n),operator,m),"{} = _t".format(rd(d))] + flags
+    if(op == 'mul'):
+        return ["{} = {}".format(rd(args[0]),wrap("{} * {}".format(rs(args[1]),rs(args[2]))))]
+    if(op in ('udiv','sdiv')):
+        function = 'unsigned_divide' if op == 'udiv' else 'signed_divide'
+        return ["{} = {}({},{})".format(rd(args[0]),function,rs(args[1]),rs(args[2]))]
+    if(op in ('madd','msub')):
+        return ["{} = {}".format(rd(args[0]),wrap("{} {} {} * {}".format(rs(args[3]),'+' if op == 'madd' else '-',rs(args[1]),rs(args[2]))))]
+    if(op in ('cmp_reg','cmp_imm')):
+        m = rs(args[1]) if op == 'cmp_reg' else args[1]
+        return ["_fk = 'sub'; _fa = {}; _fb = {}".format(rs(args[0]),m)]
+    if(op in ('csel','csinc')):
+        d,n,m,cond = args
+        m = wrap(rs(m) + ' + 1') if op == 'csinc' else rs(m)
+        return ["{} = {} if({}) else {}".format(rd(d),rs(n),block_condition(cond,kind),m)]
+    if(op == 'cset'):
+        return ["{} = 1 if({}) else 0".format(rd(args[0]),block_condition(args[1],kind))]
+    raise ValueError("can't compile {}".format(op))
+
+'''
+Returns the registers written by a decoded instruction that can be
+compiled
+'''
+def block_writes(instr:tuple)->set:
+    op = instr[0]
+    writes = set()
+    if(op[0:3] in ('ldp','stp')):
+        if(op.startswith('ldp')):writes.update(instr[1:3])
+        if(op.endswith('_pre') or op.endswith('_post')):writes.add(instr[3])
+    elif(op[0:3] in ('ldr','str')):
+        if(op.startswith('ldr')):writes.add(instr[1])
+        if(op.endswith('_pre') or op.endswith('_post')):writes.add(instr[2])
+    elif(op not in ('cmp_reg','cmp_imm')):
+        writes.add(instr[1])
+    return writes
+
+'''
+**********************
+* Control Flow Graph *
+**********************
+Built from the decoded program when it is loaded (see find_blocks())
+and used by the static rule checks (loops, dead code and recursion)
+and to find the basic blocks that are compiled (see find_blocks()).
+Every step is linear in the size of the program.
+
+A basic block starts at the beginning of the program, at every label
+and after every instruction in block_branches or block_exits, so like
+in the block compiler labels, bl, ret and svc end a block. Blocks are 
+numbered in program order. The successors of a block are the blocks
+that can run right after it in the same procedure: the target of a 
+branch and, unless it is a b or a ret, the next block. A bl has the 
+next block (where the procedure continues after the call returns) as
+its successor, and a call edge to the block of its label. Calls to 
+linked_labels have no call edge. An svc is assumed to return, unless
+x8 is set to 93 (exit) by a mov earlier in the same block. A line that
+failed to decode is also assumed to continue, so that a typo is not 
+reported as dead code.
+
+The graph has:
+    starts          first instruction of each block
+    block_of        block of each instruction
+    successors      list of successor blocks of each block
+    calls           list of (block of the label, label) of each block
+    reachable       whether a block can run, starting from the first
+                    block and following successors and calls
+    labelled        whether a block can be reached the same way from
+                    the first block or from any label. Blocks that 
+                    aren't are reported as dead code, so a procedure 
+                    that is never called is not dead code
+    back_edges      (block, successor) pairs that close a loop, found
+                    with a depth first search from the first block and
+                    from every procedure that is called. There is a 
+                    loop in the program if and only if there is one
+    recursive_labels the labels of procedures that can call themselves,
+                    directly or through other procedures. These are 
+                    the labels called from inside of a strongly 
+                    connected component (of successors and calls) that
+                    also contains the label, found with Tarjan's 
+                    algorithm
+Only reachable blocks are taken into account for loops and recursion
+'''
+class ControlFlowGraph:
+    def __init__(self,program:list):
+        count = len(program)
+        leaders = [False]*count
+        if(count):leaders[0] = True
+        for i in range(0,count):
+            op = program[i][0]
+            if(op == 'label'):leaders[i] = True
+            if((op in block_branches or op in block_exits) and i+1 < count):leaders[i+1] = True
+        self.starts = [i for i in range(0,count) if leaders[i]]
+        self.block_of = []
+        for number in range(0,len(self.starts)):
+            end = self.starts[number+1] if number+1 < len(self.starts) else count
+            self.block_of += [number]*(end - self.starts[number])
+        self.successors = []
+        self.calls = []
+        for number in range(0,len(self.starts)):
+            last = (self.starts[number+1] if number+1 < len(self.starts) else count) - 1
+            instr = program[last]
+            op = instr[0]
+            successors = []
+            if(op in block_branches):
+                successors.append(self.block_of[instr[-1]])
+            if(op not in ('b','ret') and last+1 < count and not self.exits(program,number,last)):
+                successors.append(self.block_of[last+1])
+            self.successors.append(successors)
+            if(op == 'bl' and instr[2] is not None):
+                self.calls.append([(self.block_of[instr[2]],instr[1][:-1])])
+            else:
+                self.calls.append([])
+        self.reachable = self.find_reachable([0])
+        self.labelled = self.find_reachable([0] + [self.block_of[i] for i in range(0,count) if program[i][0] == 'label'])
+        self.back_edges = self.find_back_edges()
+        self.recursive_labels = self.find_recursive_labels()
+
     '''
-    This is a counter that is used to assign an "address" in mem
-    to a symbol. Basically the value in sym_table when a key is one of 
-    the user defined variables. It's incremented for every variable encountered
-    by the size of the data stored in mem
+    Whether the svc at the end of block number is an exit, i.e. the 
+    last instruction before it in the block that writes x8 is a mov
+    of 93
     '''
-    index = len(mem)
+    def exits(self,program:list,number:int,last:int)->bool:
+        if(program[last][0] != 'svc'):return False
+        for i in range(last-1,self.starts[number]-1,-1):
+            instr = program[i]
+            #the registers written by other instructions are not known
+            if(instr[0] not in register_operands):return False
+            if(8 in block_writes(instr)):
+                return instr[0] == 'mov_imm' and instr[2] == 93
+        return False
 
-    
-    for line in lines:
-        line = line.strip()
-        #convert multiple spaces into one space 
-        line = re.sub('[ \t]+',' ',line) 
-        if('/*' in line and '*/' in line):continue
-        if('//' in line):continue
-        if("/*" in line):comment = True;continue
-        if("*/" in line):comment = False;continue
-        if(".data" in line):data = True;code = False;bss = False;continue
-        if(".bss" in line):data = False;code = False;bss = True;continue
-        if("main:" in line or "_start:" in line):code = True;data = False;bss = False;continue
-        if(code and not comment and len(line)>0):line = line.lower();asm.append(line)
-        if((data or bss) and not comment):
-            #remove quotes and whitespace surrouding punctuation 
-            #spaces following colons and periods are not touched so
-            #that string literals are not altered
-            line = re.sub('[ ]*:',':',line)
-            line = re.sub('[ ]*\.','.',line)
-            line = re.sub('[ ]*-[ ]*','-',line)
-            line = re.sub('[ ]*=[ ]*','=',line)
-            '''
-            When encountering something like s: .asciz "a"
-            we want to make s a new key in the sym_table dict and 
-            set its value equal to the second element after
-            splitting on the string ":.asciz". Additionally
-            we save the length of the string in a "shadow entry"
-            in sym_table in case someone wants to find the length
-            using the -. idiom. The string gets converted to bytes
-            before it is written to mem
-            '''
-            if(re.match('.*:\.asciz.*',line)):
-                #Don't convert string literals to lower case, so split on quote
-                #and everything to the left becomes lower
-                line = line[0:line.find('\"')].lower() + line[line.find('\"'):]             
-                #remove quote characters
-                line = re.sub('["]','',line)
-                #escape characters get mangled to \\<char>, convert to \<char>
-                #for now just tab, carriage return, and newline 
-                line = line.replace('\\n','\n')
-                line = line.replace('\\t','\t')
-                line = line.replace('\\r','\r')
-                line = line.split(":.asciz ")
-                sym_table[line[0]] = index
-                sym_table[line[0]+"_SIZE_"] = len(line[1])
-                sym_table[line[0]+"_TYPE_"] = 0
-                mem.extend(list(bytes(line[1],'ascii')))
-                index+=len(list(line[1]))
+    '''
+    Marks the blocks that can be reached from the blocks in roots
+    '''
+    def find_reachable(self,roots:list)->list:
+        reachable = [False]*len(self.starts)
+        if(not self.starts):return reachable
+        pending = []
+        for root in roots:
+            if(not reachable[root]):
+                reachable[root] = True
+                pending.append(root)
+        while(pending):
+            block = pending.pop()
+            for successor in self.successors[block] + [called for called,label in self.calls[block]]:
+                if(not reachable[successor]):
+                    reachable[successor] = True
+                    pending.append(successor)
+        return reachable
+
+    '''
+    Depth first search over the successors, starting at the first block
+    and then at every procedure called from a reachable block. An edge
+    to a block that is still on the search path is a back edge
+    '''
+    def find_back_edges(self)->list:
+        #0: not visited, 1: on the search path, 2: done
+        state = [0]*len(self.starts)
+        roots = [0] if self.starts else []
+        roots += [called for block in range(0,len(self.starts)) if self.reachable[block]
+                  for called,label in self.calls[block]]
+        back_edges = []
+        for root in roots:
+            if(state[root]):continue
+            state[root] = 1
+            path = [(root,0)]
+            while(path):
+                block,next_edge = path[-1]
+                successors = self.successors[block]
+                if(next_edge < len(successors)):
+                    path[-1] = (block,next_edge+1)
+                    successor = successors[next_edge]
+                    if(state[successor] == 1):
+                        back_edges.append((block,successor))
+                    elif(state[successor] == 0):
+                        state[successor] = 1
+                        path.append((successor,0))
+                else:
+                    state[block] = 2
+                    path.pop()
+        return back_edges
+
+    '''
+    Finds the strongly connected components of the reachable blocks
+    (with both successors and calls as edges) with an iterative version
+    of Tarjan's algorithm, and returns the labels of the calls that 
+    stay inside of a component
+    '''
+    def find_recursive_labels(self)->set:
+        count = len(self.starts)
+        edges = [self.successors[block] + [called for called,label in self.calls[block]]
+                 for block in range(0,count)]
+        index = [None]*count
+        low = [0]*count
+        on_stack = [False]*count
+        component = [None]*count
+        stack = []
+        counter = 0
+        components = 0
+        for root in range(0,count):
+            if(index[root] is not None or not self.reachable[root]):continue
+            index[root] = low[root] = counter;counter+=1
+            stack.append(root);on_stack[root] = True
+            path = [(root,0)]
+            while(path):
+                block,next_edge = path[-1]
+                if(next_edge < len(edges[block])):
+                    path[-1] = (block,next_edge+1)
+                    successor = edges[block][next_edge]
+                    if(index[successor] is None):
+                        index[successor] = low[successor] = counter;counter+=1
+                        stack.append(successor);on_stack[successor] = True
+                        path.append((successor,0))
+                    elif(on_stack[successor]):
+                        low[block] = min(low[block],index[successor])
+                else:
+                    path.pop()
+                    if(path):
+                        parent = path[-1][0]
+                        low[parent] = min(low[parent],low[block])
+                    if(low[block] == index[block]):
+                        while(True):
+                            member = stack.pop()
+                            on_stack[member] = False
+                            component[member] = components
+                            if(member == block):break
+                        components+=1
+        return {label for block in range(0,count) if self.reachable[block]
+                for called,label in self.calls[block] if component[called] == component[block]}
+
+'''
+********************
+* Profiling        *
+********************
+To find out where a program spends its time, set profile to True 
+before calling run(). run() then counts every instruction it executes
+in instruction_counts, a list of ints indexed by pc, and 
+profile_report() ranks the instructions by how often they ran. parse()
+keeps the line number that every instruction of asm came from in 
+source_lines, so the report points at the line in the .s file.
+
+Counting is done by wrapping the handler of every instruction (see
+profiled_code()), the same way stack checks are attached (see 
+checked()), so nothing changes in the main loop when profile is off.
+Superinstructions and compiled blocks run many instructions at once,
+so they are not used while profiling. step() counts too, so armdb and
+the last instruction before a step limit are included. See armprof.py
+for a command line interface.
+
+The handlers of bl and ret also keep a shadow call stack in a 
+CallProfile (call_profile), which tells how many instructions ran in
+each procedure and which procedures called it. A bl counts towards 
+the procedure that makes the call and a ret towards the one that 
+returns. A bl to one of the linked_labels is a call that returns
+straight away, without instructions of its own
+'''
+
+'''
+Profile of the calls made by a program. Instead of keeping a copy of
+the call stack for every instruction, the calls are kept in a tree
+(the call tree) with a node for every distinct stack of procedures. 
+Nodes are numbered, node 0 is the root (root, the code that isn't in
+any procedure). For each node it has
+    labels          the procedure (label without colon)
+    parents         the node of the caller (None for the root)
+    children        dict of label to the node of each procedure called
+    counts          instructions executed in the procedure itself with
+                    exactly this stack
+and for each procedure
+    calls           number of times it was called
+    max_depths      most calls of it that were on the stack at once
+                    (more than 1 means it recursed)
+The instructions executed are only given to a node when the stack 
+changes (see account()), so tracking the calls costs nothing for the
+instructions in between
+'''
+class CallProfile:
+    def __init__(self,root:str='_start'):
+        self.labels = [root]
+        self.parents = [None]
+        self.children = [{}]
+        self.counts = [0]
+        self.calls = {root:1}
+        self.max_depths = {root:1}
+        #number of calls of each procedure that are on the stack
+        self.depths = {root:1}
+        #the node of the current stack
+        self.node = 0
+        #value of steps that has been accounted for
+        self.counted = 0
+
+    '''
+    Gives the instructions executed since the last call of account() 
+    to the current stack. steps is the number of instructions executed
+    since the profile was started
+    '''
+    def account(self,steps:int):
+        self.counts[self.node] += steps - self.counted
+        self.counted = steps
+
+    def call(self,label:str,steps:int):
+        self.account(steps)
+        node = self.children[self.node].get(label)
+        if(node is None):
+            node = len(self.labels)
+            self.labels.append(label)
+            self.parents.append(self.node)
+            self.children.append({})
+            self.counts.append(0)
+            self.children[self.node][label] = node
+        self.node = node
+        self.calls[label] = self.calls.get(label,0) + 1
+        depth = self.depths.get(label,0) + 1
+        self.depths[label] = depth
+        if(depth > self.max_depths.get(label,0)):self.max_depths[label] = depth
+
+    def ret(self,steps:int):
+        self.account(steps)
+        #a ret with nothing on the stack stays at the root
+        if(self.node):
+            self.depths[self.labels[self.node]] -= 1
+            self.node = self.parents[self.node]
+
+    '''
+    Returns a dict of procedure to a dict with the number of 'calls', 
+    the instructions executed in the procedure itself ('exclusive') and
+    in it and everything it called ('inclusive'), and 'max_depth'. 
+    Instructions of a recursive procedure are only counted once 
+    towards its inclusive count
+    '''
+    def procedures(self)->dict:
+        count = len(self.labels)
+        #instructions in the subtree of every node. Children always have
+        #a higher number than their parent
+        totals = list(self.counts)
+        for node in range(count-1,0,-1):
+            totals[self.parents[node]] += totals[node]
+        result = {label:{'calls':self.calls[label], 'inclusive':0, 'exclusive':0,
+                         'max_depth':self.max_depths[label]} for label in self.calls}
+        #a node adds its subtree to the inclusive count of its procedure
+        #unless the procedure is already further up the stack
+        active = {}
+        stack = [(0,True)]
+        while(stack):
+            node,entering = stack.pop()
+            label = self.labels[node]
+            if(not entering):
+                active[label] -= 1
                 continue
-            '''
-            A similar procedure is done the .space directive is used
-            We first check if a previously declared variable is being
-            used to determine the size. If so we fetch it and use that,
-            otherwise we just use the number provided. We append a list
-            with n zero values to mem where n is the size we found
-            Additionally, the size is stored in a shadow entry
-            '''
-            if(re.match('.*:\.space.*',line)):
-                line = line.lower()
-                line = line.split(":.space ")
-                size = sym_table[line[1]] if line[1] in sym_table else int(line[1])
-                mem.extend(list([0]*size))    
-                sym_table[line[0]] = index
-                sym_table[line[0]+"_TYPE_"] = 2
-                sym_table[line[0]+"_SIZE_"] = size
-                index+=size
-                continue    
-                
-            '''
-            The .8byte directive is followed by a comma separated list
-            of numbers. Each number will be an 8 byte entry in mem.
-            Additionally, the _SIZE_ shadow entry will be created
-            '''
-            if(re.match('.*:\.8byte.*',line)):
-                line = line.lower()
-                line = line.split(":.8byte ")
-                numbers = list(map(int, line[1].split(',')))
-                #each number is 8 bytes
-                size = len(numbers) * 8
-                for n in numbers:
-                    mem.extend(list(int.to_bytes(n,8,'little')))
-                
-                sym_table[line[0]] = index
-                sym_table[line[0]+"_SIZE_"] = size
-                sym_table[line[0]+"_TYPE_"] = 1 
-                index+=size 
-                continue            
-            '''
-            If using the len=.-str idiom to store str length, we
-            lookup the length of str that we stored in sym_table
-            dict when handling .asciz in the format str_SIZE_ 
-            '''         
-            if(re.match('(.)+=.-(.)+',line)):
-                line = line.lower()
-                line = line.split("=.-")
-                if(line[1] not in sym_table):
-                    raise KeyError("Can't find length of undeclared variable "+line[1])
-                sym_table[line[0]] = sym_table[line[1]+"_SIZE_"]
+            result[label]['exclusive'] += self.counts[node]
+            if(not active.get(label)):
+                result[label]['inclusive'] += totals[node]
+            active[label] = active.get(label,0) + 1
+            stack.append((node,False))
+            stack.extend((child,True) for child in self.children[node].values())
+        return result
+
+    '''
+    Returns the profile in the folded stack format read by flamegraph
+    tools (e.g. flamegraph.pl or speedscope): a line per stack with the
+    procedures from the root down separated by ;, a space and the 
+    number of instructions executed with that stack. If max_depth is
+    given, the instructions of deeper stacks are given to their 
+    ancestor at max_depth, so that deep recursion doesn't make the 
+    output huge
+    '''
+    def folded(self,max_depth:int=None)->str:
+        count = len(self.labels)
+        paths = [None]*count
+        depths = [0]*count
+        counts = list(self.counts)
+        paths[0] = self.labels[0]
+        depths[0] = 1
+        for node in range(1,count):
+            parent = self.parents[node]
+            depths[node] = depths[parent] + 1
+            if(max_depth is not None and depths[node] > max_depth):
+                #point the node at its ancestor at max_depth
+                depths[node] = depths[parent]
+                paths[node] = paths[parent]
+            else:
+                paths[node] = paths[parent] + ';' + self.labels[node]
+        folded = {}
+        for node in range(0,count):
+            if(counts[node]):
+                folded[paths[node]] = folded.get(paths[node],0) + counts[node]
+        return ''.join("{} {}\n".format(path,value) for path,value in folded.items())
+
+'''
+********************
+* Timing Model     *
+********************
+armsim only tells whether a program is correct. To estimate how long
+it would take on real hardware, a TimingModel can be attached to a
+machine (machine.timing = TimingModel()). run() then passes every 
+instruction it executes to the model, which adds up an estimate of 
+the cycles it takes. The default costs are those of the Cortex-A72 in
+the Raspberry Pi 4, taken from the Cortex-A72 Software Optimization 
+Guide. Every instruction belongs to a class, with a latency (cycles 
+until its result can be used) and an issue cost (cycles until the 
+next instruction can start, 0.5 for the two integer pipelines):
+    alu                 mov, add, sub, and, orr, eor, shifts, cmp, csel
+    multiply            mul, madd, msub
+    divide              udiv, sdiv (4 to 20 cycles depending on the 
+                        values, the middle is used)
+    load                ldr and ldp, assuming the data is in the L1 
+                        cache. The base register of a pre/post indexed
+                        load is written back like an alu result
+    store               str and stp
+    branch_not_taken    b.<cond>, cbz and cbnz that fall through
+    branch_taken        taken branches, bl and ret, one cycle more for
+                        fetching from the target
+    syscall             svc, a rough figure for the trip into the 
+                        kernel. It waits for everything before it
+Labels cost nothing. An instruction starts when the previous one has
+issued and all of the registers it reads (the flags count as one) are
+ready, the time spent waiting is counted as stalls. Out of order 
+execution, branch prediction and caches are not modeled, so this is an
+estimate meant to compare programs with each other (e.g. a submission
+with the reference solution), not a prediction of the exact runtime.
+Like profiling, superinstructions and compiled blocks are not used
+while timing, but a run without a timing model is not affected
+'''
+#dict of class to (latency, issue cost) in cycles
+cortex_a72_costs = {
+    'alu':(1,0.5), 'multiply':(3,1), 'divide':(12,12),
+    'load':(4,1), 'store':(1,1),
+    'branch_not_taken':(1,1), 'branch_taken':(1,2),
+    'syscall':(200,200)
+}
+
+#index of the flags in the ready times of a TimingModel
+FLAGS = REGISTER_COUNT
+
+'''
+Returns the class of a decoded instruction (see Timing Model above), 
+or None for labels and lines that failed to decode. Branches are 
+'branch_taken' or 'branch_not_taken' depending on how they go, so
+'branch' is returned for them
+'''
+def timing_class(instr:tuple):
+    op = instr[0]
+    if(op in ('label','invalid')):return None
+    if(op in block_branches or op in ('bl','ret')):return 'branch'
+    if(op == 'svc'):return 'syscall'
+    if(op in ('mul','madd','msub')):return 'multiply'
+    if(op in ('udiv','sdiv')):return 'divide'
+    if(op[0:3] in ('ldr','ldp')):return 'load'
+    if(op[0:3] in ('str','stp')):return 'store'
+    return 'alu'
+
+'''
+Returns the registers a decoded instruction reads and the ones it 
+writes with its result (not counting a written back base register, 
+see block_writes() for that), as two tuples. FLAGS stands for the flags
+'''
+def timing_registers(instr:tuple)->tuple:
+    op = instr[0]
+    if(op == 'bl'):return (),(LR,)
+    if(op == 'ret'):return (LR,),()
+    if(op not in register_operands):return (),()
+    #positions of the operands that are only written
+    if(op[0:3] == 'ldp'):results = (1,2)
+    elif(op[0:3] in ('str','stp') or op in ('cmp_reg','cmp_imm') or op in block_branches):results = ()
+    else:results = (1,)
+    reads = [instr[k] for k in register_operands[op] if k not in results]
+    writes = [instr[k] for k in results]
+    if(op.startswith('b.') or op in ('csel','csinc','cset')):reads.append(FLAGS)
+    if(flag_kind(instr)):writes.append(FLAGS)
+    return tuple(reads),tuple(writes)
+
+'''
+Estimates the cycles a program takes (see Timing Model above). costs 
+is a dict of class to (latency, issue cost). After a run, cycles is 
+the estimate, stalls the cycles spent waiting for registers and 
+class_counts the number of instructions of each class
+'''
+class TimingModel:
+    def __init__(self,costs:dict=cortex_a72_costs):
+        self.costs = costs
+        self.reset()
+        #code of the machine with every handler wrapped (see start())
+        self.code = []
+
+    def reset(self):
+        self.cycle = 0.0
+        self.stalls = 0.0
+        self.instructions = 0
+        self.class_counts = {}
+        #ready[r] is the cycle at which register r (or the flags) can be read
+        self.ready = [0.0]*(REGISTER_COUNT+1)
+
+    '''
+    Resets the model and builds code from the handlers in code (the 
+    machine's code, or its profiled code), with every handler wrapped 
+    so that the instruction is timed after it runs. Called by run() and
+    step() of machine
+    '''
+    def start(self,machine,code:list):
+        self.reset()
+        self.code = []
+        everything = tuple(range(0,REGISTER_COUNT+1))
+        for i,(handler,operands) in enumerate(code):
+            instr = machine.program[i]
+            kind = timing_class(instr)
+            if(kind is None):
+                self.code.append((handler,operands))
                 continue
-            '''
-            This is for when constants are declared with the = sign
-            If assigning an existing value, look it up in the sym_table
-            and if it's not there, then assume a number is being assigned. 
-            '''
-            if(re.match('(.)+=[a-z0-9]+',line)):
-                line = line.lower()
-                line = line.split("=")
-                value = 0
-                if(line[1] in sym_table):
-                    sym_table[line[0]] = sym_table[line[1]]
-                else:
-                    sym_table[line[0]] = int(line[1])
+            reads,writes = timing_registers(instr)
+            if(kind == 'syscall'):reads = everything
+            if(kind == 'branch'):
+                taken = ('branch_taken',) + self.costs['branch_taken']
+                #bl and ret always go somewhere else
+                not_taken = taken if instr[0] in ('bl','ret') else ('branch_not_taken',) + self.costs['branch_not_taken']
+            else:
+                taken = not_taken = (kind,) + self.costs[kind]
+            written_back = tuple(block_writes(instr) - set(writes)) if kind in ('load','store') else ()
+            self.code.append((self.timed(machine,handler,reads,writes,written_back,taken,not_taken),operands))
 
-    #set the break variables to the end of static memory
-    original_break = index
-    brk = original_break
-    assert brk == len(mem), \
-    "mem list likely incorrect- brk: {} len(mem):{}".format(brk,len(mem))
-    #extend mem to make room for the stack, then set the stack pointer
-    #mem.extend(list([0]*HEAP_SIZE))
+    def timed(self,machine,handler,reads,writes,written_back,taken,not_taken):
+        def run(*operands):
+            pc = machine.pc
+            handler(*operands)
+            self.issue(reads,writes,written_back,taken if machine.pc != pc else not_taken)
+        return run
+
+    '''
+    Times one instruction. cost is its (class, latency, issue cost)
+    '''
+    def issue(self,reads,writes,written_back,cost):
+        kind,latency,issue = cost
+        ready = self.ready
+        start = self.cycle
+        for r in reads:
+            if(ready[r] > start):start = ready[r]
+        self.stalls += start - self.cycle
+        self.cycle = start + issue
+        for r in writes:
+            ready[r] = start + latency
+        for r in written_back:
+            ready[r] = start + self.costs['alu'][0]
+        self.instructions += 1
+        self.class_counts[kind] = self.class_counts.get(kind,0) + 1
+
+    '''
+    The estimated number of cycles, once the last instruction has issued
+    '''
+    @property
+    def cycles(self)->int:
+        return math.ceil(self.cycle)
+
+    '''
+    Returns the estimate as a dict with the cycles, instructions, stalls,
+    cycles per instruction ('cpi') and the count of every class
+    '''
+    def report(self)->dict:
+        return {'cycles':self.cycles, 'instructions':self.instructions, 'stalls':math.ceil(self.stalls),
+                'cpi':self.cycle/self.instructions if self.instructions else None,
+                'classes':dict(self.class_counts)}
 
-    
-    
 '''
-This procedure dispatches and executes the provided line
-of assembly code. In order to deal with the myriad
-addressing modes, a regex method is used to match
-the line to the appropriate action. Once an instruction is matched,
-the arguments are extracted with regular epressions.The procedure 
-returns after executing the matched instruction. If no match is
-found an exception is thrown. Both hexadecimal
-and decimal immediate values are supported. The register
-naming convention is rd for destination register, rn
-for the first arg register and rm for the second arg regsiter
-Notes:
--int(str,0) means that both numerical strings and hex strings
-will be properly converted
--Error message is very general, so any syntax errors or use 
-of unsupported instructions will throw the same error.
--If an illegal register is used, it will trigger a syntax error
--If a register is used in a branch instr that doesn't take them,
-an error is raised
+********************
+* Machine          *
+********************
+A Machine holds all of the state of one simulated program: the 
+instructions, the symbol table, memory, registers, flags and the
+static rule settings. Several machines can be kept alive at once, 
+for example to keep many parsed programs around, or to run them 
+from different threads. Usage:
+    machine = Machine()
+    with open('my_file.s','r') as f:
+        machine.parse(f)
+    machine.run()
+    print(machine.reg['x0'])
+The module level functions (parse(), run(), reset(), ...) and 
+variables (reg, asm, forbid_loops, ...) all refer to default_machine,
+see the end of this file
 '''
-def execute(line:str):
-    global pc,n_flag,z_flag,label_hit_counts,mem
-    global original_break,brk,STACK_SIZE, HEAP_SIZE
-    global register_regex,num_regex,var_regex,label_regex
-        
-    #remove spaces around commas
-    line = re.sub('[ ]*,[ ]*',',',line)
-    #octothorpe is optional, remove it
-    line = re.sub('#','',line) 
+class Machine:
+    def __init__(self):
+        '''
+        State variables
+        '''
+        #list to hold the instructions
+        self.asm = []
+        #source_lines[i] is the line number (starting at 1) of asm[i] in
+        #the lines given to parse()
+        self.source_lines = []
+        #list to hold the decoded instructions (see decode_program()).
+        #program[i] is the decoded form of asm[i]
+        self.program = []
+        #list of (handler, operands) pairs executed by the main loop
+        #(see link_program()). code[i] executes program[i]
+        self.code = []
+        #code with some pairs of instructions fused into one handler
+        #(see fuse_code())
+        self.fused_code = []
+        #dict of label (including colon) to its index in asm. Built once by
+        #load() and used to resolve branches and to check for labels
+        self.label_index = {}
+        #copy of asm at the time load() was last called, so the program is 
+        #only indexed and decoded again if asm changes
+        self.loaded_asm = []
+        #points to the original break, which comes after the static data
+        self.original_break = 0
+        #points to current break
+        self.brk = 0
+        #list of register values, indexed by register number (see 
+        #Register File above)
+        self.registers = [0]*REGISTER_COUNT
+        #view of the registers by name, e.g. reg['x0']
+        self.reg = RegisterView(self.registers)
+        #program counter
+        self.pc = 0
+        #the NZCV flags, recorded lazily (see Condition Flags above).
+        #They can be read with n_flag, z_flag, c_flag and v_flag
+        self.flags = ('set',0,0)
+
+        '''
+        dict to hold how often a label has been seen. Intialized in the
+        run() procedure, then updated in the main loop every time a label is
+        hit. Since the BL instruction does not cause the pc to actually
+        land on the label, label_hit_counts must also be updated in execute()
+        when a BL instruction is matched (colon must be included)
+        '''
+        self.label_hit_counts = {}
+
+        '''
+        dict to hold "external" labels that can be targets for BL.
+        The key is a label (including colon) and the value is a python
+        function
+        '''
+        self.linked_labels = {}
+        #the linked_labels that code was built with (see link_program())
+        self.linked = set()
+
+        '''
+        A map of string to int, where int will either be
+        an index into the mem array or a size in bytes.
+        Basically, vars declared with a : will be addresses and
+        vars declared with = will be literals
+        Additionally the directive type will be stored in the following way:
+        -an key in the form <var>_TYPE_ will map to
+        0 -> asciz
+        1 -> 8byte
+        2 -> space
+        NB. vars declared with = (ie length variables) are just stored in
+        sym_table as numbers, so they don't have a type
+        Types are stored primarily for the get_data procedure
+        '''
+        self.sym_table = {}
+
+        '''
+        Data is stored in a Memory, which is allocated a page at a time as 
+        it is written (see Memory above). String data gets converted with
+        bytes(str,'ascii') and numbers are packed into 8 little endian bytes
+        with the struct module.
+        Single bytes and strings are accessed with an index and a size using the
+        format [addr:addr+size]. 8 byte values are read and written in place with
+        mem.load_quad(addr) and mem.store_quad(addr,value), which avoids
+        creating temporary lists and bytes objects.
+        The stack pointer also points to the end of this list and grows down.
+        It's first filled with the stack, then static data, then the heap. This
+        ensures that increasing the heap does not shift the stack or static data.
+        The sp (stack pointer) register will point to the end of its section
+        and the heap pointer will point beginning of it's section to start
+        Thus, we get the following diagram
+
+        | stack | static | heap |
+                ^        ^     
+            <--sp        hp -->
+        '''
+        self.mem = Memory()
+
+        '''
+        Static Rule Variables:
+        Specify properties that a program must have
+        --disallow certain instructions
+        --require/forbid recursion
+        '''
+        #A set that contains the mnemonic of instructions that you don't want used 
+        #for a particular run of the the program
+        self.forbidden_instructions = set()
+
+        #recursion flags
+        self.forbid_recursion = False
+        self.require_recursion = False
+        #loop flag
+        self.forbid_loops = False
+
+        #dead code flag
+        self.check_dead_code = False
+
+        #labels (without colon) that were called recursively during
+        #the last run(). Updated by bl
+        self.recursed_labels = set()
+
+        #set to add labels that should be recursively called
+        #(do not include colon)
+        self.recursive_labels = set()
+
+        '''
+        Block compiler variables (see Block Compiler above)
+        '''
+        #if True, run() compiles basic blocks that are executed often
+        self.compile_blocks = True
+        #number of times a block has to be entered before it is compiled
+        self.block_threshold = 16
+        #blocks[i] is the compiled function for the block starting at asm[i].
+        #None means it hasn't been compiled (yet) and False means that no
+        #block starts at i or it can't be compiled
+        self.blocks = []
+        #block_counts[i] is the number of times the block starting at asm[i]
+        #has been entered by the main loop
+        self.block_counts = []
+        #block_sizes[i] is the number of instructions in the compiled block
+        #starting at asm[i] (used to keep steps up to date)
+        self.block_sizes = []
+        #if True, run() executes common pairs of instructions with a
+        #single handler (see fuse_code())
+        self.fuse_instructions = True
+        #control flow graph of program, built by find_blocks() (see 
+        #Control Flow Graph above)
+        self.cfg = ControlFlowGraph([])
+
+        #number of instructions executed by run() or step() (labels
+        #are not counted)
+        self.steps = 0
+        #if True, run() and step() count how often every instruction is
+        #executed (see Profiling above)
+        self.profile = False
+        #instruction_counts[i] is the number of times asm[i] was executed
+        #by the last run() (and the step() calls since), when profiling
+        self.instruction_counts = []
+        #the calls made while profiling (see CallProfile)
+        self.call_profile = CallProfile()
+        #code that run() and step() use when profiling (see 
+        #profiled_code())
+        self.profiled = []
+        #if set to a TimingModel, run() and step() estimate the cycles
+        #the program takes (see Timing Model above)
+        self.timing = None
+        #where the program's input comes from (see InputSource)
+        self.stdin = InputSource()
+        #where the program's output goes (see OutputSink)
+        self.stdout = OutputSink()
+        #everything written to stdout by the program
+        self.output = bytearray()
+        #the state of the machine at the end of parse(), which restore()
+        #goes back to. None until a program has been parsed
+        self.initial_state = None
+
+        #dict of mnemonic to decoder (see decode())
+        self.decoders = {
+            'ldp':self.decode_pair, 'stp':self.decode_pair,
+            'ldr':self.decode_single, 'str':self.decode_single,
+            'mov':self.decode_mov,
+            'asr':self.decode_shift, 'lsl':self.decode_shift, 'lsr':self.decode_shift,
+            'mul':self.decode_multiply, 'udiv':self.decode_multiply, 'sdiv':self.decode_multiply,
+            'madd':self.decode_multiply_add, 'msub':self.decode_multiply_add,
+            'cmp':self.decode_cmp,
+            'csel':self.decode_csel, 'csinc':self.decode_csel, 'cset':self.decode_cset,
+            'cbz':self.decode_cbz, 'cbnz':self.decode_cbz,
+            'b':self.decode_b, 'bl':self.decode_bl, 'ret':self.decode_ret, 'svc':self.decode_svc
+        }
+        for op in ['add','sub','and','orr','eor']:
+            self.decoders[op] = self.decoders[op+'s'] = self.decode_arithmetic
+        for cond in branch_conditions:
+            self.decoders['b.'+cond] = self.decoders['b'+cond] = self.decode_b
+
+        #dict of opcode to instruction handler
+        self.handlers = {
+            'ldp':self.op_ldp, 'ldp_pre':self.op_ldp_pre, 'ldp_post':self.op_ldp_post,
+            'stp':self.op_stp, 'stp_pre':self.op_stp_pre, 'stp_post':self.op_stp_post,
+            'ldr_sym':self.op_ldr_sym, 'ldr':self.op_ldr, 'ldr_reg':self.op_ldr_reg, 'ldr_pre':self.op_ldr_pre, 'ldr_post':self.op_ldr_post,
+            'str':self.op_str, 'str_reg':self.op_str_reg, 'str_pre':self.op_str_pre, 'str_post':self.op_str_post,
+            'mov_imm':self.op_mov_imm, 'mov_reg':self.op_mov_reg,
+            'asr':self.op_asr, 'lsl':self.op_lsl, 'lsr':self.op_lsr,
+            'add_imm':self.op_add_imm, 'add_reg':self.op_add_reg, 'sub_imm':self.op_sub_imm, 'sub_reg':self.op_sub_reg,
+            'mul':self.op_mul, 'udiv':self.op_udiv, 'sdiv':self.op_sdiv, 'msub':self.op_msub, 'madd':self.op_madd,
+            'cmp_reg':self.op_cmp_reg, 'cmp_imm':self.op_cmp_imm,
+            'and_imm':self.op_and_imm, 'and_reg':self.op_and_reg, 'orr_imm':self.op_orr_imm, 'orr_reg':self.op_orr_reg, 'eor_imm':self.op_eor_imm,
+            'cbnz':self.op_cbnz, 'cbz':self.op_cbz, 'b':self.op_b,
+            'csel':self.op_csel, 'csinc':self.op_csinc, 'cset':self.op_cset,
+            'bl':self.op_bl, 'ret':self.op_ret, 'svc':self.op_svc,
+            'label':self.op_label, 'invalid':self.op_invalid
+        }
+        for cond in branch_conditions:
+            self.handlers['b.'+cond] = self.op_b_cond(cond)
+
+    '''
+    This procedure reads the lines of a program (which can be a .s file
+    or just a list of assembly instructions) and populates the
+    sym_table, mem, and asm data structures. It uses
+    boolean flags to determine which datastructure is currently
+    being populated. These flags change upon encountering specific
+    keywords. Those keywords are .data or .bss for declaring constants
+    and buffers and main: or _start: for code. lines can be any 
+    iterable of strings, e.g. an open file, and is only read once.
+    Every line is only looked at once, and the data of .8byte and 
+    .asciz directives is converted in one go and written straight into
+    mem, so big generated arrays load quickly
+    '''
+    def parse(self,lines)->None:
+        #booleans for parsing .s file
+        comment = False
+        code = False
+        data = False
+        bss = False 
     
-    #use abbreviations for the regexes
-    rg = register_regex
-    num = num_regex
-    var = var_regex
-    lab = label_regex
+        #allocate the stack (nothing is allocated until it is written)
+        #and set the stack pointer
+        self.mem.resize(self.mem.size + STACK_SIZE)
+        self.registers[SP] = self.mem.size - 1
+        '''
+        This is a counter that is used to assign an "address" in mem
+        to a symbol. Basically the value in sym_table when a key is one of 
+        the user defined variables. It's incremented for every variable encountered
+        by the size of the data stored in mem
+        '''
+        index = self.mem.size
+        #data of .8byte and .asciz directives that hasn't been written 
+        #to mem yet. It is written in one go when a .space directive or 
+        #the end of the program is reached
+        pending = bytearray()
+
     
-    #all labels in program (better feedback for typos/malformed branches
-    #[:-1] is so that the colon in the label is not included
-    labels = [l[:-1] for l in asm if(re.match('{}:'.format(lab),l))]
-    '''
-    ldp instructions
-    ''' 
-    #ldp rt, rt2, [rn]
-    #dollar sign so it doesn't match post index
-    if(re.match('ldp {},{},\[{}\]$'.format(rg,rg,rg),line)):
-        rt = re.findall(rg,line)[0]
-        rt2 = re.findall(rg,line)[1]
-        rn = re.findall(rg,line)[2]
-        addr = reg[rn]
-        #check for out of bounds mem access
-        if(addr < reg['sp'] or addr > len(mem) - 16):
-            raise ValueError("out of bounds memory access: {}".format(line))
-        reg[rt] = int.from_bytes(bytes(mem[addr:addr+8]),'little')
-        addr += 8
-        reg[rt2] = int.from_bytes(bytes(mem[addr:addr+8]),'little')
-        return
-    #ldp rt, rt2, [rn, imm]
-    #dollar sign so it doesn't match pre index
-    if(re.match('ldp {},{},\[{},{}\]$'.format(rg,rg,rg,num),line)):
-        rt = re.findall(rg,line)[0]
-        rt2 = re.findall(rg,line)[1]
-        rn = re.findall(rg,line)[2]
-        imm = int(re.findall(num,line)[-1],0)
-        addr = reg[rn] + imm
-        #check for out of bounds mem access
-        if(addr < reg['sp'] or addr > len(mem) - 16):
-            raise ValueError("out of bounds memory access: {}".format(line))
-        reg[rt] = int.from_bytes(bytes(mem[addr:addr+8]),'little')
-        addr += 8
-        reg[rt2] = int.from_bytes(bytes(mem[addr:addr+8]),'little')
-        return
+        for number,line in enumerate(lines,1):
+            line = line.strip()
+            #convert multiple spaces into one space 
+            if('  ' in line or '\t' in line):line = spaces_regex.sub(' ',line)
+            if('/*' in line and '*/' in line):continue
+            if('//' in line):continue
+            if("/*" in line):comment = True;continue
+            if("*/" in line):comment = False;continue
+            if(".data" in line):data = True;code = False;bss = False;continue
+            if(".bss" in line):data = False;code = False;bss = True;continue
+            if("main:" in line or "_start:" in line):code = True;data = False;bss = False;continue
+            if(code and not comment and len(line)>0):
+                self.asm.append(line.lower())
+                self.source_lines.append(number)
+            if((data or bss) and not comment):
+                directive = directive_regex.match(line)
+                if(directive is None):
+                    #remove whitespace surrounding punctuation, so that
+                    #the constants below can be split on = and =.-
+                    line = punctuation_regex.sub('',line)
+                    '''
+                    If using the len=.-str idiom to store str length, we
+                    lookup the length of str that we stored in sym_table
+                    dict when handling .asciz in the format str_SIZE_ 
+                    '''
+                    if(length_regex.match(line)):
+                        line = line.lower()
+                        line = line.split("=.-")
+                        if(line[1] not in self.sym_table):
+                            raise KeyError("Can't find length of undeclared variable "+line[1])
+                        self.sym_table[line[0]] = self.sym_table[line[1]+"_SIZE_"]
+                        continue
+                    '''
+                    This is for when constants are declared with the = sign
+                    If assigning an existing value, look it up in the sym_table
+                    and if it's not there, then assume a number is being assigned. 
+                    '''
+                    if(constant_regex.match(line)):
+                        line = line.lower()
+                        line = line.split("=")
+                        if(line[1] in self.sym_table):
+                            self.sym_table[line[0]] = self.sym_table[line[1]]
+                        else:
+                            self.sym_table[line[0]] = int(line[1])
+                    continue
+                name,kind,operands = directive.groups()
+                name = punctuation_regex.sub('',name).lower()
+                '''
+                When encountering something like s: .asciz "a"
+                we want to make s a new key in the sym_table dict and 
+                set its value equal to the string. Additionally
+                we save the length of the string in a "shadow entry"
+                in sym_table in case someone wants to find the length
+                using the -. idiom. The string gets converted to bytes
+                before it is written to mem. Spaces in front of 
+                punctuation are removed from the string, like they 
+                always have been
+                '''
+                if(kind == 'asciz'):
+                    #remove quote characters
+                    text = punctuation_regex.sub('',operands).replace('"','')
+                    #escape characters get mangled to \\<char>, convert to \<char>
+                    #for now just tab, carriage return, and newline 
+                    if('\\' in text):
+                        text = text.replace('\\n','\n').replace('\\t','\t').replace('\\r','\r')
+                    data_bytes = bytes(text,'ascii')
+                    data_type = 0
+                '''
+                A similar procedure is done the .space directive is used
+                We first check if a previously declared variable is being
+                used to determine the size. If so we fetch it and use that,
+                otherwise we just use the number provided. Nothing is 
+                written to mem, it only grows by the size (see Memory)
+                '''
+                if(kind == 'space'):
+                    operands = operands.strip().lower()
+                    size = self.sym_table[operands] if operands in self.sym_table else int(operands)
+                    self.mem.extend(pending)
+                    pending.clear()
+                    self.mem.resize(self.mem.size + size)
+                    self.sym_table[name] = index
+                    self.sym_table[name+"_TYPE_"] = 2
+                    self.sym_table[name+"_SIZE_"] = size
+                    index+=size
+                    continue
+                '''
+                The .8byte directive is followed by a comma separated list
+                of numbers. Each number will be an 8 byte entry in mem.
+                The numbers are converted by array, numbers that don't 
+                fit in 64 bits signed are wrapped like before
+                '''
+                if(kind == '8byte'):
+                    if('- ' in operands):operands = operands.replace('- ','-')
+                    numbers = operands.split(',')
+                    try:
+                        words = array.array('q',map(int,numbers))
+                    except OverflowError:
+                        words = array.array('q',[signed(int(number)) for number in numbers])
+                    if(sys.byteorder == 'big'):words.byteswap()
+                    data_bytes = words.tobytes()
+                    data_type = 1
+                self.sym_table[name] = index
+                self.sym_table[name+"_SIZE_"] = len(data_bytes)
+                self.sym_table[name+"_TYPE_"] = data_type
+                pending += data_bytes
+                index+=len(data_bytes)
+        self.mem.extend(pending)
+
+        #set the break variables to the end of static memory
+        self.original_break = index
+        self.brk = self.original_break
+        assert self.brk == self.mem.size, \
+        "mem likely incorrect- brk: {} len(mem):{}".format(self.brk,self.mem.size)
+        self.snapshot()
+        #extend mem to make room for the stack, then set the stack pointer
+        #mem.extend(list([0]*HEAP_SIZE))
+
     
-    #ldp rt, rt2, [rn, imm]! //pre index
-    if(re.match('ldp {},{},\[{},{}\]!$'.format(rg,rg,rg,num),line)):
-        rt = re.findall(rg,line)[0]
-        rt2 = re.findall(rg,line)[1]
-        rn = re.findall(rg,line)[2]
-        imm = int(re.findall(num,line)[-1],0)
-        reg[rn] += imm
-        addr = reg[rn]
-        #check for out of bounds mem access
-        if(addr < reg['sp'] or addr > len(mem) - 16):
-            raise ValueError("out of bounds memory access: {}".format(line))
-        reg[rt] = int.from_bytes(bytes(mem[addr:addr+8]),'little')
-        addr += 8
-        reg[rt2] = int.from_bytes(bytes(mem[addr:addr+8]),'little')
-        return
-    #ldp rt, rt2, [rn], imm //post index
-    if(re.match('ldp {},{},\[{}\],{}$'.format(rg,rg,rg,num),line)):
-        rt = re.findall(rg,line)[0]
-        rt2 = re.findall(rg,line)[1]
-        rn = re.findall(rg,line)[2]
-        imm = int(re.findall(num,line)[-1],0)
-        addr = reg[rn]
-        #check for out of bounds mem access
-        if(addr < reg['sp'] or addr > len(mem) - 16):
-            raise ValueError("out of bounds memory access: {}".format(line))
-        reg[rt] = int.from_bytes(bytes(mem[addr:addr+8]),'little')
-        addr += 8
-        reg[rt2] = int.from_bytes(bytes(mem[addr:addr+8]),'little')
-        reg[rn] += imm
-        #check for out of bounds pointer
-        if(reg[rn] > len(mem) and reg[rn] < reg['sp']):
-            raise ValueError("register {} points to out of bounds memory".format(reg[rn]))
-        return
+    
+    '''
+    This procedure decodes the provided line of assembly code into
+    a tuple of the form (opcode, operands...). The first word of the line
+    (the mnemonic) is used to look up a decoder in the decoders dict 
+    (see __init__()), and only that decoder's patterns are matched, so
+    the cost of decoding a line doesn't depend on how many instructions
+    are supported. In order to deal with the myriad addressing modes, 
+    each decoder matches the operands against a regex for every format
+    it supports (see Decoder Patterns above). The operands are captured
+    by the regex and converted to their final form: registers are kept 
+    as names, immediates are converted to ints and branch labels are 
+    resolved to their index in asm. Decoding is done once per line of 
+    the program (see decode_program()) so that the regular expressions
+    are not matched again every time an instruction is executed. If no 
+    match is found an exception is thrown. Both hexadecimal and decimal
+    immediate values are supported. The register naming convention is 
+    rd for destination register, rn for the first arg register and rm 
+    for the second arg regsiter
+    Notes:
+    -int(str,0) means that both numerical strings and hex strings
+    will be properly converted
+    -Error message is very general, so any syntax errors or use 
+    of unsupported instructions will throw the same error.
+    -If an illegal register is used, it will trigger a syntax error
+    -If a register is used in a branch instr that doesn't take them,
+    an error is raised
+    -Memory instructions keep the original line so that out of bounds
+    errors can report it
+    '''
+    def decode(self,line:str)->tuple:
+    
+        #labels are kept in the decoded program so that pc still
+        #indexes asm, but they don't do anything when executed
+        if(label_line_regex.match(line)):
+            return ('label',line)
+    
+        #remove spaces around commas
+        line = comma_regex.sub(',',line)
+        #octothorpe is optional, remove it
+        line = line.replace('#','')
+        mnemonic,_,operands = line.partition(' ')
+        decoder = self.decoders.get(mnemonic)
+        instr = decoder(mnemonic,operands,line) if decoder else None
+        if(instr is None):
+            raise ValueError("Unsupported instruction or syntax error: "+line)
+        return instr
+
+    '''
+    Decoders. Each one takes the mnemonic, the operands (the rest of the 
+    line after the mnemonic) and the whole line, and returns the decoded
+    instruction or None if the operands don't match any of its formats
+    '''
+    #ldp/stp rt, rt2, [rn]
+    #ldp/stp rt, rt2, [rn, imm]
+    #ldp/stp rt, rt2, [rn, imm]! //pre index
+    #ldp/stp rt, rt2, [rn], imm  //post index
+    def decode_pair(self,mnemonic,operands,line):
+        target = write_register if mnemonic == 'ldp' else read_register
+        for pattern,suffix in pair_patterns:
+            m = pattern.match(operands)
+            if(m):
+                rt,rt2,rn,imm = m.groups()
+                if(suffix and rn == 'xzr'):raise ValueError("xzr can't be written back: "+line)
+                return (mnemonic+suffix,target(rt),target(rt2),read_register(rn),int(imm,0) if imm else 0,line)
+    #ldr rt, =<var>
+    #ldr/str rt, [rn]
+    #ldr/str rt, [rn, imm]
+    #ldr/str rt, [rn, rm]
+    #ldr/str rt, [rn, imm]! //pre index
+    #ldr/str rt, [rn], imm  //post index
+    def decode_single(self,mnemonic,operands,line):
+        target = write_register if mnemonic == 'ldr' else read_register
+        if(mnemonic == 'ldr'):
+            m = ldr_sym_pattern.match(operands)
+            if(m):
+                return ('ldr_sym',write_register(m.group(1)),self.sym_table[m.group(2)])
+        m = single_reg_pattern.match(operands)
+        if(m):
+            rt,rn,rm = m.groups()
+            return (mnemonic+'_reg',target(rt),read_register(rn),read_register(rm),line)
+        for pattern,suffix in single_patterns:
+            m = pattern.match(operands)
+            if(m):
+                rt,rn,imm = m.groups()
+                if(suffix and rn == 'xzr'):raise ValueError("xzr can't be written back: "+line)
+                return (mnemonic+suffix,target(rt),read_register(rn),int(imm,0) if imm else 0,line)
+    #mov rd, imm
+    #mov rd, rn
+    def decode_mov(self,mnemonic,operands,line):
+        m = reg_imm_pattern.match(operands)
+        if(m):
+            return ('mov_imm',write_register(m.group(1)),signed(int(m.group(2),0)))
+        m = reg_reg_pattern.match(operands)
+        if(m):
+            return ('mov_reg',write_register(m.group(1)),read_register(m.group(2)))
+    #asr/lsl/lsr rd, rn, imm
+    def decode_shift(self,mnemonic,operands,line):
+        m = reg_reg_imm_pattern.match(operands)
+        if(m):
+            return (mnemonic,write_register(m.group(1)),read_register(m.group(2)),int(m.group(3),0))
+    #add{s}/sub{s}/and{s}/orr{s}/eor{s} rd, rn, imm
+    #add{s}/sub{s}/and{s}/orr{s} rd, rn, rm
+    #the last operand is True if the 's' suffix was used
+    def decode_arithmetic(self,mnemonic,operands,line):
+        op = mnemonic[0:3]
+        s = len(mnemonic) == 4
+        m = reg_reg_imm_pattern.match(operands)
+        if(m):
+            return (op+'_imm',write_register(m.group(1)),read_register(m.group(2)),signed(int(m.group(3),0)),s)
+        m = reg_reg_reg_pattern.match(operands)
+        #there is no register form of eor
+        if(m and op != 'eor'):
+            return (op+'_reg',write_register(m.group(1)),read_register(m.group(2)),read_register(m.group(3)),s)
+    #mul/udiv/sdiv rd, rn, rm
+    def decode_multiply(self,mnemonic,operands,line):
+        m = reg_reg_reg_pattern.match(operands)
+        if(m):
+            rd,rn,rm = m.groups()
+            return (mnemonic,write_register(rd),read_register(rn),read_register(rm))
+    #madd/msub rd, rn, rm, ra
+    def decode_multiply_add(self,mnemonic,operands,line):
+        m = four_reg_pattern.match(operands)
+        if(m):
+            rd,rn,rm,ra = m.groups()
+            return (mnemonic,write_register(rd),read_register(rn),read_register(rm),read_register(ra))
+    #cmp rn, rm
+    #cmp rn, imm
+    def decode_cmp(self,mnemonic,operands,line):
+        m = reg_reg_pattern.match(operands)
+        if(m):
+            rn,rm = m.groups()
+            assert rm != 'sp', "2nd register in cmp can't be sp"
+            return ('cmp_reg',read_register(rn),read_register(rm))
+        m = reg_imm_pattern.match(operands)
+        if(m):
+            return ('cmp_imm',read_register(m.group(1)),signed(int(m.group(2),0)))
+    #csel/csinc rd, rn, rm, <cond>
+    def decode_csel(self,mnemonic,operands,line):
+        m = csel_pattern.match(operands)
+        if(m):
+            rd,rn,rm,cond = m.groups()
+            return (mnemonic,write_register(rd),read_register(rn),read_register(rm),cond)
+    #cset rd, <cond>
+    def decode_cset(self,mnemonic,operands,line):
+        m = cset_pattern.match(operands)
+        if(m):
+            return ('cset',write_register(m.group(1)),m.group(2))
+    '''
+    branch instructions
+    NB. A value error is raised if a register is included where it shouldn't be
+    Labels are resolved to the index of the label in asm. The
+    branch sets the pc to this index, so execution resumes on
+    the line after the label
+    '''
+    #cbz/cbnz rn, <label>
+    def decode_cbz(self,mnemonic,operands,line):
+        m = reg_label_pattern.match(operands)
+        if(m):
+            if(len(re.findall(register_regex,line)) != 1): raise ValueError("{} takes one register".format(mnemonic))
+            return (mnemonic,read_register(m.group(1)),self.label_target(m.group(2)+':'))
+    #b <label>
+    #b.<cond> <label> (or b<cond> <label>)
+    #the condition code becomes part of the opcode (b.lt, b.le, ...)
+    def decode_b(self,mnemonic,operands,line):
+        m = label_pattern.match(operands)
+        if(m):
+            cond = mnemonic[1:].lstrip('.')
+            if(len(re.findall(register_regex,line)) != 0): raise ValueError("b{} takes no registers".format(cond))
+            opcode = 'b.'+cond if cond else 'b'
+            return (opcode,self.label_target(m.group(1)+':'))
+    #bl <label>
+    #bl can branch to a local assembly procedure or to an externally defined
+    #python function. The target is None if the label isn't in asm. 
+    #Whether the label is one of the linked_labels is only looked at by
+    #link_program(), so the decoded program doesn't depend on them
+    def decode_bl(self,mnemonic,operands,line):
+        m = label_pattern.match(operands)
+        if(m):
+            if(len(re.findall(register_regex,line)) != 0): raise ValueError("bl takes no registers")
+            label = m.group(1) + ':'
+            return ('bl',label,self.label_index.get(label))
+    #ret 
+    def decode_ret(self,mnemonic,operands,line):
+        if(not operands):
+            return ('ret',)
+    #svc 0
+    def decode_svc(self,mnemonic,operands,line):
+        if(operands == '0'):
+            return ('svc',)
 
     '''
-    stp instructions
+    Looks up the index of a label (including colon) in label_index
     '''
-    #stp rt, rt2, [rn]
-    #dollar sign so it doesn't match post index
-    if(re.match('stp {},{},\[{}\]$'.format(rg,rg,rg),line)):
-        rt = re.findall(rg,line)[0]
-        rt2 = re.findall(rg,line)[1]
-        rn = re.findall(rg,line)[2]        
-        addr = reg[rn]
+    def label_target(self,label:str)->int:
+        if(label not in self.label_index):
+            raise ValueError("{} is not a label in the program".format(label[:-1]))
+        return self.label_index[label]
+
+
+    '''
+    Instruction handlers. Each one takes the operands produced by decode()
+    (everything after the opcode) and updates the state of the machine. 
+    They are looked up by opcode in the handlers dict (see __init__()).
+    '''
+    #ldp rt, rt2, [rn, imm]
+    def op_ldp(self,rt,rt2,rn,imm,line):
+        addr = self.registers[rn] + imm
         #check for out of bounds mem access
-        if(addr < reg['sp'] or addr > len(mem) - 16):
+        if(addr < self.registers[SP] or addr > self.mem.size - 16):
             raise ValueError("out of bounds memory access: {}".format(line))
-        mem[addr:addr+8] = list(int.to_bytes((reg[rt]),8,'little'))
-        addr += 8
-        mem[addr:addr+8] = list(int.to_bytes((reg[rt2]),8,'little'))
-        return   
-    
+        self.registers[rt],self.registers[rt2] = self.mem.load_pair(addr)
+    #ldp rt, rt2, [rn, imm]! //pre index
+    def op_ldp_pre(self,rt,rt2,rn,imm,line):
+        self.registers[rn] += imm
+        self.op_ldp(rt,rt2,rn,0,line)
+    #ldp rt, rt2, [rn], imm //post index
+    def op_ldp_post(self,rt,rt2,rn,imm,line):
+        self.op_ldp(rt,rt2,rn,0,line)
+        self.registers[rn] += imm
+        #check for out of bounds pointer
+        if(self.registers[rn] > self.mem.size and self.registers[rn] < self.registers[SP]):
+            raise ValueError("register {} points to out of bounds memory".format(self.registers[rn]))
     #stp rt, rt2, [rn, imm]
-    #dollar sign so it doesn't match pre index
-    if(re.match('stp {},{},\[{},{}\]$'.format(rg,rg,rg,num),line)):
-        rt = re.findall(rg,line)[0]
-        rt2 = re.findall(rg,line)[1]
-        rn = re.findall(rg,line)[2]
-        imm = int(re.findall(num,line)[-1],0)        
-        addr = reg[rn] + imm
+    def op_stp(self,rt,rt2,rn,imm,line):
+        addr = self.registers[rn] + imm
         #check for out of bounds mem access
-        if(addr < reg['sp'] or addr > len(mem) - 16):
+        if(addr < self.registers[SP] or addr > self.mem.size - 16):
             raise ValueError("out of bounds memory access: {}".format(line))
-        mem[addr:addr+8] = list(int.to_bytes((reg[rt]),8,'little'))
-        addr += 8
-        mem[addr:addr+8] = list(int.to_bytes((reg[rt2]),8,'little'))
-        return 
+        self.mem.store_pair(addr,self.registers[rt],self.registers[rt2])
     #stp rt, rt2, [rn, imm]! //pre index
-    if(re.match('stp {},{},\[{},{}\]!$'.format(rg,rg,rg,num),line)):
-        rt = re.findall(rg,line)[0]
-        rt2 = re.findall(rg,line)[1]
-        rn = re.findall(rg,line)[2]        
-        imm = int(re.findall(num,line)[-1],0)
-        reg[rn] += imm
-        addr = reg[rn]
-        #check for out of bounds mem access
-        if(addr < reg['sp'] or addr > len(mem) - 16):
-            raise ValueError("out of bounds memory access: {}".format(line))
-        mem[addr:addr+8] = list(int.to_bytes((reg[rt]),8,'little'))
-        addr += 8
-        mem[addr:addr+8] = list(int.to_bytes((reg[rt2]),8,'little'))
-        return
+    def op_stp_pre(self,rt,rt2,rn,imm,line):
+        self.registers[rn] += imm
+        self.op_stp(rt,rt2,rn,0,line)
     #stp rt, rt2, [rn], imm //post index
-    if(re.match('stp {},{},\[{}\],{}$'.format(rg,rg,rg,num),line)):
-        rt = re.findall(rg,line)[0]
-        rt2 = re.findall(rg,line)[1]
-        rn = re.findall(rg,line)[2]        
-        imm = int(re.findall(num,line)[-1],0)
-        addr = reg[rn]
-        #check for out of bounds mem access
-        if(addr < reg['sp'] or addr > len(mem) - 16):
-            raise ValueError("out of bounds memory access: {}".format(line))
-        mem[addr:addr+8] = list(int.to_bytes((reg[rt]),8,'little'))
-        addr += 8
-        mem[addr:addr+8] = list(int.to_bytes((reg[rt2]),8,'little'))
-        reg[rn] += imm
+    def op_stp_post(self,rt,rt2,rn,imm,line):
+        self.op_stp(rt,rt2,rn,0,line)
+        self.registers[rn] += imm
         #check for out of bounds pointer
-        if(reg[rn] > len(mem) and reg[rn] < reg['sp']):
-            raise ValueError("register {} points to out of bounds memory".format(reg[rn]))
-        return
-    '''
-    ldr instructions
-    '''
+        if(self.registers[rn] > self.mem.size and self.registers[rn] < self.registers[SP]):
+            raise ValueError("register {} points to out of bounds memory".format(self.registers[rn]))
     #ldr rt, =<var>
-    if(re.match('ldr {},={}$'.format(rg,var),line)):
-        rt = re.findall(rg,line)[0]
-        v = re.findall('='+var,line)[0][1:]
-        reg[rt] = sym_table[v]
-        return
-    #ldr rt, [rn]
-    #dollar sign so it doesn't match post index
-    if(re.match('ldr {},\[{}\]$'.format(rg,rg),line)):
-        rt = re.findall(rg,line)[0]
-        rn = re.findall(rg,line)[1]
-        addr = reg[rn]
+    #the address (or value) of var was looked up when decoding
+    def op_ldr_sym(self,rt,value):
+        self.registers[rt] = value
+    #load 8 bytes starting at addr and convert to int
+    def load_mem(self,rt,addr,line):
         #check for out of bounds mem access
-        if(addr < reg['sp'] or addr > len(mem) - 8):
+        if(addr < self.registers[SP] or addr > self.mem.size - 8):
             raise ValueError("out of bounds memory access: {}".format(line))
-        #load 8 bytes starting at addr and convert to int
-        reg[rt] = int.from_bytes(bytes(mem[addr:addr+8]),'little')
-        return
+        self.registers[rt] = self.mem.load_quad(addr)
     #ldr rt, [rn, imm]
-    #dollar sign so it doesn't match pre index
-    if(re.match('ldr {},\[{},{}\]$'.format(rg,rg,num),line)):
-        rt = re.findall(rg,line)[0]
-        rn = re.findall(rg,line)[1]
-        imm = int(re.findall(num,line)[-1],0)
-        addr = reg[rn] + imm
-        #check for out of bounds mem access
-        if(addr < reg['sp'] or addr > len(mem) - 8):
-            raise ValueError("out of bounds memory access: {}".format(line))
-        #load 8 bytes starting at addr and convert to int
-        reg[rt] = int.from_bytes(bytes(mem[addr:addr+8]),'little')
-        return
+    def op_ldr(self,rt,rn,imm,line):
+        self.load_mem(rt,self.registers[rn] + imm,line)
     #ldr rt, [rn, rm]
-    #dollar sign so it doesn't match pre index
-    if(re.match('ldr {},\[{},{}\]$'.format(rg,rg,rg),line)):
-        rt = re.findall(rg,line)[0]
-        rn = re.findall(rg,line)[1]
-        rm = re.findall(rg,line)[2]
-        addr = reg[rn] + reg[rm]
-        #check for out of bounds mem access
-        if(addr < reg['sp'] or addr > len(mem) - 8):
-            raise ValueError("out of bounds memory access: {}".format(line))
-        #load 8 bytes starting at addr and convert to int
-        reg[rt] = int.from_bytes(bytes(mem[addr:addr+8]),'little')
-        return
+    def op_ldr_reg(self,rt,rn,rm,line):
+        self.load_mem(rt,self.registers[rn] + self.registers[rm],line)
     #ldr rt, [rn, imm]! //pre index
-    if(re.match('ldr {},\[{},{}\]!'.format(rg,rg,num),line)):
-        rt = re.findall(rg,line)[0]
-        rn = re.findall(rg,line)[1]
-        imm = int(re.findall(num,line)[-1],0)
-        reg[rn] += imm
-        addr = reg[rn]
-        #check for out of bounds mem access
-        if(addr < reg['sp'] or addr > len(mem) - 8):
-            raise ValueError("out of bounds memory access: {}".format(line))
-        #load 8 bytes starting at addr and convert to int
-        reg[rt] = int.from_bytes(bytes(mem[addr:addr+8]),'little')
-        return
+    def op_ldr_pre(self,rt,rn,imm,line):
+        self.registers[rn] += imm
+        self.load_mem(rt,self.registers[rn],line)
     #ldr rt, [rn], imm //post index
-    if(re.match('ldr {},\[{}\],{}$'.format(rg,rg,num),line)):
-        rt = re.findall(rg,line)[0]
-        rn = re.findall(rg,line)[1]
-        imm = int(re.findall(num,line)[-1],0)
-        addr = reg[rn]
-        #check for out of bounds mem access
-        if(addr < reg['sp'] or addr > len(mem) - 8):
-            raise ValueError("out of bounds memory access: {}".format(line))
-        #load 8 bytes starting at addr and convert to int
-        reg[rt] = int.from_bytes(bytes(mem[addr:addr+8]),'little')
-        reg[rn] += imm
+    def op_ldr_post(self,rt,rn,imm,line):
+        self.load_mem(rt,self.registers[rn],line)
+        self.registers[rn] += imm
         #check for out of bounds pointer
-        if(reg[rn] > len(mem) and reg[rn] < reg['sp']):
-            raise ValueError("register {} points to out of bounds memory".format(reg[rn]))
-        return
-    '''
-    str instructions
-    '''
-    #str rt, [rn]
-    #dollar sign so it doesn't match post index
-    if(re.match('str {},\[{}\]$'.format(rg,rg),line)):
-        rt = re.findall(rg,line)[0]
-        rn = re.findall(rg,line)[1]
-        addr = reg[rn]
+        if(self.registers[rn] > self.mem.size and self.registers[rn] < self.registers[SP]):
+            raise ValueError("register {} points to out of bounds memory".format(self.registers[rn]))
+    #store the 8 bytes of rt starting at addr
+    def store_mem(self,rt,addr,line):
         #check for out of bounds mem access
-        if(addr < reg['sp'] or addr > len(mem) - 8):
+        if(addr < self.registers[SP] or addr > self.mem.size - 8):
             raise ValueError("out of bounds memory access: {}".format(line))
-        mem[addr:addr+8] = list(int.to_bytes((reg[rt]),8,'little'))
-        return       
+        self.mem.store_quad(addr,self.registers[rt])
     #str rt, [rn, imm]
-    #dollar sign so it doesn't match pre index
-    if(re.match('str {},\[{},{}\]$'.format(rg,rg,num),line)):
-        rt = re.findall(rg,line)[0]
-        rn = re.findall(rg,line)[1]
-        imm = int(re.findall(num,line)[-1],0)
-        addr = reg[rn] + imm
-        #check for out of bounds mem access
-        if(addr < reg['sp'] or addr > len(mem) - 8):
-            raise ValueError("out of bounds memory access: {}".format(line))
-        mem[addr:addr+8] = list(int.to_bytes((reg[rt]),8,'little'))
-        return    
+    def op_str(self,rt,rn,imm,line):
+        self.store_mem(rt,self.registers[rn] + imm,line)
     #str rt, [rn, rm]
-    #dollar sign so it doesn't match pre index
-    if(re.match('str {},\[{},{}\]$'.format(rg,rg,rg),line)):
-        rt = re.findall(rg,line)[0]
-        rn = re.findall(rg,line)[1]
-        rm = re.findall(rg,line)[2]
-        addr = reg[rn] + reg[rm]
-        #check for out of bounds mem access
-        if(addr < reg['sp'] or addr > len(mem) - 8):
-            raise ValueError("out of bounds memory access: {}".format(line))
-        mem[addr:addr+8] = list(int.to_bytes((reg[rt]),8,'little'))
-        return
+    def op_str_reg(self,rt,rn,rm,line):
+        self.store_mem(rt,self.registers[rn] + self.registers[rm],line)
     #str rt, [rn, imm]! //pre index
-    if(re.match('str {},\[{},{}\]!$'.format(rg,rg,num),line)):
-        rt = re.findall(rg,line)[0]
-        rn = re.findall(rg,line)[1]
-        imm = int(re.findall(num,line)[-1],0)
-        reg[rn] += imm
-        addr = reg[rn]
-        #check for out of bounds mem access
-        if(addr < reg['sp'] or addr > len(mem) - 8):
-            raise ValueError("out of bounds memory access: {}".format(line))
-        mem[addr:addr+8] = list(int.to_bytes((reg[rt]),8,'little'))
-        return 
+    def op_str_pre(self,rt,rn,imm,line):
+        self.registers[rn] += imm
+        self.store_mem(rt,self.registers[rn],line)
     #str rt, [rn], imm //post index
-    if(re.match('str {},\[{}\],{}$'.format(rg,rg,num),line)):
-        rt = re.findall(rg,line)[0]
-        rn = re.findall(rg,line)[1]
-        imm = int(re.findall(num,line)[-1],0)
-        addr = reg[rn]
-        #check for out of bounds mem access
-        if(addr < reg['sp'] or addr > len(mem) - 8):
-            raise ValueError("out of bounds memory access: {}".format(line))
-        mem[addr:addr+8] = list(int.to_bytes((reg[rt]),8,'little'))
-        reg[rn] += imm
+    def op_str_post(self,rt,rn,imm,line):
+        self.store_mem(rt,self.registers[rn],line)
+        self.registers[rn] += imm
         #check for out of bounds pointer
-        if(reg[rn] > len(mem) and reg[rn] < reg['sp']):
-            raise ValueError("register {} points to out of bounds memory".format(reg[rn]))
-        return 
-    '''
-    mov instructions
-    '''
+        if(self.registers[rn] > self.mem.size and self.registers[rn] < self.registers[SP]):
+            raise ValueError("register {} points to out of bounds memory".format(self.registers[rn]))
     #mov rd, imm
-    if(re.match('mov {},{}$'.format(rg,num),line)):
-        rd = re.findall(rg,line)[0]
-        imm = int(re.findall(num,line)[-1],0)
-        reg[rd] = imm
-        return
+    def op_mov_imm(self,rd,imm):
+        self.registers[rd] = imm
     #mov rd, rn
-    if(re.match('mov {},{}$'.format(rg,rg),line)):
-        rd = re.findall(rg,line)[0]
-        rn = re.findall(rg,line)[1]
-        reg[rd] = reg[rn]
-        return
-    '''
-    arithmetic instructions
-    '''
+    def op_mov_reg(self,rd,rn):
+        self.registers[rd] = self.registers[rn]
+    #set the flags based on the result of a logical instruction
+    def set_flags(self,result):
+        self.flags = ('logic',result,0)
     #asr rd, rn, imm
-    if(re.match('asr {},{},{}$'.format(rg,rg,num),line)):
-        rd = re.findall(rg,line)[0]
-        rn = re.findall(rg,line)[1]
-        imm = int(re.findall(num,line)[-1],0)
-        reg[rd] = reg[rn] >> imm
-        return
+    def op_asr(self,rd,rn,imm):
+        self.registers[rd] = self.registers[rn] >> imm
     #lsl rd, rn, imm
-    if(re.match('lsl {},{},{}$'.format(rg,rg,num),line)):
-        rd = re.findall(rg,line)[0]
-        rn = re.findall(rg,line)[1]
-        imm = int(re.findall(num,line)[-1],0)
-        reg[rd] = reg[rn] << imm
-        return
+    def op_lsl(self,rd,rn,imm):
+        self.registers[rd] = signed(self.registers[rn] << imm)
+    #lsr rd, rn, imm
+    def op_lsr(self,rd,rn,imm):
+        self.registers[rd] = signed((self.registers[rn] & WORD_MASK) >> imm)
     #add{s} rd, rn, imm
-    if(re.match('adds? {},{},{}$'.format(rg,rg,num),line)):
-        rd = re.findall(rg,line)[0]
-        rn = re.findall(rg,line)[1]
-        imm = int(re.findall(num,line)[-1],0)
-        reg[rd] = reg[rn] + imm
-        if('adds' in line):
-            n_flag = True if(reg[rd] < 0) else False
-            z_flag = True if(reg[rd] == 0) else False        
-        return
+    def op_add_imm(self,rd,rn,imm,s):
+        if(s):self.flags = ('add',self.registers[rn],imm)
+        self.registers[rd] = signed(self.registers[rn] + imm)
     #add{s} rd, rn, rm
-    if(re.match('adds? {},{},{}$'.format(rg,rg,rg),line)):
-        rd = re.findall(rg,line)[0]
-        rn = re.findall(rg,line)[1]
-        rm = re.findall(rg,line)[2]
-        reg[rd] = reg[rn] + reg[rm]
-        if('adds' in line):
-            n_flag = True if(reg[rd] < 0) else False
-            z_flag = True if(reg[rd] == 0) else False        
-        return
+    def op_add_reg(self,rd,rn,rm,s):
+        if(s):self.flags = ('add',self.registers[rn],self.registers[rm])
+        self.registers[rd] = signed(self.registers[rn] + self.registers[rm])
     #sub{s} rd, rn, imm
-    if(re.match('subs? {},{},{}$'.format(rg,rg,num),line)):
-        rd = re.findall(rg,line)[0]
-        rn = re.findall(rg,line)[1]
-        imm = int(re.findall(num,line)[-1],0)
-        reg[rd] = reg[rn] - imm
-        if('subs' in line):
-            n_flag = True if(reg[rd] < 0) else False
-            z_flag = True if(reg[rd] == 0) else False
-        return
+    def op_sub_imm(self,rd,rn,imm,s):
+        if(s):self.flags = ('sub',self.registers[rn],imm)
+        self.registers[rd] = signed(self.registers[rn] - imm)
     #sub{s} rd, rn, rm
-    if(re.match('subs? {},{},{}$'.format(rg,rg,rg),line)):
-        rd = re.findall(rg,line)[0]
-        rn = re.findall(rg,line)[1]
-        rm = re.findall(rg,line)[2]
-        reg[rd] = reg[rn] - reg[rm]
-        if('subs' in line):
-            n_flag = True if(reg[rd] < 0) else False
-            z_flag = True if(reg[rd] == 0) else False
-        return
+    def op_sub_reg(self,rd,rn,rm,s):
+        if(s):self.flags = ('sub',self.registers[rn],self.registers[rm])
+        self.registers[rd] = signed(self.registers[rn] - self.registers[rm])
     #mul rd, rn, rm
-    if(re.match('mul {},{},{}$'.format(rg,rg,rg),line)):
-        rd = re.findall(rg,line)[0]
-        rn = re.findall(rg,line)[1]
-        rm = re.findall(rg,line)[2]
-        reg[rd] = reg[rn] * reg[rm]
-        return
-    #For now treat un/signed division the same, since everything
-    #is signed in python, but separate in case this changes
+    def op_mul(self,rd,rn,rm):
+        self.registers[rd] = signed(self.registers[rn] * self.registers[rm])
     #udiv rd, rn, rm
-    if(re.match('udiv {},{},{}$'.format(rg,rg,rg),line)):
-        rd = re.findall(rg,line)[0]
-        rn = re.findall(rg,line)[1]
-        rm = re.findall(rg,line)[2]
-        #IMPORTANT: use integer division, not floating point
-        reg[rd] = reg[rn] // reg[rm]
-        return
+    def op_udiv(self,rd,rn,rm):
+        self.registers[rd] = unsigned_divide(self.registers[rn],self.registers[rm])
     #sdiv rd, rn, rm
-    if(re.match('sdiv {},{},{}$'.format(rg,rg,rg),line)):
-        rd = re.findall(rg,line)[0]
-        rn = re.findall(rg,line)[1]
-        rm = re.findall(rg,line)[2]
-        #IMPORTANT: use integer division, not floating point
-        reg[rd] = reg[rn] // reg[rm]
-        return
+    def op_sdiv(self,rd,rn,rm):
+        self.registers[rd] = signed_divide(self.registers[rn],self.registers[rm])
     #msub rd, rn, rm, ra
-    if(re.match('msub {},{},{},{}$'.format(rg,rg,rg,rg),line)):
-        rd = re.findall(rg,line)[0]
-        rn = re.findall(rg,line)[1]
-        rm = re.findall(rg,line)[2]
-        ra = re.findall(rg,line)[3]
-        reg[rd] = reg[ra] - reg[rn] * reg[rm]
-        return
+    def op_msub(self,rd,rn,rm,ra):
+        self.registers[rd] = signed(self.registers[ra] - self.registers[rn] * self.registers[rm])
     #madd rd, rn, rm, ra
-    if(re.match('madd {},{},{},{}$'.format(rg,rg,rg,rg),line)):
-        rd = re.findall(rg,line)[0]
-        rn = re.findall(rg,line)[1]
-        rm = re.findall(rg,line)[2]
-        ra = re.findall(rg,line)[3]
-        reg[rd] = reg[ra] + reg[rn] * reg[rm]
-        return
-    '''
-    compare instructions
-    '''
+    def op_madd(self,rd,rn,rm,ra):
+        self.registers[rd] = signed(self.registers[ra] + self.registers[rn] * self.registers[rm])
     #cmp rn, rm
-    if(re.match('cmp {},{}$'.format(rg,rg),line)):
-        rn = re.findall(rg,line)[0]
-        rm = re.findall(rg,line)[1]
-        assert rm != 'sp', "2nd register in cmp can't be sp"
-        z_flag = True if reg[rn] == reg[rm] else False
-        n_flag = True if reg[rn] < reg[rm] else False
-        return
+    def op_cmp_reg(self,rn,rm):
+        self.op_cmp_imm(rn,self.registers[rm])
     #cmp rn, imm
-    if(re.match('cmp {},{}$'.format(rg,num),line)):
-        rn = re.findall(rg,line)[0]
-        imm = int(re.findall(num,line)[-1],0)
-        z_flag = True if reg[rn] == imm else False
-        n_flag = True if reg[rn] < imm else False
-        return
-    '''
-    logical instructions
-    '''
+    def op_cmp_imm(self,rn,imm):
+        self.flags = ('sub',self.registers[rn],imm)
+    #csel rd, rn, rm, <cond>
+    def op_csel(self,rd,rn,rm,cond):
+        self.registers[rd] = self.registers[rn] if condition_holds(cond,self.flags) else self.registers[rm]
+    #csinc rd, rn, rm, <cond>
+    def op_csinc(self,rd,rn,rm,cond):
+        self.registers[rd] = self.registers[rn] if condition_holds(cond,self.flags) else signed(self.registers[rm] + 1)
+    #cset rd, <cond>
+    def op_cset(self,rd,cond):
+        self.registers[rd] = 1 if condition_holds(cond,self.flags) else 0
     #and{s} rd, rn, imm
-    if(re.match('ands? {},{},{}$'.format(rg,rg,num),line)):
-        rd = re.findall(rg,line)[0]
-        rn = re.findall(rg,line)[1]
-        imm = int(re.findall(num,line)[-1],0)
-        reg[rd] = reg[rn] & imm   
-        if('ands' in line):
-            n_flag = True if(reg[rd] < 0) else False
-            z_flag = True if(reg[rd] == 0) else False 
-        return 
+    def op_and_imm(self,rd,rn,imm,s):
+        self.registers[rd] = self.registers[rn] & imm
+        if(s):self.set_flags(self.registers[rd])
     #and{s} rd, rn, rm
-    if(re.match('ands? {},{},{}$'.format(rg,rg,rg),line)):
-        rd = re.findall(rg,line)[0]
-        rn = re.findall(rg,line)[1]
-        rm = re.findall(rg,line)[2]
-        reg[rd] = reg[rn] & reg[rm]   
-        if('ands' in line):
-            n_flag = True if(reg[rd] < 0) else False
-            z_flag = True if(reg[rd] == 0) else False 
-        return 
+    def op_and_reg(self,rd,rn,rm,s):
+        self.registers[rd] = self.registers[rn] & self.registers[rm]
+        if(s):self.set_flags(self.registers[rd])
     #orr{s} rd, rn, imm
-    if(re.match('orrs? {},{},{}$'.format(rg,rg,num),line)):
-        rd = re.findall(rg,line)[0]
-        rn = re.findall(rg,line)[1]
-        imm = int(re.findall(num,line)[-1],0)
-        reg[rd] = reg[rn] | imm
-        if('orrs' in line):
-            n_flag = True if(reg[rd] < 0) else False
-            z_flag = True if(reg[rd] == 0) else False    
-        return 
+    def op_orr_imm(self,rd,rn,imm,s):
+        self.registers[rd] = self.registers[rn] | imm
+        if(s):self.set_flags(self.registers[rd])
     #orr{s} rd, rn, rm
-    if(re.match('orrs? {},{},{}$'.format(rg,rg,rg),line)):
-        rd = re.findall(rg,line)[0]
-        rn = re.findall(rg,line)[1]
-        rm = re.findall(rg,line)[2]
-        reg[rd] = reg[rn] | reg[rm]
-        if('orrs' in line):
-            n_flag = True if(reg[rd] < 0) else False
-            z_flag = True if(reg[rd] == 0) else False    
-        return 
+    def op_orr_reg(self,rd,rn,rm,s):
+        self.registers[rd] = self.registers[rn] | self.registers[rm]
+        if(s):self.set_flags(self.registers[rd])
     #eor{s} rd, rn, imm
-    if(re.match('eors? {},{},{}$'.format(rg,rg,num),line)):
-        rd = re.findall(rg,line)[0]
-        rn = re.findall(rg,line)[1]
-        imm = int(re.findall(num,line)[-1],0)
-        reg[rd] = reg[rn] ^ imm
-        if('eors' in line):
-            n_flag = True if(reg[rd] < 0) else False
-            z_flag = True if(reg[rd] == 0) else False
-        return 
-    '''
-    branch instructions
-    NB. A value error is raised if a register is included where it shouldn't be
-    '''
+    def op_eor_imm(self,rd,rn,imm,s):
+        self.registers[rd] = self.registers[rn] ^ imm
+        if(s):self.set_flags(self.registers[rd])
     #cbnz rn,<label>
-    if(re.match('cbnz {},{}$'.format(rg,lab),line)):
-        if(len(re.findall(rg,line)) != 1): raise ValueError("cbnz takes one register")
-        rn = re.findall(rg,line)[0]
-        #last match is the label
-        label = re.findall(lab,line)[-1]
-        if(reg[rn] != 0):pc = asm.index(label+':') 
-        return
+    def op_cbnz(self,rn,target):
+        if(self.registers[rn] != 0):self.pc = target
     #cbz rn, <label>
-    if(re.match('cbz {},{}$'.format(rg,lab),line)):
-        if(len(re.findall(rg,line)) != 1): raise ValueError("cbz takes one register")
-        rn = re.findall(rg,line)[0]
-        #last match is the label
-        label = re.findall(lab,line)[-1]
-        if(reg[rn] == 0):pc = asm.index(label+':') 
-        return
+    def op_cbz(self,rn,target):
+        if(self.registers[rn] == 0):self.pc = target
     #b <label>
-    if(re.match('b {}$'.format(lab),line)):
-        if(len(re.findall(rg,line)) != 0): raise ValueError("b takes no registers")
-        #last match is the label
-        label = re.findall(lab,line)[-1]
-        pc = asm.index(label+':')
-        return
-    #b.lt <label>
-    if(re.match('b\.?lt {}$'.format(lab),line)):
-        if(len(re.findall(rg,line)) != 0): raise ValueError("blt takes no registers")
-        #last match is the label
-        label = re.findall(lab,line)[-1]
-        if(n_flag): pc=asm.index(label+':')
-        return
-    #b.le <label>
-    if(re.match('b\.?le {}$'.format(lab),line)):
-        if(len(re.findall(rg,line)) != 0): raise ValueError("ble takes no registers")
-        #last match is the label
-        label = re.findall(lab,line)[-1]
-        if(n_flag or z_flag): pc=asm.index(label+':')
-        return
-    #b.gt <label>
-    if(re.match('b\.?gt {}$'.format(lab),line)):
-        if(len(re.findall(rg,line)) != 0): raise ValueError("bgt takes no registers")
-        #last match is the label
-        label = re.findall(lab,line)[-1]
-        if(not z_flag and not n_flag): pc=asm.index(label+':')
-        return
-    #b.ge <label>
-    if(re.match('b\.?ge {}$'.format(lab),line)):
-        if(len(re.findall(rg,line)) != 0): raise ValueError("bge takes no registers")
-        #last match is the label
-        label = re.findall(lab,line)[-1]
-        if(not n_flag): pc=asm.index(label+':')
-        return
-    #b.eq <label>
-    if(re.match('b\.?eq {}$'.format(lab),line)):
-        if(len(re.findall(rg,line)) != 0): raise ValueError("beq takes no registers")
-        #last match is the label
-        label = re.findall(lab,line)[-1]
-        if(z_flag): pc=asm.index(label+':')
-        return
-    #b.ne <label>
-    if(re.match('b\.?ne {}$'.format(lab),line)):
-        if(len(re.findall(rg,line)) != 0): raise ValueError("bne takes no registers")
-        #last match is the label
-        label = re.findall(lab,line)[-1]
-        if(not z_flag): pc=asm.index(label+':')
-        return
-    #b.mi <label>
-    if(re.match('b\.?mi {}$'.format(lab),line)):
-        if(len(re.findall(rg,line)) != 0): raise ValueError("bmi takes no registers")
-        #last match is the label
-        label = re.findall(lab,line)[-1]
-        if(n_flag): pc=asm.index(label+':')
-        return
-    #b.pl <label>
-    if(re.match('b\.?pl {}$'.format(lab),line)):
-        if(len(re.findall(rg,line)) != 0): raise ValueError("bpl takes no registers")
-        #last match is the label
-        label = re.findall(lab,line)[-1]
-        if(not n_flag or z_flag): pc=asm.index(label+':')
-        return
+    def op_b(self,target):
+        self.pc = target
+    #b.<cond> <label>
+    #returns the handler for one condition. After a cmp or subs the
+    #condition is tested on the operands directly
+    def op_b_cond(self,cond):
+        sub = condition_sub[cond]
+        test = condition_flags[cond]
+        def branch(target):
+            flags = self.flags
+            if(sub(flags[1],flags[2]) if flags[0] == 'sub' else test(*nzcv(flags))):
+                self.pc = target
+        return branch
     #bl <label>
-    #bl can branch to a local assembly procedure or to an externally defined
-    #python function
-    if(re.match('bl {}$'.format(lab),line)):
-        if(len(re.findall(rg,line)) != 0): raise ValueError("bl takes no registers")
-        #last match is the label
-        label = re.findall(lab,line)[-1] + ':'
-        reg['lr'] = pc
+    def op_bl(self,label,target):
+        #This checks for recursion by determining if the current pc
+        #is saved in the link register at the time of a bl instr. If so, 
+        #this is the 2nd time this bl instr has been reached. 
+        #Will not detect a recursive procedure if termination condition
+        #is immediately met.
+        if(self.pc == self.registers[LR]):
+            self.recursed_labels.add(label[:-1])
+        self.registers[LR] = self.pc
         #label_hit_counts must be updated here to count procedure calls
-        if(label in label_hit_counts.keys()):
-            label_hit_counts[label] += 1
+        if(label in self.label_hit_counts.keys()):
+            self.label_hit_counts[label] += 1
         #behavior depends if local or external label
-        if(label in linked_labels):
-            linked_labels[label]()
+        if(target is None):
+            self.linked_labels[label]()
         else:
-            pc=asm.index(label)
-        return
+            self.pc = target
     #ret 
-    if(re.match('ret$',line)):
-        addr = reg['lr']
-        if(addr not in range(0,len(asm))):
+    def op_ret(self):
+        addr = self.registers[LR]
+        if(addr not in range(0,len(self.asm))):
             raise ValueError("ret: address in LR ({}) out of range".format(addr))
-        pc = addr
-        return
+        self.pc = addr
     '''
     system call handler
     Currently supported: Read and write to stdin/stdout, getrandom
     '''
     #svc 0
-    if(re.match('svc 0$',line)):
-        syscall = int(reg['x8'])
+    def op_svc(self):
+        syscall = int(self.registers[8])
         #simulate exit by causing main loop to exit
         if(syscall==93):
-            pc = len(asm)
+            self.pc = len(self.asm)
+            self.stdout.flush()
         #write
         elif(syscall==64):
-            assert reg['x0'] == 1, "Can only write to stdout! (x0 must contain #1)"
-            length = reg['x2']
-            addr = reg['x1']
-            output = bytes(mem[addr:addr+length]).decode('ascii')
-            #if the user wants to print a newline they have to include
-            #it in their string
-            print(output, end='') 
+            assert self.registers[0] == 1, "Can only write to stdout! (x0 must contain #1)"
+            length = self.registers[2]
+            addr = self.registers[1]
+            #the bytes are written as they are, if the user wants to 
+            #print a newline they have to include it in their string
+            output = self.mem.read(addr,length)
+            written = self.stdout.write(output)
+            self.output += output[:written]
+            if(written < len(output)):
+                raise LimitExceeded("output limit of {} bytes reached".format(self.stdout.limit),'output',self)
         #read
         elif(syscall==63):
-            length = reg['x2']
-            addr = reg['x1']
-            enter = input()
-            enter+='\n'
-            #truncate input based on # of chars read
-            enter = enter[:length]
-            #store as bytes, not string
-            mem[addr:addr+len(enter)] = list(bytes(enter,'ascii'))
-            #return value is # of bytes read
-            reg['x0'] = len(enter)
+            #show everything written so far (e.g. a prompt) first
+            self.stdout.flush()
+            length = self.registers[2]
+            addr = self.registers[1]
+            #up to length bytes go straight into mem
+            data = self.stdin.read(length)
+            self.mem[addr:addr+len(data)] = data
+            #return value is # of bytes read, 0 at the end of the input
+            self.registers[0] = len(data)
         #brk
         elif(syscall==214):
-            new_brk = reg['x0']
+            new_brk = self.registers[0]
             #invalid new_brk, return current brk
-            if(new_brk < original_break):
-                reg['x0'] = brk
+            if(new_brk < self.original_break):
+                self.registers[0] = self.brk
             #original brk, reset heap_pointer (works with empty data section)
-            elif(new_brk == original_break):
-                brk = new_brk
-                reg['x0'] = brk
-                mem = mem[:original_break]
+            elif(new_brk == self.original_break):
+                self.brk = new_brk
+                self.registers[0] = self.brk
+                self.mem.resize(self.original_break)
             #adjust brk  
             else:
                 #round up to the nearest page boundary of 4K bytes
-                break_size = new_brk - original_break
+                break_size = new_brk - self.original_break
                 assert break_size >= 0, "System error: break_size should never be negative"
                 page = (break_size + 0x1000) - break_size % 0x1000
                 if(page > HEAP_SIZE): raise ValueError("break size of {} too large".format(break_size))
-                #shink the heap
-                if(len(mem) > page + original_break):
-                    mem = mem[:page + original_break]
-                #grow the heap
-                else:
-                    mem.extend([0] * page)
+                #grow or shrink the heap
+                self.mem.resize(self.original_break + page)
                 #x0 has valid address, set brk to it
-                brk = reg['x0']
+                self.brk = self.registers[0]
         #getrandom
         elif(syscall==278):
-            addr = reg['x0']
-            quantity = reg['x1']
+            addr = self.registers[0]
+            quantity = self.registers[1]
             #the number of random bytes requested is written to mem
-            mem[addr:addr+quantity] = list(os.urandom(quantity))
-            reg['x0'] = quantity
+            self.mem[addr:addr+quantity] = os.urandom(quantity)
+            self.registers[0] = quantity
         else:
             raise ValueError("Unsupported system call: {} ".format(syscall))
-        return
-    raise ValueError("Unsupported instruction or syntax error: "+line)
+    #labels are only reached by falling through to them (branches go
+    #to the instruction after the label). A label is not an instruction,
+    #so the step counted by the main loop is taken back
+    def op_label(self,line):
+        self.label_hit_counts[line] = self.label_hit_counts.get(line,0) + 1
+        self.steps-=1
+    #placeholder for a line that failed to decode. The error is raised
+    #when (and only when) the line is executed
+    def op_invalid(self,error):
+        raise error
+
+    '''
+    Executes an instruction that has already been decoded by looking up
+    the handler for its opcode
+    '''
+    def execute_decoded(self,instr:tuple):
+        self.handlers[instr[0]](*instr[1:])
+
+    '''
+    Raises an error if sp is outside of the stack or not aligned. Only
+    needs to be called after an instruction that writes sp
+    '''
+    def check_stack(self):
+        sp = self.registers[SP]
+        if(sp < 0):
+            raise ValueError("stack overflow")
+        if(sp > STACK_SIZE):
+            raise ValueError("stack underflow (make sure to allocate space)")
+        if((sp + 1)% 16 != 0):
+            raise ValueError("Alignment error: sp must be a multiple of 16")
+
+    '''
+    Wraps the handler of an instruction that writes sp, so that the 
+    stack is checked after it runs
+    '''
+    def checked(self,handler):
+        def run(*operands):
+            handler(*operands)
+            self.check_stack()
+        return run
+
+    '''
+    Decodes and executes the provided line of assembly code. This is
+    used by the repl; programs are decoded once by decode_program() 
+    '''
+    def execute(self,line:str):
+        self.execute_decoded(self.decode(line))
+
+    '''
+    Prepares the lines in asm for execution. The label index is built
+    first, since decoding a branch needs it to resolve the target.
+    If asm has not changed since the last call nothing is done, so this
+    can be called by anything that needs the label index or the
+    decoded program (check_static_rules(), run(), armdb)
+    '''
+    def load(self):
+        if(self.asm == self.loaded_asm and len(self.program) == len(self.asm)):
+            #linked_labels may have changed since the program was linked
+            if(set(self.linked_labels) != self.linked):
+                self.link_program()
+                self.fuse_code()
+            return
+        label_index,program = self.decoded()
+        self.label_index.clear()
+        self.label_index.update(label_index)
+        self.program[:] = program
+        self.link_program()
+        self.fuse_code()
+        self.find_blocks()
+        self.loaded_asm = list(self.asm)
+
+    '''
+    Same as parse(), but the parsed and decoded program is kept in 
+    cache_dir, so that running the same source again only has to read
+    one file. Cached programs are looked up by a hash of the source and
+    of the simulator (see simulator_version()), so editing either one
+    makes a new entry. A cache file that can't be read is ignored and 
+    written again. Like parse(), this is meant for a fresh machine. As
+    with parse(), nothing is decoded until load() is called (e.g. by 
+    run()), and the cached program doesn't depend on linked_labels, so
+    they can be set before or after. The files are pickles, so 
+    cache_dir should only be writable by whoever runs armsim
+    '''
+    def parse_cached(self,lines,cache_dir:str)->None:
+        lines = list(lines)
+        if(self.asm):
+            self.parse(lines)
+            return
+        key = hashlib.sha256(simulator_version().encode() + ''.join(lines).encode())
+        path = os.path.join(cache_dir,key.hexdigest() + '.armc')
+        try:
+            self.load_program(path)
+            return
+        except (OSError,ValueError,EOFError,pickle.UnpicklingError):
+            #missing or unreadable, parse the program and (re)write it
+            pass
+        self.parse(lines)
+        os.makedirs(cache_dir,exist_ok=True)
+        self.save_program(path)
+
+    '''
+    Writes everything parse() produces, and the decoded program, to a 
+    cache file. The program is decoded for the file if load() hasn't 
+    been called yet, without changing the machine. The file is written
+    under a temporary name and then renamed, so that other processes 
+    never see half of a file
+    '''
+    def save_program(self,path:str):
+        label_index = self.label_index
+        program = self.program
+        if(self.asm != self.loaded_asm or len(self.program) != len(self.asm)):
+            label_index,program = self.decoded()
+        state = {'asm':self.asm, 'source_lines':self.source_lines, 'sym_table':self.sym_table, 'registers':self.registers,
+                 'mem_size':self.mem.size, 'pages':{n:bytes(p) for n,p in self.mem.pages.items()},
+                 'original_break':self.original_break, 'brk':self.brk,
+                 'label_index':label_index, 'program':program}
+        temporary = "{}.{}.tmp".format(path,os.getpid())
+        with open(temporary,'wb') as f:
+            f.write(CACHE_MAGIC + bytes([CACHE_FORMAT]))
+            pickle.dump(state,f,pickle.HIGHEST_PROTOCOL)
+        os.replace(temporary,path)
+
+    '''
+    Reads a file written by save_program(). Only the handlers have to
+    be looked up again (see link_program()), nothing is parsed or 
+    decoded. Raises ValueError if the file is from another format. The
+    machine is only changed once the whole file has been read, and 
+    afterwards it is in the same state as after parse() (see restore()),
+    even if it ran another program before
+    '''
+    def load_program(self,path:str):
+        with open(path,'rb') as f:
+            data = f.read()
+        header = CACHE_MAGIC + bytes([CACHE_FORMAT])
+        if(not data.startswith(header)):
+            raise ValueError("{} is not a cached program of this version".format(path))
+        state = pickle.loads(data[len(header):])
+        #replace whatever program the machine held before
+        self.asm[:] = state['asm']
+        self.source_lines[:] = state['source_lines']
+        self.sym_table.clear()
+        self.sym_table.update(state['sym_table'])
+        self.label_index.clear()
+        self.label_index.update(state['label_index'])
+        self.registers[:] = state['registers']
+        self.flags = ('set',0,0)
+        self.mem.pages = {n:bytearray(p) for n,p in state['pages'].items()}
+        self.mem.size = state['mem_size']
+        self.original_break = state['original_break']
+        self.brk = state['brk']
+        self.program[:] = state['program']
+        self.link_program()
+        self.fuse_code()
+        self.find_blocks()
+        self.loaded_asm = list(self.asm)
+        self.snapshot()
+        #pc, steps, output and the counters of the previous run
+        self.restore()
+
+    '''
+    Saves the registers, flags, memory and the break in initial_state.
+    Called at the end of parse(). The rest of the state that running a
+    program changes (pc, steps, output and the counters) always starts
+    out empty, so restore() resets it without a snapshot. Memory is not
+    copied, its pages are shared with the snapshot until they are 
+    written (see Memory)
+    '''
+    def snapshot(self):
+        self.initial_state = (list(self.registers),self.flags,self.mem.snapshot(),self.brk)
+
+    '''
+    Puts the machine back into the state it was in right after parse(),
+    so the same program can be run again (e.g. with another stdin) 
+    without parsing it again. The program, the decoded instructions,
+    compiled blocks and the rule settings are kept
+    '''
+    def restore(self):
+        if(self.initial_state is None):
+            raise ValueError("no program has been parsed")
+        registers,self.flags,memory,self.brk = self.initial_state
+        #the list is updated in place, since reg is a view of it
+        self.registers[:] = registers
+        self.mem.restore(memory)
+        self.pc = 0
+        self.steps = 0
+        self.output = bytearray()
+        self.label_hit_counts = {}
+        self.instruction_counts = []
+        self.call_profile = CallProfile()
+        self.profiled = []
+        if(self.timing):self.timing.code = []
+        self.recursed_labels = set()
+
+    '''
+    Decodes every line of asm into the program list, so that the
+    main loop executes pre-decoded instructions instead of matching
+    regular expressions on every step. Lines that can't be decoded
+    are turned into an 'invalid' instruction so that, like before,
+    the error is only raised if the line is actually executed
+    '''
+    def decode_program(self):
+        self.program.clear()
+        for line in self.asm:
+            try:
+                self.program.append(self.decode(line))
+            except (ValueError,KeyError,AssertionError) as e:
+                self.program.append(('invalid',e))
+
+    '''
+    Returns the label index and the decoded program of asm, without 
+    changing the machine. The label index is built first, since 
+    decoding a branch needs it to resolve the target. Used by load()
+    and save_program()
+    '''
+    def decoded(self)->tuple:
+        label_index = self.label_index
+        program = self.program
+        self.label_index = {}
+        self.program = []
+        try:
+            for i in range(0,len(self.asm)):
+                #only the first declaration is kept, duplicates are 
+                #reported by check_static_rules()
+                if(label_line_regex.match(self.asm[i]) and self.asm[i] not in self.label_index):
+                    self.label_index[self.asm[i]] = i
+            self.decode_program()
+            return self.label_index,self.program
+        finally:
+            self.label_index = label_index
+            self.program = program
     
+    '''
+    Builds code from program by looking up the handler of each 
+    instruction once. The stack check that would otherwise be done on 
+    every step is attached only to the instructions that write sp. A bl
+    to one of the linked_labels calls the external function (even if 
+    the label is also in asm) and is treated as writing sp. A bl to a 
+    label that is neither raises an error when it is executed, like a 
+    line that failed to decode
+    '''
+    def link_program(self):
+        self.code.clear()
+        for instr in self.program:
+            op = instr[0]
+            handler = self.handlers[op]
+            if(op == 'bl'):
+                label = instr[1]
+                if(label in self.linked_labels):
+                    self.code.append((self.checked(handler),(label,None)))
+                elif(instr[2] is None):
+                    self.code.append((self.op_invalid,(ValueError("{} is not a label in the program".format(label[:-1])),)))
+                else:
+                    self.code.append((handler,instr[1:]))
+                continue
+            elif(op not in block_exits and op not in block_branches):
+                if(SP in block_writes(instr)):
+                    handler = self.checked(handler)
+            self.code.append((handler,instr[1:]))
+        self.linked = set(self.linked_labels)
 
-'''
-Takes a variable declared in the data or bss section
-and returns the data (always as a list)at that address in a format 
-that makes sense according to the directive type. The directive type
-was stored in sym_table during the parse stage:
-0 -> asciz
-1 -> 8byte
-2 -> space
-Since the size of each variable is stored we can print out all data
-
-Examples:
-
-Given
-message: .asciz "hello world\n"
-get_data('message')
-returns the list
-['h','e','l','l','o',' ','w','o','r','l','d','\n']
-
-Given
-array: .8byte 89,80,83,88,86,82,87,81,84,85
-get_data('array')
-returns the list
-[89,80,83,88,86,82,87,81,84,85]
-
-Given
-len = 12
-get_data('len')
-returns the list
-[12]
-
-Given
-steps: .space 8
-get_data('steps')
-returns the list
-[0,0,0,0,0,0,0]
-(assuming nothing has been put there)
-'''
-def getdata(variable:str):
-    if( variable+'_TYPE_' in sym_table):
-        index = sym_table[variable]
-        size = sym_table[variable+"_SIZE_"]
-        #asciz
-        if(sym_table[variable+'_TYPE_'] == 0):
-            return list(bytes(mem[index:index+size]).decode('ascii'))
-        #8byte
-        elif(sym_table[variable+'_TYPE_'] == 1):
-            lst = []
-            for i in range(0,size,8):
-                lst.append(int.from_bytes(bytes(mem[index+i:index+i+8]),'little'))
-            return lst
-        #space
-        elif(sym_table[variable+'_TYPE_'] == 2):
-            return list(bytes(mem[index:index+size]))
+    '''
+    Builds fused_code from code. Some pairs of instructions make up most
+    of the loops in the example programs: a cmp followed by a b.<cond>,
+    a subs followed by a b.<cond> (counting down) and an ldr followed by
+    an add (walking through an array). fused_code[i] runs such a pair,
+    program[i] and program[i+1], with a single handler (a 
+    superinstruction), which saves a pass through the main loop. The
+    compare and branch superinstructions also test the condition on the
+    compared values directly instead of reading the flags back.
+
+    A label is an instruction of its own, so no label can sit between 
+    the two instructions of a pair, and label_hit_counts is not 
+    affected. fused_code[i+1] is left as it is, since a branch can
+    still go straight to it. The superinstruction moves the pc and 
+    steps on to the second instruction before running it, so an error
+    in either instruction is reported at the right line with the right
+    step count. Only run() uses fused_code (and only if 
+    fuse_instructions is True), step() and so armdb still run one 
+    instruction at a time, so breakpoints work as before
+    '''
+    def fuse_code(self):
+        self.fused_code = list(self.code)
+        for i in range(0,len(self.program)-1):
+            handler = self.fuse(i)
+            if(handler):self.fused_code[i] = (handler,())
+
+    '''
+    Returns the superinstruction for program[i] and program[i+1], or 
+    None if they can't be fused
+    '''
+    def fuse(self,i:int):
+        first = self.program[i]
+        second = self.program[i+1]
+        if(second[0].startswith('b.')):
+            sub = condition_sub[second[0][2:]]
+            target = second[1]
+            if(first[0] == 'cmp_imm'):
+                rn,imm = first[1:]
+                def cmp_imm_branch():
+                    a = self.registers[rn]
+                    self.flags = ('sub',a,imm)
+                    self.pc+=1;self.steps+=1
+                    if(sub(a,imm)):self.pc = target
+                return cmp_imm_branch
+            if(first[0] == 'cmp_reg'):
+                rn,rm = first[1:]
+                def cmp_reg_branch():
+                    a = self.registers[rn]
+                    b = self.registers[rm]
+                    self.flags = ('sub',a,b)
+                    self.pc+=1;self.steps+=1
+                    if(sub(a,b)):self.pc = target
+                return cmp_reg_branch
+            #a subs that writes sp has to check the stack, leave it alone
+            if(first[0] == 'sub_imm' and first[4] and first[1] != SP):
+                rd,rn,imm = first[1:4]
+                def subs_branch():
+                    a = self.registers[rn]
+                    self.flags = ('sub',a,imm)
+                    self.registers[rd] = signed(a - imm)
+                    self.pc+=1;self.steps+=1
+                    if(sub(a,imm)):self.pc = target
+                return subs_branch
+        if(first[0] in ('ldr','ldr_reg','ldr_pre','ldr_post') and second[0] in ('add_imm','add_reg')):
+            #the handlers from code, so that stack checks are kept
+            load, load_operands = self.code[i]
+            add, add_operands = self.code[i+1]
+            def ldr_add():
+                load(*load_operands)
+                self.pc+=1;self.steps+=1
+                add(*add_operands)
+            return ldr_add
+        return None
+
+    '''
+    Starts a new profile: clears instruction_counts and call_profile
+    and builds profiled. Called by run() when profile is True, and by
+    step() if profiled doesn't match the program
+    '''
+    def start_profile(self):
+        self.instruction_counts = [0]*len(self.asm)
+        self.call_profile = CallProfile()
+        self.call_profile.counted = self.steps
+        self.profiled = self.profiled_code()
+
+    '''
+    Returns code with every handler wrapped so that it adds one to the
+    count of its instruction in instruction_counts before it runs, and
+    bl and ret also update call_profile (see Profiling above)
+    '''
+    def profiled_code(self)->list:
+        counts = self.instruction_counts
+        calls = self.call_profile
+        def counted(i,handler):
+            def run(*operands):
+                counts[i]+=1
+                handler(*operands)
+            return run
+        #the bl or ret itself hasn't been added to steps yet
+        def call(i,handler,label,linked):
+            def run(*operands):
+                counts[i]+=1
+                calls.call(label,self.steps+1)
+                handler(*operands)
+                if(linked):calls.ret(self.steps+1)
+            return run
+        def ret(i,handler):
+            def run(*operands):
+                counts[i]+=1
+                calls.ret(self.steps+1)
+                handler(*operands)
+            return run
+        code = []
+        for i,(handler,operands) in enumerate(self.code):
+            op = self.program[i][0]
+            if(op == 'bl' and handler != self.op_invalid):
+                label,target = operands
+                code.append((call(i,handler,label[:-1],target is None),operands))
+            elif(op == 'ret'):
+                code.append((ret(i,handler),operands))
+            else:
+                code.append((counted(i,handler),operands))
+        return code
+
+    '''
+    Returns the instructions that were executed while profiling, the 
+    most executed first (ties in program order). Each one is a dict 
+    with its index in asm ('pc'), its line in the source ('line', None
+    if it wasn't parsed), how often it ran ('count'), its share of all
+    instructions executed ('share') and its text. Labels are left out,
+    see label_hit_counts for them. If top is given, only that many are
+    returned
+    '''
+    def profile_report(self,top:int=None)->list:
+        counts = self.instruction_counts
+        executed = [i for i in range(0,len(counts)) if counts[i] and self.program[i][0] != 'label']
+        total = sum(counts[i] for i in executed)
+        executed.sort(key=lambda i:(-counts[i],i))
+        return [{'pc':i, 'line':self.source_lines[i] if i < len(self.source_lines) else None,
+                 'count':counts[i], 'share':counts[i]/total, 'text':self.asm[i]}
+                for i in executed[:top]]
+
+    '''
+    Builds the control flow graph, marks the instructions where basic
+    blocks start and resets the compiled blocks. Blocks that start with
+    a label are left out, since a label can't be compiled. Called by 
+    load()
+    '''
+    def find_blocks(self):
+        self.cfg = ControlFlowGraph(self.program)
+        self.blocks = [False]*len(self.program)
+        self.block_counts = [0]*len(self.program)
+        self.block_sizes = [0]*len(self.program)
+        for start in self.cfg.starts:
+            if(self.program[start][0] != 'label'):self.blocks[start] = None
+    '''
+    Compiles the basic block starting at asm[start] into a python 
+    function, as described above. Returns False if the block
+    can't be compiled
+    '''
+    def compile_block(self,start:int):
+        body = []
+        #owners[k] is the offset from start of the instruction that body[k]
+        #belongs to
+        owners = []
+        #registers read/written and whether the flags or memory are used
+        used = set()
+        written = set()
+        flags = False
+        memory = False
+        #kind of the last flag setting instruction in the block so far
+        kind = None
+        i = start
+        while(i < len(self.program) and self.program[i][0] not in block_exits):
+            instr = self.program[i]
+            op = instr[0]
+            used.update(instr[j] for j in register_operands[op])
+            if(op in block_branches):
+                target = instr[-1] + 1
+                if(op == 'b'):
+                    body.append("return {}".format(target))
+                elif(op in ('cbz','cbnz')):
+                    body.append("if({} {} 0): return {}".format(
+                        '0' if instr[1] == XZR else 'r{}'.format(instr[1]),'==' if op == 'cbz' else '!=',target))
+                else:
+                    flags = True
+                    body.append("if({}): return {}".format(block_condition(op[2:],kind),target))
+                owners += [i - start]*(len(body) - len(owners))
+                i+=1
+                break
+            if(flag_kind(instr) or op in ('csel','csinc','cset')):
+                flags = True
+            if(op[0:3] in ('ldp','stp','ldr','str') and op != 'ldr_sym'):
+                memory = True
+            targets = block_writes(instr)
+            written.update(targets)
+            body += block_source(instr,kind)
+            kind = flag_kind(instr) or kind
+            if(SP in targets):
+                body += ["if(r31 < 0): raise ValueError('stack overflow')",
+                         "if(r31 > STACK_SIZE): raise ValueError('stack underflow (make sure to allocate space)')",
+                         "if((r31 + 1)% 16 != 0): raise ValueError('Alignment error: sp must be a multiple of 16')"]
+            owners += [i - start]*(len(body) - len(owners))
+            i+=1
+        if(i == start):return False
+        self.block_sizes[start] = i - start
+        #memory accesses are checked against sp
+        if(memory):used.add(SP)
+        used -= {XZR,DISCARD};written.discard(DISCARD)
+        #if the block does not end with a branch, continue at the next instruction
+        if(not body[-1].startswith('return')):body.append("return {}".format(i))
+        src = ["def block(self):","    reg = self.registers; mem = self.mem; pages = mem.pages"]
+        src += ["    r{0} = reg[{0}]".format(r) for r in sorted(used)]
+        if(flags):src.append("    _fk,_fa,_fb = self.flags")
+        src.append("    try:")
+        #offsets[n] is the instruction that line n+1 of src belongs to
+        offsets = [None]*len(src) + owners
+        src += ["        "+line for line in body]
+        src.append("    finally:")
+        src += ["        reg[{0}] = r{0}".format(r) for r in sorted(written)]
+        if(flags):src.append("        self.flags = (_fk,_fa,_fb)")
+        if(not written and not flags):src.append("        pass")
+        namespace = {}
+        exec(compile('\n'.join(src),'<block {}>'.format(start),'exec'),globals(),namespace)
+        namespace['block'].offsets = offsets
+        return namespace['block']
+
+    '''
+    Called by run() when the compiled block starting at pc raises error.
+    The line of the block that raised it tells which instruction it 
+    came from, so pc is moved to that instruction and the instructions
+    after it are taken back off steps. pc and steps are then the same 
+    as if the block had been run by the main loop
+    '''
+    def block_error(self,error:Exception):
+        block = self.blocks[self.pc]
+        trace = error.__traceback__
+        while(trace is not None and trace.tb_frame.f_code is not block.__code__):
+            trace = trace.tb_next
+        if(trace is None):return
+        offset = block.offsets[trace.tb_lineno - 1]
+        self.steps -= self.block_sizes[self.pc] - offset
+        self.pc += offset
+    '''
+    Takes a variable declared in the data or bss section
+    and returns the data (always as a list)at that address in a format 
+    that makes sense according to the directive type. The directive type
+    was stored in sym_table during the parse stage:
+    0 -> asciz
+    1 -> 8byte
+    2 -> space
+    Since the size of each variable is stored we can print out all data
+
+    Examples:
+
+    Given
+    message: .asciz "hello world\n"
+    get_data('message')
+    returns the list
+    ['h','e','l','l','o',' ','w','o','r','l','d','\n']
+
+    Given
+    array: .8byte 89,80,83,88,86,82,87,81,84,85
+    get_data('array')
+    returns the list
+    [89,80,83,88,86,82,87,81,84,85]
+
+    Given
+    len = 12
+    get_data('len')
+    returns the list
+    [12]
+
+    Given
+    steps: .space 8
+    get_data('steps')
+    returns the list
+    [0,0,0,0,0,0,0]
+    (assuming nothing has been put there)
+    '''
+    def getdata(self,variable:str):
+        if( variable+'_TYPE_' in self.sym_table):
+            index = self.sym_table[variable]
+            size = self.sym_table[variable+"_SIZE_"]
+            #asciz
+            if(self.sym_table[variable+'_TYPE_'] == 0):
+                return list(str(self.mem.read(index,size),'ascii'))
+            #8byte
+            elif(self.sym_table[variable+'_TYPE_'] == 1):
+                return list(struct.unpack('<{}q'.format(size//8),self.mem.read(index,size)))
+            #space
+            elif(self.sym_table[variable+'_TYPE_'] == 2):
+                return list(self.mem.read(index,size))
+            else:
+                print(variable+': variable not found')
         else:
-            print(variable+': variable not found')
-    else:
-        return [sym_table[variable]]
+            return [self.sym_table[variable]]
         
 
-'''
-Procedure to check that predefined rules about the code 
-have been adhered to
-Currently checks:
---Code has been detected and parsed into the asm list
---The same label is not declared twice
---forbidden instructions are not used
---branches are calling existing labels
---looping is not used, depending on flag
---the only text that immediately follow an unconditional branch
-(ret or b) is a label, or it should be the last instruction
-Called in run() and debug(), so should be no
-need to call this separately 
-'''
-def check_static_rules():
-    global forbid_recursion, require_recursion, check_dead_code, label_regex
-    #label regex
-    lab = label_regex
+    '''
+    Procedure to check that predefined rules about the code 
+    have been adhered to
+    Currently checks:
+    --Code has been detected and parsed into the asm list
+    --The same label is not declared twice
+    --forbidden instructions are not used
+    --branches are calling existing labels
+    --looping is not used, depending on flag
+    --the only text that immediately follow an unconditional branch
+    (ret or b) is a label, or it should be the last instruction
+    Called in run() and debug(), so should be no
+    need to call this separately 
+    '''
+    def check_static_rules(self):
+        #label regex
+        lab = label_regex
     
-    #Make sure code has been detected
-    if(not asm):
-        raise ValueError("no code detected (remember to include a _start: or main: label)")
-    #check for disallowed instructions:
-    #--extract mnemonics (string before the first space)
-    mnemonics = [i.split(" ")[0] for i in asm if " " in i]
-    forbid = set(mnemonics).intersection(forbidden_instructions)
-    if(forbid): raise ValueError("Use of {} disallowed".format(forbid))
+        #Make sure code has been detected
+        if(not self.asm):
+            raise ValueError("no code detected (remember to include a _start: or main: label)")
+        self.load()
+        #check for disallowed instructions:
+        #--extract mnemonics (string before the first space)
+        mnemonics = [i.split(" ")[0] for i in self.asm if " " in i]
+        forbid = set(mnemonics).intersection(self.forbidden_instructions)
+        if(forbid): raise ValueError("Use of {} disallowed".format(forbid))
     
-    #verify that labels have not be redeclared
-    labels = [l for l in asm if(re.match('{}:'.format(lab),l))]
-    if(len(labels)>len(set(labels))):
-        raise ValueError("You can't declare the same label more than once")    
+        #verify that labels have not be redeclared
+        #(label_index only holds the first declaration of each label)
+        labels = [i for i in self.program if i[0] == 'label']
+        if(len(labels)>len(self.label_index)):
+            raise ValueError("You can't declare the same label more than once")    
     
     
-    #check that all branch instructions call existing labels
-    for instr in asm:
-        if(re.match('c?b(.*?)',instr)):
-            label = re.findall(lab,instr)[-1] + ":" 
-            if(label not in asm and label not in linked_labels):
-                raise ValueError(instr + " is calling a nonexistent label")      
+        #check that all branch instructions call existing labels
+        for instr in self.asm:
+            if(re.match('c?b(.*?)',instr)):
+                label = re.findall(lab,instr)[-1] + ":" 
+                if(label not in self.label_index and label not in self.linked_labels):
+                    raise ValueError(instr + " is calling a nonexistent label")      
                 
-    #To check for looping:
-    #--match any branch instruction except bl
-    #--if its label occurs earlier in the instruction
-    #listing than the branch, it is a loop
-    looped = False
-    if(forbid_loops):
-        for i in range(0,len(asm)-1):
-            #match branches except for bl
-            if(re.match('c?b(?!l )',asm[i])):
-                #last match is the label
-                label = re.findall(lab,asm[i])[-1]
-                if(asm.index(label+':') < i):
-                    looped = True
-        if(looped):
-             raise ValueError("you cannot loop")
+        #the checks below use the control flow graph built by load()
+        cfg = self.cfg
+        #a loop is a cycle in the control flow graph of a procedure, 
+        #i.e. a branch back to a block that can lead to the branch
+        if(self.forbid_loops and cfg.back_edges):
+            raise ValueError("you cannot loop")
     
-    if(check_dead_code):
-        #Check for dead code after ret or b instruction
-        #The only instr that should come after a ret or b is a label
-        for i in range(0,len(asm)-1):
-            #don't care about last instruction
-            if(i != len(asm) - 1):
-                if(asm[i] == 'ret' or re.match('b {}'.format(lab),asm[i])):
-                    assert re.match(lab+':',asm[i+1]), \
-                    "Dead code detected after instruction {} " + asm[i]
-
-'''
-This procedure runs the code normally to the end. Exceptions are raised
-for violated static checks, stack overflow, and if recursion is (un)used
-contrary to the forbid/require recursion flags. The program is considered to 
-have ended when pc equals the length of the asm list
-'''
-def run():
-    global pc, STACK_SIZE, label_regex,label_hit_counts
-    check_static_rules()
-    recursed_labels = set()
-    labels = [l for l in asm if(re.match('{}:'.format(label_regex),l))]+list(linked_labels.keys())
-    label_hit_counts = dict(zip(labels, [0]*len(labels)))
-    while pc < len(asm):
-        line=asm[pc]
-        #This checks for recursion by determining if the current pc
-        #is saved in the link register at the time of a bl instr. If so, 
-        #this is the 2nd time this bl instr has been reached. 
-        #Will not detect a recursive procedure if termination condition
-        #is immediately met.
-        if(re.match('bl {}'.format(label_regex),line)):
-            if(pc == reg['lr']):
-                #last match is the label
-                label = re.findall(label_regex,line)[-1]
-                recursed_labels.add(label)
-        
-        #check for stack errors    
-        if(reg['sp'] < 0):
-            raise ValueError("stack overflow")
-        if(reg['sp'] > STACK_SIZE):
-            raise ValueError("stack underflow (make sure to allocate space)")
-        if((reg['sp'] + 1)% 16 != 0):
-            raise ValueError("Alignment error: sp must be a multiple of 16")
-        
-        #if a label in encountered, inc pc and skip
-        #also update label_hit_counts
-        if(re.match(label_regex+':',line)):
-            pc+=1;label_hit_counts[line]+=1
-            continue     
-        execute(line)
-        reg['xzr'] = 0
-        pc+=1
-    #empty recursed_labels list means no recursion happened
-    if(recursed_labels and forbid_recursion):
-        raise ValueError("recursion occurred in program but it should not have")
-    if(not recursed_labels and require_recursion):
-        raise ValueError("recursion did not occur in program but it should have")
-    #case where there was recursion, but not for the labels specified
-    #in the recursive_labels list. (recursive_labels should be a subset
-    #of recursed_labels)
-    if(recursed_labels and recursive_labels - recursed_labels):
-        raise ValueError("recursive calls do not include required call to {}".format(recursive_labels))
+        #static recursion checks: a procedure that can call itself (the
+        #same checks are done by run() for the calls that were made)
+        if(self.forbid_recursion and cfg.recursive_labels):
+            raise ValueError("recursion is possible in program but it should not be ({})".format(
+                ', '.join(sorted(cfg.recursive_labels))))
+        if(self.require_recursion and not cfg.recursive_labels):
+            raise ValueError("no recursion is possible in program but it should be")
+        #like in run(), only when the program can recurse at all
+        if(cfg.recursive_labels and self.recursive_labels - cfg.recursive_labels):
+            raise ValueError("recursive calls do not include required call to {}".format(self.recursive_labels))
+
+        if(self.check_dead_code):
+            #any instruction (except for labels) that can't be reached 
+            #from the start of the program or from a label is dead code
+            for number in range(0,len(cfg.starts)):
+                if(cfg.labelled[number]):continue
+                for i in range(cfg.starts[number],len(self.program)):
+                    if(cfg.block_of[i] != number):break
+                    assert self.program[i][0] == 'label', \
+                        "Dead code detected: {} can never be executed".format(self.asm[i])
+
+    '''
+    This procedure runs the code normally to the end. Exceptions are raised
+    for violated static checks, stack overflow, and if recursion is (un)used
+    contrary to the forbid/require recursion flags. The program is considered to 
+    have ended when pc equals the length of the asm list.
+    If max_steps is given, LimitExceeded is raised before the program
+    executes more than max_steps instructions. If time_limit is given,
+    LimitExceeded is raised once the program has run for time_limit seconds
+    (the clock is only checked every LIMIT_CHECK_STEPS instructions)
+    '''
+    def run(self, max_steps:int=None, time_limit:float=None):
+        self.check_static_rules()
+        self.recursed_labels = set()
+        #sp is checked after every instruction that writes it, so it 
+        #only has to be checked here once
+        self.check_stack()
+        labels = list(self.label_index.keys())+list(self.linked_labels.keys())
+        self.label_hit_counts = dict(zip(labels, [0]*len(labels)))
+        #local names for the state used on every step, since attribute
+        #lookups are slower. The pc is kept in self.pc, since the
+        #handlers read and write it
+        asm = self.asm
+        code = self.fused_code if self.fuse_instructions else self.code
+        compile_blocks = self.compile_blocks
+        if(self.profile):
+            self.start_profile()
+            code = self.profiled
+            compile_blocks = False
+        if(self.timing):
+            self.timing.start(self,self.profiled if self.profile else self.code)
+            code = self.timing.code
+            compile_blocks = False
+        blocks = self.blocks
+        sizes = self.block_sizes
+        #the limits are only looked at once steps reaches next_check,
+        #so without limits the loop just compares against infinity.
+        #next_check stops one step short of the budget, so that the last
+        #instruction can be run on its own instead of in a fused pair
+        budget = float('inf') if max_steps is None else self.steps + max_steps
+        deadline = None if time_limit is None else time.perf_counter() + time_limit
+        next_check = budget - 1 if deadline is None else min(budget - 1,self.steps + LIMIT_CHECK_STEPS)
+        #output is passed on when the program ends or is stopped
+        try:
+            while self.pc < len(asm):
+                if(self.steps >= next_check):
+                    if(self.steps >= budget):
+                        raise LimitExceeded("instruction limit of {} reached".format(max_steps),'steps',self)
+                    if(deadline is not None):
+                        if(time.perf_counter() >= deadline):
+                            raise LimitExceeded("time limit of {} seconds reached".format(time_limit),'time',self)
+                        next_check = min(budget - 1,self.steps + LIMIT_CHECK_STEPS)
+                    if(self.steps + 1 >= budget):
+                        self.step()
+                        continue
+                #if a basic block starts here, count it and compile it once 
+                #it is hot. Compiled blocks return the next pc. No block
+                #starts at a bl or label
+                if(compile_blocks and blocks[self.pc] is not False):
+                    if(blocks[self.pc] is None):
+                        self.block_counts[self.pc] += 1
+                        if(self.block_counts[self.pc] >= self.block_threshold):
+                            blocks[self.pc] = self.compile_block(self.pc)
+                    #blocks that would go past the next limit check are left to
+                    #the main loop, so that limits are checked on time
+                    if(blocks[self.pc] and self.steps + sizes[self.pc] <= next_check):
+                        #steps is updated before the block runs. If it raises 
+                        #an error, pc and steps are moved back to the instruction
+                        #that raised it (see block_error())
+                        try:
+                            self.steps += sizes[self.pc]
+                            pc = blocks[self.pc](self)
+                            #go straight to the next block if it is also compiled.
+                            #Blocks check sp themselves, so this is safe
+                            while(pc < len(asm) and blocks[pc] and self.steps + sizes[pc] <= next_check):
+                                self.pc = pc
+                                self.steps += sizes[pc]
+                                pc = blocks[pc](self)
+                        except Exception as e:
+                            self.block_error(e)
+                            raise
+                        self.pc = pc
+                        continue
+                #the stack checks, the xzr reset, recursion tracking and label
+                #hit counts are done by the handlers that need them (see
+                #link_program())
+                handler, operands = code[self.pc]
+                handler(*operands)
+                self.steps+=1
+                self.pc+=1
+        finally:
+            self.stdout.flush()
+            if(self.profile):self.call_profile.account(self.steps)
+        recursed_labels = self.recursed_labels
+        #empty recursed_labels list means no recursion happened
+        if(recursed_labels and self.forbid_recursion):
+            raise ValueError("recursion occurred in program but it should not have")
+        if(not recursed_labels and self.require_recursion):
+            raise ValueError("recursion did not occur in program but it should have")
+        #case where there was recursion, but not for the labels specified
+        #in the recursive_labels list. (recursive_labels should be a subset
+        #of recursed_labels)
+        if(recursed_labels and self.recursive_labels - recursed_labels):
+            raise ValueError("recursive calls do not include required call to {}".format(self.recursive_labels))
    
+    '''
+    Simple REPL for testing instructions. Limited to instructions that
+    only affect registers (no memory access or jumps). Prints the flags
+    and affected registers after executing each instruction.
+    '''
+    def repl(self):
+        print('armsim repl. operations on memory not supported\ntype q to quit')
+        instr = ''
+        while(True):
+            instr = input('>> ').lower()
+            if(instr.startswith('q')):break
+            #if enter is pressed with no input skip the rest
+            if(not instr):continue
+            try:
+                self.execute(instr)
+                for r in set(re.findall(register_regex,instr)):
+                    print("{}: {}".format(r,self.reg[r]))
+                print("N: {} Z: {} C: {} V: {}".format(self.n_flag,self.z_flag,self.c_flag,self.v_flag))
+            except ValueError as e:
+                print(e)
+        return
+
+    
+
+    '''
+    Executes the instruction at pc and moves on to the next one. If pc is
+    at a label, the label hit count is updated and the label is skipped.
+    load() (or check_static_rules()) must have been called first. This
+    is used by armdb to run a program one instruction at a time
+    '''
+    def step(self):
+        code = self.code
+        if(self.profile):
+            if(len(self.profiled) != len(self.asm)):self.start_profile()
+            code = self.profiled
+        if(self.timing):
+            if(len(self.timing.code) != len(self.asm)):self.timing.start(self,code)
+            code = self.timing.code
+        try:
+            handler, operands = code[self.pc]
+            handler(*operands)
+            self.steps+=1
+            self.pc+=1
+        finally:
+            self.stdout.flush()
+            if(self.profile):self.call_profile.account(self.steps)
+
+    '''
+    A procedure to return the simulator to it's initial state
+    '''
+    def reset(self):
+        self.__init__()
+
+    #the flags as variables (see flag_property())
+    n_flag = flag_property(0)
+    z_flag = flag_property(1)
+    c_flag = flag_property(2)
+    v_flag = flag_property(3)
+
+
 '''
-Simple REPL for testing instructions. Limited to instructions that
-only affect registers (no memory access or jumps). Prints the flags
-and affected registers after executing each instruction.
+The machine used by the module level functions and variables, so 
+programs written against the original module level interface (see
+documentation/armsim_lib.md) keep working
 '''
+default_machine = Machine()
+
+def parse(lines)->None:
+    default_machine.parse(lines)
+
+def parse_cached(lines,cache_dir:str)->None:
+    default_machine.parse_cached(lines,cache_dir)
+
+def restore():
+    default_machine.restore()
+
+def decode(line:str)->tuple:
+    return default_machine.decode(line)
+
+def load():
+    default_machine.load()
+
+def execute(line:str):
+    default_machine.execute(line)
+
+def execute_decoded(instr:tuple):
+    default_machine.execute_decoded(instr)
+
+def step():
+    default_machine.step()
+
+def getdata(variable:str):
+    return default_machine.getdata(variable)
+
+def check_static_rules():
+    default_machine.check_static_rules()
+
+def run(max_steps:int=None, time_limit:float=None):
+    default_machine.run(max_steps,time_limit)
+
 def repl():
-    global n_flag,z_flag,register_regex
-    print('armsim repl. operations on memory not supported\ntype q to quit')
-    instr = ''
-    while(True):
-        instr = input('>> ').lower()
-        if(instr.startswith('q')):break
-        #if enter is pressed with no input skip the rest
-        if(not instr):continue
-        try:
-            execute(instr)
-            for r in set(re.findall(register_regex,instr)):
-                print("{}: {}".format(r,reg[r]))
-            print("Z: {} N: {}".format(n_flag,z_flag))   
-        except ValueError as e:
-            print(e)
-    return
+    default_machine.repl()
+
+def reset():
+    default_machine.reset()
 
-    
 '''
-A procedure to return the simulator to it's initial state
+Module level variables like armsim.reg or armsim.forbid_loops are
+the attributes of default_machine. The module's class is replaced 
+with one that forwards getting and setting them, so that both
+armsim.reg['x0'] and armsim.forbid_loops = True work like before
 '''
-def reset():
-    global reg,z_flag,n_flag,pc
-    global require_recursion,forbid_recursion,forbid_loops
-    forbidden_instructions.clear()
-    require_recursion = False
-    forbid_recursion = False
-    forbid_loops = False
-    reg = {r:0 for r in reg}
-    mem.clear()
-    asm.clear()
-    sym_table.clear()
-    n_flag = False;z_flag = False
-    pc = 0
-    
+machine_attributes = set(vars(default_machine)) | {'n_flag','z_flag','c_flag','v_flag'}
+
+class ArmsimModule(types.ModuleType):
+    def __getattr__(self, name):
+        if(name in machine_attributes):
+            return getattr(default_machine,name)
+        raise AttributeError("module 'armsim' has no attribute '{}'".format(name))
+
+    def __setattr__(self, name, value):
+        if(name in machine_attributes):
+            setattr(default_machine,name,value)
+        else:
+            super().__setattr__(name,value)
+
+sys.modules[__name__].__class__ = ArmsimModule
+
   
 def main():
+    machine = Machine()
     if(not sys.argv[1:]):
-        repl()
+        machine.repl()
     else:
         _file = sys.argv[1]
         with open(_file,'r') as f:
-            parse(f.readlines())
-        run()
-    return reg['x0']
+            machine.parse(f)
+        machine.run()
+    return machine.reg['x0']
 if __name__ == "__main__":
     main()
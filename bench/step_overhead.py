@@ -0,0 +1,60 @@
+'''
+Measures the time armsim spends per executed instruction, so that
+changes to the main loop can be compared. Each workload is a small
+generated program that runs for a known number of instructions. It is
+run once with the block compiler turned off (every instruction goes
+through the main loop) and once with it on.
+
+Usage (from the top level directory):
+    python bench/step_overhead.py [iterations]
+'''
+import os
+import sys
+import time
+sys.path.insert(0,os.path.join(os.path.dirname(os.path.abspath(__file__)),'..'))
+import armsim
+
+'''
+Workloads: each one is a loop body that is repeated iterations times.
+The counter is kept in x19
+'''
+workloads = {
+    #straight line arithmetic, compiled blocks apply
+    'arithmetic':['add x1, x1, 3','sub x2, x2, x1','lsl x3, x1, 2','eor x4, x3, 5'],
+    #loads and stores relative to sp
+    'memory':['str x1, [sp, 8]','ldr x2, [sp, 8]','add x1, x2, 1','stp x1, x2, [sp]'],
+    #procedure calls, which always go through the main loop
+    'calls':['bl work','add x1, x1, 1'],
+}
+
+def program(body:list, iterations:int)->list:
+    lines = ['.text','.global _start','_start:','sub sp, sp, 16','mov x19, {}'.format(iterations),'again:']
+    lines += body
+    lines += ['sub x19, x19, 1','cbnz x19, again','mov x0, 0','mov x8, 93','svc 0','work:','add x5, x5, 1','ret']
+    return [l + '\n' for l in lines]
+
+'''
+Runs the program and returns the time taken per instruction in 
+nanoseconds, together with the number of instructions
+'''
+def measure(lines:list, compile_blocks:bool):
+    machine = armsim.Machine()
+    machine.compile_blocks = compile_blocks
+    machine.parse(lines)
+    machine.load()
+    start = time.perf_counter()
+    machine.run()
+    elapsed = time.perf_counter() - start
+    return elapsed*1e9/machine.steps, machine.steps
+
+def main():
+    iterations = int(sys.argv[1]) if sys.argv[1:] else 20000
+    print("{:<12}{:>12}{:>18}{:>18}".format('workload','steps','interpreted ns','compiled ns'))
+    for name,body in workloads.items():
+        lines = program(body,iterations)
+        interpreted, steps = measure(lines,False)
+        compiled, steps = measure(lines,True)
+        print("{:<12}{:>12}{:>18.1f}{:>18.1f}".format(name,steps,interpreted,compiled))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,201 @@
+'''
+Benchmark suite for armsim. Runs the programs in examples/ and tests/
+and some generated workloads that are scaled up to sizes the examples
+don't reach:
+    sort_1k         insertion sort of 1,000 random numbers
+    sort_10k        insertion sort of 10,000 nearly sorted numbers
+    sort_100k       insertion sort of 100,000 nearly sorted numbers
+                    (the .8byte arrays also make parsing measurable)
+    collatz_range   collatz.s on every input from 1 to 300, parsed once
+                    and restored before each input (see Machine.restore())
+    recursion       a procedure that calls itself 100,000 deep
+
+Every workload is run in a fresh python process, so that the peak
+memory (the maximum resident set size of the process, in KiB) belongs
+to that workload only. For each one the result has:
+    parse           seconds taken by parse()
+    check           seconds taken by check_static_rules(), which also
+                    decodes the program and builds its control flow graph
+    run             seconds taken by run() (all inputs together)
+    steps           instructions executed
+    ips             instructions per second while running
+    peak_kib        peak memory of the process
+With --repeat, the times are the fastest of that many repeats.
+
+The results are written as json. A results file can be kept and passed
+back with --baseline to compare against it: a table with the ratio of
+every time to the baseline is printed to stderr, and the exit code is 1
+if a time got slower by more than the threshold or the number of
+instructions of a program changed (which means the simulator behaves
+differently).
+
+Usage (from the top level directory):
+    python bench/suite.py [-o results.json] [-b baseline.json] [-r 3] [-t 0.1] [workload ...]
+'''
+import argparse
+import io
+import json
+import multiprocessing
+import os
+import platform
+import random
+import resource
+import sys
+import time
+root = os.path.join(os.path.dirname(os.path.abspath(__file__)),'..')
+sys.path.insert(0,root)
+import armsim
+
+#times that are compared against the baseline
+timings = ('parse','check','run')
+
+'''
+Generated workloads. Each returns the lines of a program
+'''
+def sort_program(count:int, nearly_sorted:bool)->list:
+    numbers = list(range(count))
+    generator = random.Random(count)
+    if(nearly_sorted):
+        #swap one pair in every hundred
+        for i in range(0,count-1,100):
+            numbers[i],numbers[i+1] = numbers[i+1],numbers[i]
+    else:
+        generator.shuffle(numbers)
+    lines = ['.text','.global _start','_start:',
+             'ldr x0, =array','ldr x1, =count','bl sort','mov x0, 0','mov x8, 93','svc 0',
+             #insertion sort of the x1 numbers at x0
+             'sort:','mov x2, 1',
+             'outer:','cmp x2, x1','b.ge done',
+             'lsl x4, x2, 3','add x4, x0, x4','ldr x3, [x4]','sub x5, x2, 1',
+             'inner:','cmp x5, 0','b.lt insert',
+             'lsl x6, x5, 3','add x6, x0, x6','ldr x7, [x6]','cmp x7, x3','b.le insert',
+             'str x7, [x6, 8]','sub x5, x5, 1','b inner',
+             'insert:','add x6, x5, 1','lsl x6, x6, 3','add x6, x0, x6','str x3, [x6]',
+             'add x2, x2, 1','b outer',
+             'done:','ret',
+             '.data','array: .8byte ' + ','.join(map(str,numbers)),'count = {}'.format(count)]
+    return [line + '\n' for line in lines]
+
+def recursion_program(depth:int)->list:
+    lines = ['.text','.global _start','_start:',
+             'ldr x0, =depth','bl sum','mov x8, 93','svc 0',
+             #sum of the numbers from 1 to x0, one call per number
+             'sum:','cbz x0, base','stp x0, lr, [sp, #-16]!','sub x0, x0, 1','bl sum',
+             'ldp x1, lr, [sp], #16','add x0, x0, x1','ret',
+             'base:','ret',
+             '.data','depth = {}'.format(depth)]
+    return [line + '\n' for line in lines]
+
+def read_program(path:str)->list:
+    with open(os.path.join(root,path),'r') as f:
+        return f.readlines()
+
+'''
+Returns a dict of workload name to (program lines, list of inputs). The
+program is run once for every input
+'''
+def workloads()->dict:
+    inputs = {'collatz.s':'37\n', 'guess.s':''.join('{}\n'.format(n) for n in range(10)), 'prompt.s':'world\n'}
+    programs = {}
+    for directory in ('examples','tests'):
+        for name in sorted(os.listdir(os.path.join(root,directory))):
+            if(name.endswith('.s')):
+                programs[directory + '/' + name] = (read_program(directory + '/' + name),[inputs.get(name,'')])
+    programs['sort_1k'] = (sort_program(1000,False),[''])
+    programs['sort_10k'] = (sort_program(10000,True),[''])
+    programs['sort_100k'] = (sort_program(100000,True),[''])
+    programs['collatz_range'] = (read_program('examples/collatz.s'),['{}\n'.format(n) for n in range(1,301)])
+    programs['recursion'] = (recursion_program(100000),[''])
+    return programs
+
+'''
+Runs one workload repeat times and returns its result. Called in a
+process of its own (see main())
+'''
+def measure(name:str, repeat:int)->dict:
+    lines, inputs = workloads()[name]
+    result = {}
+    for i in range(0,repeat):
+        machine = armsim.Machine()
+        start = time.perf_counter()
+        machine.parse(lines)
+        parsed = time.perf_counter()
+        machine.check_static_rules()
+        checked = time.perf_counter()
+        elapsed = 0.0
+        steps = 0
+        for stdin in inputs:
+            machine.restore()
+            machine.stdin = armsim.InputSource(stdin)
+            machine.stdout = armsim.OutputSink(io.BytesIO())
+            run_start = time.perf_counter()
+            machine.run()
+            elapsed += time.perf_counter() - run_start
+            steps += machine.steps
+        times = {'parse':parsed - start, 'check':checked - parsed, 'run':elapsed}
+        for timing in timings:
+            result[timing] = min(result.get(timing,times[timing]),times[timing])
+        result['steps'] = steps
+    result['ips'] = result['steps']/result['run'] if result['run'] else None
+    result['peak_kib'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return result
+
+'''
+Compares results with a baseline. Prints a table to stderr and returns
+the list of regressions
+'''
+def compare(results:dict, baseline:dict, threshold:float)->list:
+    regressions = []
+    print("{:<28}{:>10}{:>10}{:>10}{:>12}".format('workload','parse','check','run','steps'),file=sys.stderr)
+    for name,result in results.items():
+        if(name not in baseline):continue
+        old = baseline[name]
+        ratios = []
+        for timing in timings:
+            ratio = result[timing]/old[timing] if old[timing] else 1.0
+            ratios.append(ratio)
+            if(ratio > 1 + threshold):
+                regressions.append("{} {} is {:.0%} slower".format(name,timing,ratio - 1))
+        #guess.s picks a random number, so its steps change from run to run
+        same = result['steps'] == old['steps'] or name.endswith('guess.s')
+        if(not same):
+            regressions.append("{} executed {} instructions instead of {}".format(name,result['steps'],old['steps']))
+        print("{:<28}{:>9.2f}x{:>9.2f}x{:>9.2f}x{:>12}".format(
+            name,*ratios,'same' if same else 'CHANGED'),file=sys.stderr)
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark armsim on the example programs and generated workloads')
+    parser.add_argument('workloads', nargs='*', help='names of the workloads to run (default: all)')
+    parser.add_argument('-o','--output', help='file to write the results to (default: stdout)')
+    parser.add_argument('-b','--baseline', help='results file to compare against')
+    parser.add_argument('-r','--repeat', type=int, default=1, help='times to run each workload, the fastest is kept (default: 1)')
+    parser.add_argument('-t','--threshold', type=float, default=0.1, help='slowdown compared to the baseline that counts as a regression (default: 0.1)')
+    args = parser.parse_args()
+    names = args.workloads or list(workloads())
+    unknown = set(names) - set(workloads())
+    if(unknown):parser.error("unknown workloads: {}".format(', '.join(sorted(unknown))))
+    results = {}
+    #a new process for every workload, so that peak memory is its own
+    context = multiprocessing.get_context('spawn')
+    with context.Pool(1,maxtasksperchild=1) as pool:
+        for name in names:
+            results[name] = pool.apply(measure,(name,args.repeat))
+            print("{:<28}{:>12} steps {:>10.3f}s".format(name,results[name]['steps'],results[name]['run']),file=sys.stderr)
+    report = {'simulator':armsim.simulator_version(), 'python':platform.python_version(),
+              'machine':platform.machine(), 'results':results}
+    if(args.output):
+        with open(args.output,'w') as f:
+            json.dump(report,f,indent=1)
+    else:
+        print(json.dumps(report,indent=1))
+    if(args.baseline):
+        with open(args.baseline,'r') as f:
+            baseline = json.load(f)['results']
+        regressions = compare(results,baseline,args.threshold)
+        for regression in regressions:
+            print(regression,file=sys.stderr)
+        if(regressions):sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -48,14 +48,37 @@ check('orrs x0, x1, x2', result = 0, x1 = 0, x2 = 0, zeroFlag = True)
 
 check('asr x0, x1, #1', result = 1, x1 = 2)
 check('asr x0, x1, #6', result = 1, x1 = 64)
+check('asr x0, x1, #60', result = -1, x1 = -1)
+
+check('lsr x0, x1, #1', result = 1, x1 = 2)
+check('lsr x0, x1, #60', result = 15, x1 = -1)
 
 check('lsl x0, x1, #1', result = 2, x1 = 1)
 check('lsl x0, x1, #3', result = 80, x1 = 10)
+check('lsl x0, x1, #1', result = -2, x1 = 0x7fffffffffffffff)
 
 check('mul x0, x1, x1', result = 100, x1 = 10)
 check('udiv x0, x1, x2', result = 10, x1 = 100, x2 = 10)
 check('udiv x0, x1, x2', result = 10, x1 = 101, x2 = 10)
+check('udiv x0, x1, x2', result = 0x7fffffffffffffff, x1 = -1, x2 = 2)
+check('sdiv x0, x1, x2', result = -3, x1 = -7, x2 = 2)
+
+#registers are 64 bits wide and wrap around
+check('mov x0, #0xffffffffffffffff', result = -1)
+check('add x0, x1, #1', result = -2**63, x1 = 2**63 - 1)
+check('adds x0, x1, x1', result = -2, x1 = 2**63 - 1, negFlag = True)
+check('mul x0, x1, x1', result = 0, x1 = 2**32)
 
 check('cmp x1, #1',result = 0, x1 = 0, zeroFlag = False, negFlag = True)
 check('cmp x1, #1',result = 0, x1 = 1, zeroFlag = True, negFlag = False)
 check('cmp x1, #1',result = 0, x1 = 2, zeroFlag = False, negFlag = False)
+
+#x29 and x30 are the same registers as fp and lr, xzr is always 0
+check('mov x0, x29', result = 0)
+check('add x0, xzr, #5', result = 5)
+check('mov xzr, #5', result = 0)
+armsim.execute('mov x30, #3')
+assert armsim.reg['lr'] == 3, "x30 should be an alias for lr"
+armsim.execute('mov xzr, #3')
+assert armsim.reg['xzr'] == 0, "xzr should always be 0"
+armsim.reset()
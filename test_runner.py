@@ -40,9 +40,109 @@ armsim.run()
 assert armsim.reg['x0'] == 7, "brk_test returned incorrect value of {}".format(armsim.reg['x0'])
 armsim.reset()
 
+with open('tests/condition_test.s','r') as f:
+	armsim.parse(f.readlines())
+armsim.run()
+assert armsim.reg['x0'] == 7, "condition_test returned incorrect value of {}".format(armsim.reg['x0'])
+assert armsim.z_flag and not armsim.n_flag and not armsim.v_flag, "flags after condition_test should be Z only"
+armsim.reset()
+
+'''
+Memory is only allocated as it is written, reads of unwritten memory
+give zeros, and values that cross a page still work
+'''
+with open('tests/brk_test.s','r') as f:
+	armsim.parse(f.readlines())
+assert len(armsim.mem.pages) <= 1, "the stack should not be allocated by parse()"
+memory = armsim.Memory()
+memory.resize(3*armsim.PAGE_SIZE)
+assert memory.load_quad(armsim.PAGE_SIZE) == 0 and not memory.pages, "unwritten memory should read as zero"
+memory.store_pair(armsim.PAGE_SIZE - 4,-2,3)
+assert memory.load_pair(armsim.PAGE_SIZE - 4) == (-2,3), "a pair across two pages was not read back"
+memory.resize(armsim.PAGE_SIZE)
+memory.resize(3*armsim.PAGE_SIZE)
+assert memory.read(armsim.PAGE_SIZE - 4,8) == bytes([254,255,255,255,0,0,0,0]), "memory past the end should be zero after shrinking"
+armsim.reset()
+
+'''
+parse() reads the lines from any iterable, e.g. a generator, and
+keeps the layout of the data section
+'''
+def big_program():
+    yield '.data\n'
+    yield 'small: .8byte 1, - 2, 18446744073709551615\n'
+    yield 'big: .8byte ' + ','.join(str(i) for i in range(100000)) + '\n'
+    yield 'buffer: .space 16\n'
+    yield 'text: .asciz "Hi\\n"\n'
+    yield 'text_len = . - text\n'
+    yield '.text\n'
+    yield '_start:\n'
+    yield 'mov x0, 7\n'
+armsim.parse(big_program())
+assert armsim.getdata('small') == [1,-2,-1], "incorrect .8byte values: {}".format(armsim.getdata('small'))
+assert armsim.getdata('big') == list(range(100000)), "incorrect values in a big .8byte array"
+assert armsim.sym_table['buffer'] == armsim.sym_table['big'] + 800000 and armsim.getdata('buffer') == [0]*16, "incorrect .space after a big array"
+assert armsim.getdata('text') == ['H','i','\n'] and armsim.sym_table['text_len'] == 3, "incorrect .asciz after .space"
+assert armsim.brk == armsim.sym_table['text'] + 3, "the break should be at the end of the data"
+armsim.reset()
+
 
 
 
+'''
+A program read from the cache must be the same as a parsed one
+'''
+import os
+import tempfile
+with tempfile.TemporaryDirectory() as directory:
+    with open('examples/sort.s','r') as f:
+        lines = f.readlines()
+    armsim.parse_cached(lines,directory)
+    armsim.load()
+    parsed = (list(armsim.asm),list(armsim.source_lines),list(armsim.program),dict(armsim.sym_table))
+    armsim.reset()
+    armsim.parse_cached(lines,directory)
+    assert (armsim.asm,armsim.source_lines,armsim.program,armsim.sym_table) == parsed, "cached sort.s differs from the parsed one"
+    armsim.run()
+    assert armsim.getdata('array') == sorted(armsim.getdata('array')), "incorrect result produced after running cached sort.s"
+    armsim.reset()
+    #a cached program doesn't depend on linked_labels, so they can be 
+    #set by the machine that reads it, before or after parse_cached()
+    program = ['.text\n','_start:\n','mov x1, 9\n','bl printx1\n','mov x8, 93\n','svc 0\n']
+    printed = []
+    uncached = armsim.Machine()
+    uncached.parse_cached(program,directory)
+    for linked_first in (True,False):
+        machine = armsim.Machine()
+        if(linked_first):machine.linked_labels['printx1:'] = lambda: printed.append(machine.reg['x1'])
+        machine.parse_cached(program,directory)
+        if(not linked_first):machine.linked_labels['printx1:'] = lambda: printed.append(machine.reg['x1'])
+        machine.run()
+    assert printed == [9,9], "linked label should be called from a cached program, not {}".format(printed)
+    try:
+        uncached.run()
+        assert False, "bl to a label that isn't linked should fail"
+    except ValueError as e:
+        assert 'nonexistent label' in str(e), "wrong error for a missing label: {}".format(e)
+    #a machine that held another program only has the cached one afterwards
+    saved = armsim.Machine()
+    saved.parse(lines)
+    saved.load()
+    saved.save_program(os.path.join(directory,'sort.armc'))
+    machine = armsim.Machine()
+    with open('examples/collatz.s','r') as f:
+        machine.parse(f)
+    machine.stdin = armsim.InputSource('37\n')
+    machine.stdout = armsim.OutputSink(BytesIO())
+    machine.run()
+    machine.load_program(os.path.join(directory,'sort.armc'))
+    assert machine.sym_table == saved.sym_table and machine.label_index == saved.label_index, "load_program should replace the symbols and labels of the previous program"
+    assert (machine.output,machine.recursed_labels,machine.label_hit_counts,machine.pc,machine.steps) == (bytearray(),set(),{},0,0), \
+        "load_program should reset the output and counters of the previous program"
+    machine.run()
+    assert machine.getdata('array') == sorted(machine.getdata('array')), "incorrect result produced after loading sort.s into a used machine"
+
+
 '''
 Test the sort program
 '''
@@ -54,9 +154,78 @@ assert armsim.getdata('array') == sorted(original), "incorrect result produced a
 assert armsim.getdata('sorted') == sorted(original), "incorrect result produced after running sort.s"
 assert armsim.getdata('reverse') == sorted(original), "incorrect result produced after running sort.s"
 assert armsim.getdata('nearly_sorted') == sorted(original), "incorrect result produced after running sort.s"
+sort_steps = armsim.steps
+armsim.restore()
+assert armsim.getdata('array') == original, "restore() should undo the writes made by sort.s"
 armsim.reset()  
 
 
+'''
+Run sort.s again without compiling basic blocks, so that both
+the main loop and the block compiler are tested
+'''
+with open('examples/sort.s','r') as f:
+    armsim.parse(f.readlines())
+armsim.compile_blocks = False
+original = armsim.getdata('array')
+armsim.run()
+assert armsim.getdata('array') == sorted(original), "incorrect result produced after running sort.s without compiled blocks"
+assert armsim.steps == sort_steps, "compiled blocks counted {} steps instead of {}".format(sort_steps,armsim.steps)
+sort_label_hits = dict(armsim.label_hit_counts)
+armsim.compile_blocks = True
+armsim.reset()
+
+
+'''
+An error in the middle of a compiled block is reported at the same pc
+and step count as when the program is run one step() at a time. The 
+ldr goes out of bounds after the loop's block has been compiled
+'''
+program = ['.text\n','_start:\n','sub sp, sp, 512\n','mov x1, 0\n','loop:\n','add x0, x0, 1\n',
+           'ldr x2, [sp, x1]\n','add x1, x1, 8\n','add x3, x3, x2\n','cmp x0, 1000\n','b.lt loop\n',
+           'mov x8, 93\n','svc 0\n']
+stopped = []
+for compiled in (True,False):
+    machine = armsim.Machine()
+    machine.parse(program)
+    machine.load()
+    try:
+        if(compiled):
+            machine.run()
+        else:
+            while(True):machine.step()
+    except ValueError as e:
+        stopped.append((str(e),machine.pc,machine.steps,list(machine.registers)))
+assert len(stopped) == 2 and stopped[0][1] == 4, "the ldr should fail: {}".format([s[:3] for s in stopped])
+assert stopped[0] == stopped[1], "compiled block stopped at pc {} after {} steps, step() at pc {} after {}".format(
+    stopped[0][1],stopped[0][2],stopped[1][1],stopped[1][2])
+
+
+'''
+And once more without fused instructions (or compiled blocks), to
+check that superinstructions don't change steps or label hit counts
+'''
+with open('examples/sort.s','r') as f:
+    armsim.parse(f.readlines())
+armsim.compile_blocks = False
+armsim.fuse_instructions = False
+armsim.run()
+assert armsim.getdata('array') == sorted(original), "incorrect result produced after running sort.s without fused instructions"
+assert armsim.steps == sort_steps, "fused instructions counted {} steps instead of {}".format(sort_steps,armsim.steps)
+assert armsim.label_hit_counts == sort_label_hits, "fused instructions changed the label hit counts"
+armsim.reset()
+#a fused pair must not go past the instruction limit
+armsim.parse(['.text\n','.global _start\n','_start:\n','mov x0, 3\n','loop:\n','subs x0, x0, 1\n','b.ne loop\n'])
+armsim.compile_blocks = False
+try:
+    armsim.run(max_steps=2)
+    assert False, "the loop should not finish in 2 instructions"
+except armsim.LimitExceeded as e:
+    assert e.steps == 2 and e.pc == 3 and e.reg['x0'] == 2, "fused pair stopped at the wrong place: pc {} steps {}".format(e.pc,e.steps)
+armsim.compile_blocks = True
+armsim.reset()
+
+
 '''
 collatz.s is currently the most complex program, so it's 
 worth having an automated test to make sure it's working
@@ -73,12 +242,278 @@ with open('examples/collatz.s','r') as f:
 sys.stdin = StringIO('37')
 armsim.run()
 assert armsim.reg['x0'] == 22, "collatz of 37 should not be {}".format(armsim.reg['x0'])
+steps = armsim.steps
+
+#restore() goes back to the state after parse() to run it again
+armsim.restore()
+sys.stdin = StringIO('27')
+armsim.run()
+assert armsim.reg['x0'] == 112, "collatz of 27 should not be {} after restore()".format(armsim.reg['x0'])
+armsim.restore()
+sys.stdin = StringIO('37')
+armsim.run()
+assert armsim.reg['x0'] == 22 and armsim.steps == steps, "collatz of 37 gave a different result after restore()"
+
+armsim.reset()
+
+
+
+
+
+'''
+Two machines can hold different programs at the same time
+'''
+first = armsim.Machine()
+second = armsim.Machine()
+with open('tests/arithmetic_test.s','r') as f:
+    first.parse(f.readlines())
+with open('examples/sort.s','r') as f:
+    second.parse(f.readlines())
+first.run()
+second.run()
+assert first.reg['x0'] == 7, "arithmetic_test returned incorrect value of {} in a separate machine".format(first.reg['x0'])
+assert second.getdata('array') == sorted(second.getdata('array')), "incorrect result produced after running sort.s in a separate machine"
+assert not armsim.asm, "running a separate machine should not change the default machine"
+
+
+'''
+When profiling, every executed instruction is counted and the report
+points at the line of the source it came from
+'''
+profiled = armsim.Machine()
+with open('examples/sort.s','r') as f:
+    lines = f.readlines()
+profiled.parse(lines)
+profiled.profile = True
+profiled.run()
+report = profiled.profile_report()
+assert sum(entry['count'] for entry in report) == profiled.steps == 1090, "profile of sort.s should count all {} instructions".format(profiled.steps)
+assert [entry['count'] for entry in report] == sorted([entry['count'] for entry in report],reverse=True), "profile report should be ranked by count"
+for entry in report:
+    assert lines[entry['line']-1].strip().lower() == entry['text'], "instruction {} is not on line {}".format(entry['text'],entry['line'])
+assert profiled.getdata('array') == sorted(profiled.getdata('array')), "incorrect result produced after profiling sort.s"
+#the last instruction before a step limit is run by step(), which counts too
+profiled.restore()
+try:
+    profiled.run(max_steps=100)
+    assert False, "sort.s should not finish in 100 instructions"
+except armsim.LimitExceeded:
+    assert sum(entry['count'] for entry in profiled.profile_report()) == 100, "profile should count the 100 instructions executed"
+
+#the calls made by collatz.s for 37: 22 nested calls of collatz
+profiled = armsim.Machine()
+with open('examples/collatz.s','r') as f:
+    profiled.parse(f)
+profiled.profile = True
+profiled.stdin = armsim.InputSource('37\n')
+profiled.stdout = armsim.OutputSink(StringIO())
+profiled.run()
+procedures = profiled.call_profile.procedures()
+assert procedures['collatz']['calls'] == procedures['collatz']['max_depth'] == 22, "collatz should recurse 22 deep, not {}".format(procedures['collatz'])
+assert procedures['_start']['inclusive'] == profiled.steps, "everything is called from _start"
+assert sum(entry['exclusive'] for entry in procedures.values()) == profiled.steps, "every instruction should be in one procedure"
+folded = [line.rsplit(' ',1) for line in profiled.call_profile.folded().splitlines()]
+assert sum(int(count) for stack,count in folded) == profiled.steps, "folded stacks should add up to all instructions"
+assert max(stack.count('collatz') for stack,count in folded) == 22, "deepest folded stack should have 22 calls of collatz"
+folded = [line.rsplit(' ',1) for line in profiled.call_profile.folded(5).splitlines()]
+assert max(stack.count(';') for stack,count in folded) == 4, "folded stacks should be cut off at 5 procedures"
+assert sum(int(count) for stack,count in folded) == profiled.steps, "cut off folded stacks should still add up to all instructions"
+
+
+'''
+A timing model estimates the cycles a program takes. An instruction
+waits for the registers it reads: here the mul waits for the mov, the
+add for the mul and the svc for everything
+'''
+timed = armsim.Machine()
+timed.parse(['.text\n','_start:\n','mov x0, 1\n','mul x1, x0, x0\n','add x2, x1, 1\n','mov x8, 93\n','svc 0\n'])
+timed.timing = armsim.TimingModel()
+timed.run()
+report = timed.timing.report()
+assert (report['cycles'],report['stalls'],report['instructions']) == (206,3,5), "wrong estimate for a dependent chain: {}".format(report)
+assert report['classes'] == {'alu':3,'multiply':1,'syscall':1}, "wrong instruction classes: {}".format(report['classes'])
+with open('examples/sort.s','r') as f:
+    timed = armsim.Machine()
+    timed.parse(f)
+timed.timing = armsim.TimingModel()
+timed.run()
+cycles = timed.timing.cycles
+assert timed.getdata('array') == sorted(timed.getdata('array')) and timed.steps == 1090, "timing should not change how sort.s runs"
+timed.restore()
+timed.run()
+assert timed.timing.cycles == cycles, "the estimate for sort.s should be the same every run"
+
+
+'''
+run() stops a program that goes over its instruction budget or time
+limit and keeps the output it produced
+'''
+with open('examples/hello.s','r') as f:
+    armsim.parse(f.readlines())
+try:
+    armsim.run(max_steps=5)
+    assert False, "hello.s should not finish in 5 instructions"
+except armsim.LimitExceeded as e:
+    assert e.reason == 'steps' and e.steps == 5 and e.pc == 5, "hello.s stopped at the wrong place: pc {} steps {}".format(e.pc,e.steps)
+    assert e.output == 'hello world\n', "LimitExceeded should keep the output of hello.s"
+armsim.reset()
+armsim.parse(['.text\n','.global _start\n','_start:\n','loop:\n','b loop\n'])
+try:
+    armsim.run(time_limit=0.1)
+    assert False, "an infinite loop should not finish"
+except armsim.LimitExceeded as e:
+    assert e.reason == 'time', "an infinite loop should hit the time limit"
+armsim.reset()
 
+
+'''
+Output goes to the machine's OutputSink as raw bytes, so it can be
+captured without replacing sys.stdout and limited in size
+'''
+program = ['.data\n','bytes: .8byte -1\n','.text\n','_start:\n',
+           'mov x0, 1\n','ldr x1, =bytes\n','mov x2, 8\n','mov x8, 64\n','svc 0\n',
+           'mov x0, 7\n','mov x8, 93\n','svc 0\n']
+armsim.parse(program)
+captured = BytesIO()
+armsim.stdout = armsim.OutputSink(captured)
+armsim.run()
+assert captured.getvalue() == b'\xff'*8 and armsim.output == b'\xff'*8, "non-ascii output was not written as it is"
+armsim.restore()
+captured = BytesIO()
+armsim.stdout = armsim.OutputSink(captured,limit=4)
+try:
+    armsim.run()
+    assert False, "the program should be stopped by the output limit"
+except armsim.LimitExceeded as e:
+    assert e.reason == 'output' and captured.getvalue() == b'\xff'*4, "output limit stopped the program with {!r}".format(captured.getvalue())
 armsim.reset()
 
 
+'''
+The read syscall copies bytes from the machine's InputSource. Exact
+reads: a short read leaves the rest of the line for the next one, a 
+read stops after a newline unless line_buffered is False, and the end
+of the input returns 0
+'''
+program = ['.bss\n','buffer: .space 16\n','.text\n','_start:\n',
+           'mov x0, 0\n','ldr x1, =buffer\n','mov x2, 2\n','mov x8, 63\n','svc 0\n','mov x3, x0\n',
+           'mov x0, 0\n','ldr x1, =buffer\n','add x1, x1, 2\n','mov x2, 8\n','mov x8, 63\n','svc 0\n','mov x4, x0\n',
+           'mov x0, 0\n','ldr x1, =buffer\n','mov x2, 8\n','mov x8, 63\n','svc 0\n','mov x5, x0\n']
+machine = armsim.Machine()
+machine.parse(program)
+machine.stdin = armsim.InputSource(b'12345\n6',exact=True)
+machine.run()
+assert (machine.reg['x3'],machine.reg['x4'],machine.reg['x5']) == (2,4,1), "wrong byte counts from reads"
+assert bytes(machine.getdata('buffer')[0:6]) == b'62345\n', "reads wrote the wrong bytes: {}".format(machine.getdata('buffer'))
+machine.restore()
+machine.stdin = armsim.InputSource((chunk for chunk in ['12','','345\n67']),line_buffered=False,exact=True)
+machine.run()
+assert (machine.reg['x3'],machine.reg['x4'],machine.reg['x5']) == (2,6,0), "wrong byte counts from reads of a generator"
+machine.restore()
+machine.stdin = armsim.InputSource('',exact=True)
+machine.run()
+assert (machine.reg['x3'],machine.reg['x4'],machine.reg['x5']) == (0,0,0), "reads at the end of the input should return 0"
+#by default a read takes a whole line, adds the missing newline and
+#throws away what doesn't fit, like the read syscall always did
+machine.restore()
+machine.stdin = armsim.InputSource('12345\n6')
+machine.run()
+assert (machine.reg['x3'],machine.reg['x4'],machine.reg['x5']) == (2,2,0), "wrong byte counts from line reads"
+assert bytes(machine.getdata('buffer')[0:4]) == b'126\n', "line reads wrote the wrong bytes: {}".format(machine.getdata('buffer'))
+#a read of 0 bytes doesn't touch the source
+assert armsim.InputSource(iter(())).read(0) == b'' and armsim.InputSource(0,exact=True).read(0) == b'', "reading 0 bytes should return b''"
+
+
+'''
+Batch grading: each job gets its own fixture and a program that
+never ends is stopped without affecting the other jobs
+'''
+import armbatch
+import json
+import tempfile
+import os
+with tempfile.TemporaryDirectory() as directory:
+    spin = os.path.join(directory,'spin.s')
+    with open(spin,'w') as f:
+        f.write('.text\n.global _start\n_start:\nloop:\nb loop\n')
+    jobs = [{'id':'collatz','program':'examples/collatz.s','stdin':'37\n'},
+            {'id':'spin','program':spin},
+            {'id':'budget','program':spin,'max_steps':1000},
+            {'id':'loops','program':'examples/sort.s','forbid_loops':True}]
+    results = {r['id']:r for r in armbatch.grade(jobs,workers=2,timeout=1)}
+assert results['collatz']['status'] == 'ok' and results['collatz']['x0'] == 22, "batch run of collatz.s failed: {}".format(results['collatz'])
+assert results['collatz']['stdout'].startswith('Enter a positive number'), "batch run of collatz.s did not capture stdout"
+assert results['spin']['status'] == 'timeout' and results['spin']['steps'], "infinite loop should time out in batch mode"
+assert results['budget']['status'] == 'step_limit' and results['budget']['steps'] == 1000, "infinite loop should stop at max_steps in batch mode"
+assert results['loops']['violations'] == ['you cannot loop'], "forbid_loops should be reported as a violation in batch mode"
+#a machine that is reused for the same program is restored, and the
+#rules of the previous job don't carry over
+machine = armsim.Machine()
+first = armbatch.run_job({'id':'a','program':'examples/sort.s','forbid_loops':True},machine)
+second = armbatch.run_job({'id':'b','program':'examples/sort.s'},machine)
+assert first['status'] == 'violation' and second['status'] == 'ok', "rules should not carry over to the next job: {}".format(second)
+third = armbatch.run_job({'id':'c','program':'examples/sort.s'},machine)
+assert third['steps'] == second['steps'] == sort_steps, "a reused machine should run sort.s in the same number of steps"
+fourth = armbatch.run_job({'id':'d','program':'examples/sort.s','cycles':True},machine)
+assert fourth['cycles'] == cycles and third['cycles'] is None, "batch mode should only estimate cycles when asked to"
+#output that isn't utf-8 is returned as base64 without losing any bytes
+with tempfile.TemporaryDirectory() as directory:
+    binary = os.path.join(directory,'binary.s')
+    with open(binary,'w') as f:
+        f.write('.text\n.global _start\n_start:\nmov x0, 1\nldr x1, =bytes\nmov x2, 2\nmov x8, 64\nsvc 0\n'
+                'mov x0, 0\nmov x8, 93\nsvc 0\n.data\nbytes: .8byte 16895\n')
+    result = armbatch.run_job({'id':'binary','program':binary})
+assert (result['stdout_encoding'],result['stdout']) == ('base64','/0E='), "output that isn't utf-8 should be base64: {}".format(result)
+assert armbatch.output_bytes(result) == b'\xffA', "output_bytes should decode base64 output"
+assert results['collatz']['stdout_encoding'] == 'utf-8' and armbatch.output_bytes(results['collatz']).startswith(b'Enter'), \
+    "utf-8 output should be kept as text"
+assert json.loads(json.dumps(result)) == result, "results should survive json"
 
 
+'''
+Lanes: collatz.s on many inputs at once must give the same results as
+running it once per input. armlanes needs numpy, so it is only tested
+when numpy is installed
+'''
+try:
+    import armlanes
+except ImportError:
+    armlanes = None
+if(armlanes):
+    inputs = ['{}\n'.format(n) for n in range(0,40)] + ['']
+    machine = armsim.Machine()
+    with open('examples/collatz.s','r') as f:
+        machine.parse(f.readlines())
+    lanes = armlanes.Lanes(machine,inputs)
+    lanes.run(max_steps=1000)
+    for fixture,result in zip(inputs,lanes.results()):
+        machine = armsim.Machine()
+        with open('examples/collatz.s','r') as f:
+            machine.parse(f.readlines())
+        machine.stdin = armsim.InputSource(fixture)
+        output = BytesIO()
+        machine.stdout = armsim.OutputSink(output)
+        try:
+            machine.run(max_steps=1000)
+            status = 'ok'
+        except armsim.LimitExceeded:
+            status = 'step_limit'
+        written = output.getvalue().decode('utf-8','replace')
+        assert (result['status'],result['x0'],result['stdout'],result['steps']) == (status,machine.reg['x0'],written,machine.steps), \
+            "lane for input {!r} doesn't match armsim: {}".format(fixture,result)
+    #growing the heap past heap_size only stops the lane that did it
+    program = ['.text\n','_start:\n','mov x19, x0\n','mov x0, 0\n','mov x8, 214\n','svc 0\n',
+               'add x0, x0, x19\n','mov x8, 214\n','svc 0\n','mov x0, 7\n','mov x8, 93\n','svc 0\n']
+    machine = armsim.Machine()
+    machine.parse(program)
+    lanes = armlanes.Lanes(machine,['','',''],heap_size=0x2000)
+    lanes.register('x0')[:] = [8,0x1000,0x100000]
+    lanes.run()
+    width = lanes.mem.shape[1]
+    assert [result['status'] for result in lanes.results()] == ['ok','ok','memory_limit'], "only the lane over heap_size should stop: {}".format(lanes.results())
+    assert width - (len(machine.mem) - lanes.base) <= 0x2000, "the memory of the lanes should not grow past heap_size"
+    assert lanes.results()[2]['error'] == 'heap limit of 8192 bytes reached', "wrong error for a lane over heap_size: {}".format(lanes.results()[2])
+
 
 '''
 Tests for check_static_rules()
@@ -130,6 +565,45 @@ except ValueError:
     #expected
     armsim.reset()
     
+#the static checks work on the control flow graph: a branch back 
+#that can't lead to itself is not a loop, a procedure that is never
+#called is not dead code but the code after its ret is, and recursion
+#through another procedure counts
+program = ['.text\n','_start:\n','b second\n','first:\n','bl ping\n','mov x8, 93\n','svc 0\n',
+           'second:\n','b first\n',
+           'ping:\n','cbz x0, done\n','sub x0, x0, 1\n','bl pong\n','done:\n','ret\n',
+           'pong:\n','bl ping\n','ret\n',
+           'unused:\n','mov x0, 1\n','ret\n','mov x0, 2\n']
+armsim.parse(program)
+armsim.forbid_loops = True
+armsim.check_static_rules()
+assert armsim.cfg.recursive_labels == {'ping','pong'}, "ping and pong should be recursive, not {}".format(armsim.cfg.recursive_labels)
+armsim.check_dead_code = True
+error = None
+try:
+    armsim.check_static_rules()
+except AssertionError as e:
+    error = str(e)
+assert error is not None, "the code after the ret of unused: should be dead"
+assert 'mov x0, 2' in error, "wrong dead code reported: {}".format(error)
+armsim.check_dead_code = False
+armsim.forbid_recursion = True
+try:
+    armsim.check_static_rules()
+    assert False, "check_static_rules should find recursion through pong"
+except ValueError:
+    #expected
+    armsim.reset()
+
+#recursive_labels only applies to programs that recurse, like in run()
+with open('examples/sort.s','r') as f:
+    armsim.parse(f.readlines())
+armsim.recursive_labels = {'fact'}
+armsim.check_static_rules()
+armsim.run()
+armsim.recursive_labels = set()
+armsim.reset()
+
 #duplicate labels
 with open('examples/collatz.s','r') as f:
     armsim.parse(f.readlines())
@@ -0,0 +1,120 @@
+.text
+.global _start
+
+_start:
+
+main:
+
+    /************************
+     * A test case for the unsigned, carry and overflow
+     * conditions and the conditional select instructions.
+     * Like branch_test.s, the correct exit value is put in 
+     * x0 at the start and any wrong branch exits with 1
+     ************************/
+     
+     mov x0, 7 
+
+     //-1 is the largest unsigned number
+     mov x1, -1
+     cmp x1, 1
+     b.hi L1
+     b bad_exit
+     L1:
+     b.lt L2
+     b bad_exit
+     L2:
+     b.hs L3
+     b bad_exit
+     L3:
+     cmp x0, x1
+     b.lo L4
+     b bad_exit
+     L4:
+     b.ls L5
+     b bad_exit
+     L5:
+     //equal numbers are hs and ls, but not hi or lo
+     cmp x0, 7
+     b.hi bad_exit
+     b.lo bad_exit
+     b.cs L6
+     b bad_exit
+     L6:
+     b.ls L7
+     b bad_exit
+     L7:
+     //-1 + 1 carries out and is zero
+     adds x2, x1, 1
+     b.cc bad_exit
+     b.ne bad_exit
+     b.vs bad_exit
+     //the largest signed number + 1 overflows and is negative
+     mov x3, 0x7fffffffffffffff
+     adds x2, x3, 1
+     b.vc bad_exit
+     b.pl bad_exit
+     b.cs bad_exit
+     //the largest signed number is still greater than -1
+     cmp x3, x1
+     b.le bad_exit
+     //logical instructions clear carry and overflow
+     ands x2, x1, x1
+     b.cs bad_exit
+     b.vs bad_exit
+     b.pl bad_exit
+
+     //conditional select
+     cmp x0, 7
+     cset x4, eq
+     cbz x4, bad_exit
+     cset x4, ne
+     cbnz x4, bad_exit
+     mov x5, 10
+     mov x6, 20
+     csel x4, x5, x6, lo
+     cmp x4, 20
+     b.ne bad_exit
+     cmp x5, x6
+     csinc x4, x5, x6, hs
+     cmp x4, 21
+     b.ne bad_exit
+
+     //the same conditions inside of a loop, so that they are
+     //also run as a compiled block
+     mov x1, 0
+     mov x2, 0
+     L8:
+     add x1, x1, 1
+     cmp x1, x0
+     csinc x2, x2, x2, hi
+     cmp x1, 30
+     b.lo L8
+     //x2 is incremented every time x1 <= 7, so 7 times
+     cmp x2, x0
+     b.ne bad_exit
+     //count down past zero with adds, which carries until it
+     //reaches zero
+     mov x1, 40
+     L9:
+     adds x1, x1, -1
+     b.cs L9
+     cmp x1, -1
+     b.ne bad_exit
+
+/********************
+    * Exit syscall
+    *********************/
+    //x0 should still have 7 in it
+    mov x8, #93
+    svc 0
+     
+     
+     
+     
+bad_exit:
+   /********************
+    * Exit syscall
+    *********************/
+    mov x0, 1
+    mov x8, #93
+    svc 0